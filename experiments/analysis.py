@@ -85,6 +85,22 @@ def perform_analysis(results_df: pd.DataFrame, output_dir: Path):
         else:
              logger.info("Skipping structural similarity plot (no data or column missing).")
 
+        # --- Plot 5: LLM Token Usage per Method (if telemetry available) ---
+        token_columns = [c for c in ('llm_prompt_tokens', 'llm_completion_tokens') if c in results_df.columns]
+        if token_columns:
+            token_totals = results_df.groupby('method')[token_columns].sum().reset_index()
+            token_totals_melted = token_totals.melt(id_vars='method', var_name='token_type', value_name='tokens')
+            plt.figure(figsize=(10, 6))
+            sns.barplot(x='method', y='tokens', hue='token_type', data=token_totals_melted)
+            plt.title('Total LLM Tokens per Method')
+            plt.ylabel('Tokens')
+            plt.xlabel('Method')
+            plt.xticks(rotation=45)
+            plt.tight_layout()
+            plt.savefig(output_dir / "llm_tokens_per_method.png")
+            plt.close()
+            logger.debug("Saved LLM token usage plot.")
+
 
         logger.info("Analysis plots generated successfully.")
 
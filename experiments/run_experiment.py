@@ -2,6 +2,7 @@ import logging
 import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 
@@ -12,25 +13,31 @@ setup_logging() # Load config from default path 'config/logging.yaml'
 from src.utils.file_io import load_yaml, load_text, save_xml, save_json, save_yaml
 from src.nlp.processor import NLProcessor
 from src.kg_query.querier import KGQuerier
-from src.llm_interaction.llm_client import LLMClient
+from src.llm_interaction.router import create_llm_client
+from src.llm_interaction.deadline import deadline_scope
+from src.llm_interaction.telemetry import track_usage
+from src.llm_interaction.prompt_templates import templates_fingerprint
 from src.validation.xsd_validator import load_xsd_schema
 from src.validation.drools_validator import DroolsValidator
+from src.generation_pipeline.pipeline import SingleFlightMemo
 from src.generation_pipeline.generators import (
-    NaiveGenerator, XsdConstrainedGenerator, FullConstrainedGenerator, KgEnhancedGenerator
+    NaiveGenerator, XsdConstrainedGenerator, FullConstrainedGenerator, KgEnhancedGenerator, CascadeGenerator
 )
 from .dataset_loader import load_requirements
 from .metrics_calculator import calculate_metrics
 
 logger = logging.getLogger(__name__)
 
-def get_generator_instance(method_name: str, config: dict, llm_client, kg_querier, xsd_schema, drools_validator):
+def get_generator_instance(method_name: str, config: dict, llm_client, kg_querier, xsd_schema, drools_validator,
+                           initial_memo=None, fast_llm_client=None):
     """Factory function to get generator instance based on method name."""
     common_args = {
         "config": config,
         "llm_client": llm_client,
         "kg_querier": kg_querier,
         "xsd_schema": xsd_schema,
-        "drools_validator": drools_validator
+        "drools_validator": drools_validator,
+        "initial_memo": initial_memo
     }
     if method_name == "baseline1": # Naive
         return NaiveGenerator(**common_args)
@@ -40,6 +47,8 @@ def get_generator_instance(method_name: str, config: dict, llm_client, kg_querie
         return FullConstrainedGenerator(**common_args)
     elif method_name == "proposed": # KG Enhanced
         return KgEnhancedGenerator(**common_args)
+    elif method_name == "cascade": # Full Constrained, fast model first
+        return CascadeGenerator(fast_llm_client=fast_llm_client, **common_args)
     else:
         logger.error(f"Unknown generator method name: {method_name}")
         raise ValueError(f"Unknown generator method name: {method_name}")
@@ -57,18 +66,30 @@ def main(config_path: str):
     paths = config.get("paths", {})
     exp_config = config.get("experiments", {})
     methods_to_run = exp_config.get("methods_to_run", [])
+    requirement_budget_s = exp_config.get("requirement_budget_s") # Wall-clock budget shared by all LLM calls of one generation
+    batch_initial_generation = exp_config.get("batch_initial_generation", False)
+    prompt_templates_version = templates_fingerprint()
 
     # --- 2. Initialize Components ---
     logger.info("Initializing components...")
     # NLP Processor
     nlp_processor = NLProcessor() # Add model config if needed from main config
 
-    # LLM Client
-    llm_client = LLMClient(config.get("llm", {}), config.get("llm_api_keys", {}))
+    # LLM Client (an LLMRouter if llm.endpoints lists several deployments)
+    llm_client = create_llm_client(config.get("llm", {}), config.get("llm_api_keys", {}))
     if not llm_client.client:
          logger.warning("LLM Client failed to initialize. Some generators might not work.")
          # Decide if this is critical - maybe only run methods that don't need LLM?
 
+    # Fast model client (only for the 'cascade' method); an endpoint pool would override the model, so it is not used
+    fast_llm_client = None
+    if "cascade" in methods_to_run:
+        cascade_config = (config.get("generation", {}) or {}).get("cascade") or {}
+        if cascade_config.get("fast_model"):
+            fast_llm_config = {k: v for k, v in config.get("llm", {}).items() if k != "endpoints"}
+            fast_llm_client = create_llm_client({**fast_llm_config, "default_model": cascade_config["fast_model"]},
+                                                config.get("llm_api_keys", {}))
+
     # KG Querier (optional, only needed for 'proposed' method)
     kg_querier = None
     if "proposed" in methods_to_run:
@@ -84,7 +105,7 @@ def main(config_path: str):
     # XSD Schema (optional, needed for methods >= baseline2)
     xsd_schema = None
     xsd_path = paths.get("schemas")
-    if xsd_path and any(m in methods_to_run for m in ["baseline2", "baseline3", "proposed"]):
+    if xsd_path and any(m in methods_to_run for m in ["baseline2", "baseline3", "proposed", "cascade"]):
         xsd_schema = load_xsd_schema(xsd_path)
         if not xsd_schema:
             logger.warning(f"Failed to load XSD schema from {xsd_path}. Generators requiring XSD might fail or skip validation.")
@@ -92,7 +113,7 @@ def main(config_path: str):
     # Drools Validator (optional, needed for methods >= baseline3)
     drools_validator = None
     drools_config = config.get("validation", {}).get("drools")
-    if drools_config and any(m in methods_to_run for m in ["baseline3", "proposed"]):
+    if drools_config and any(m in methods_to_run for m in ["baseline3", "proposed", "cascade"]):
          # Check if endpoint is configured, as our example implementation needs it
          if drools_config.get("endpoint"):
              drools_validator = DroolsValidator(drools_config)
@@ -113,61 +134,105 @@ def main(config_path: str):
     logger.info(f"Loaded {len(requirements_data)} requirements.")
 
     # --- 4. Run Generation for each Method and Requirement ---
-    all_results = []
     output_base_dir = Path(paths.get("generated_xml", "results/generated_xml"))
+    reports_dir = Path(paths.get("reports", "results/reports"))
+    parsed_requirements = {} # req_id -> NLP parse, shared by all methods
 
-    for method in methods_to_run:
-        logger.info(f"--- Running Method: {method} ---")
-        method_output_dir = output_base_dir / method
-        os.makedirs(method_output_dir, exist_ok=True)
+    # Identical initial prompts (e.g. the basic prompt of baseline1-3) are generated once per run
+    # and shared, unless independent samples per method are wanted
+    share_initial = (config.get("generation", {}) or {}).get("share_initial_generations", True)
+    initial_memo = SingleFlightMemo() if share_initial else None
 
+    generators = {}
+    for method in methods_to_run:
         try:
-            generator = get_generator_instance(method, config, llm_client, kg_querier, xsd_schema, drools_validator)
+            generators[method] = get_generator_instance(method, config, llm_client, kg_querier, xsd_schema, drools_validator, initial_memo,
+                                                        fast_llm_client)
         except ValueError:
             continue # Skip if generator couldn't be created
 
+    # Parse every requirement once; the parses are shared by all methods
+    for req_data in requirements_data:
+        parsed_requirements[req_data["id"]] = {**nlp_processor.parse_requirement(req_data["text"]),
+                                               "requirement_id": req_data["id"]} # Few-shot leave-one-out
+
+    if batch_initial_generation and generators:
+        # Submit every initial generation as one offline batch job; the generators then
+        # pick the results up instead of making interactive calls (failed entries fall back).
+        batch_prompts, response_formats = {}, {}
+        seen_prompts = set() # Identical prompts are submitted once when initial generations are shared
         for req_data in requirements_data:
-            req_id = req_data["id"]
-            req_text = req_data["text"]
-            logger.info(f"Processing requirement ID: {req_id} using method: {method}")
+            for method, generator in generators.items():
+                prompt = generator.initial_prompt(req_data["text"], parsed_requirements[req_data["id"]])
+                if prompt and not (share_initial and prompt in seen_prompts):
+                    seen_prompts.add(prompt)
+                    custom_id = f"{req_data['id']}::{method}"
+                    batch_prompts[custom_id] = prompt
+                    if generator.initial_response_format():
+                        response_formats[custom_id] = generator.initial_response_format()
+        job_path = reports_dir / "batch_jobs" / f"initial_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        logger.info(f"Submitting {len(batch_prompts)} initial generations as a batch job: {job_path}")
+        llm_client.generate_batch(batch_prompts, str(job_path), response_formats=response_formats)
+
+    for method in generators:
+        os.makedirs(output_base_dir / method, exist_ok=True)
 
-            # Parse requirement with NLP
-            parsed_req = nlp_processor.parse_requirement(req_text)
+    def run_generation(method: str, req_data: dict) -> dict:
+        """Generates, saves and scores one requirement with one method; returns its result record."""
+        generator = generators[method]
+        req_id = req_data["id"]
+        req_text = req_data["text"]
+        logger.info(f"Processing requirement ID: {req_id} using method: {method}")
+        parsed_req = parsed_requirements[req_id]
 
-            # Generate XML
-            gen_start_time = time.time()
+        # Generate XML (deadline and usage tracking are context-local, so each worker thread has its own)
+        gen_start_time = time.time()
+        with deadline_scope(requirement_budget_s), track_usage() as llm_usage:
             generated_xml, errors = generator.generate(req_text, parsed_req)
-            gen_duration = time.time() - gen_start_time
-
-            output_filename = method_output_dir / f"{req_id}_generated.arxml" # Or .xml
-            if generated_xml:
-                save_xml(generated_xml, output_filename)
-                logger.info(f"Saved generated XML to: {output_filename}")
-            else:
-                logger.error(f"Generation failed for {req_id} with method {method}.")
-                # Save errors maybe?
-                error_file = method_output_dir / f"{req_id}_errors.json"
-                save_json({"errors": errors}, error_file)
-
-
-            # --- 5. Calculate Metrics ---
-            # Metrics calculation might need the ground truth
-            ground_truth_xml = req_data.get("ground_truth_content")
-            metrics = calculate_metrics(generated_xml, ground_truth_xml, errors, xsd_schema, drools_validator)
-
-            result_record = {
-                "requirement_id": req_id,
-                "method": method,
-                "generation_time_s": round(gen_duration, 3),
-                "output_path": str(output_filename) if generated_xml else None,
-                "validation_errors": errors,
-                **metrics # Add calculated metrics here
-            }
-            all_results.append(result_record)
+        gen_duration = time.time() - gen_start_time
+        llm_stats = llm_usage.summary() # Token, latency, TTFT and retry totals over all LLM calls
+        stage_timings = {f"stage_{name}_s": round(seconds, 4) for name, seconds in generator.last_stage_timings.items()}
+
+        output_filename = output_base_dir / method / f"{req_id}_generated.arxml" # Or .xml
+        if generated_xml:
+            save_xml(generated_xml, output_filename)
+            logger.info(f"Saved generated XML to: {output_filename}")
+        else:
+            logger.error(f"Generation failed for {req_id} with method {method}.")
+            # Save errors maybe?
+            error_file = output_base_dir / method / f"{req_id}_errors.json"
+            save_json({"errors": errors}, error_file)
+
+        # --- 5. Calculate Metrics ---
+        # Metrics calculation might need the ground truth
+        ground_truth_xml = req_data.get("ground_truth_content")
+        metrics = calculate_metrics(generated_xml, ground_truth_xml, errors, xsd_schema, drools_validator)
+
+        return {
+            "requirement_id": req_id,
+            "method": method,
+            "prompt_templates_version": prompt_templates_version, # Changes whenever a prompt template is edited
+            "generation_time_s": round(gen_duration, 3),
+            **llm_stats,
+            "non_llm_time_s": round(max(0.0, gen_duration - llm_stats["llm_busy_s"]), 3), # Validation, repair bookkeeping, KG queries
+            **stage_timings, # Wall time per pipeline stage (prompt, llm_generate, precheck, xsd, drools, repair)
+            "repair_stop_reason": generator.last_repair_stop_reason, # Set when the repair policy gave up
+            "model_tier": generator.last_model_tier, # cascade: 'fast' or 'strong'
+            "output_path": str(output_filename) if generated_xml else None,
+            "validation_errors": errors,
+            **metrics # Add calculated metrics here
+        }
+
+    # Requirements x methods run in parallel, at most llm.max_concurrency at a time; results keep method-major order
+    tasks = [(method, req_data) for method in generators for req_data in requirements_data]
+    llm_concurrency = max(1, config.get("llm", {}).get("max_concurrency", 8))
+    max_workers = max(1, min(exp_config.get("max_parallel_generations") or llm_concurrency, llm_concurrency))
+    logger.info(f"Running {len(tasks)} generations ({len(generators)} methods), up to {max_workers} in parallel.")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation") as executor:
+        all_results = list(executor.map(lambda task: run_generation(*task), tasks))
 
     # --- 6. Save Results Summary ---
     results_df = pd.DataFrame(all_results)
-    reports_dir = Path(paths.get("reports", "results/reports"))
     os.makedirs(reports_dir, exist_ok=True)
     summary_file = reports_dir / exp_config.get("output_metrics_file", "metrics_summary.csv")
     try:
@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4 # Same heuristic as src.llm_interaction.rate_limiter
+
+DEFAULT_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<AUTOSAR xmlns="http://autosar.org/schema/r4.0">
+  <AR-PACKAGES>
+    <AR-PACKAGE>
+      <SHORT-NAME>{short_name}</SHORT-NAME>
+    </AR-PACKAGE>
+  </AR-PACKAGES>
+</AUTOSAR>"""
+
+
+class LatencyModel:
+    """
+    Samples response latencies from a distribution given as '<kind>:<params>'.
+
+    Supported: 'fixed:S', 'uniform:LO,HI', 'lognormal:MU,SIGMA' (seconds).
+    """
+
+    def __init__(self, spec: str = "fixed:0", rng: random.Random | None = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return self.rng.uniform(self.params[0], self.params[1])
+        return self.rng.lognormvariate(self.params[0], self.params[1])
+
+
+class StubLLMBackend:
+    """
+    Produces chat-completion payloads for the stub server.
+
+    Answers come from ground truth ARXML files when available: a prompt containing the
+    text of a known requirement gets that requirement's gold file, any other prompt
+    gets a gold file chosen by prompt hash. Without ground truth a templated ARXML
+    document is returned. JSON mode requests (response_format json_object) get the
+    same document in the JSON object model of the JSON output mode.
+    """
+
+    def __init__(self, ground_truth_dir: str | None = None, requirements_dir: str | None = None,
+                 latency: str = "fixed:0", error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, chunk_chars: int = 16, seed: int | None = None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunk_chars = chunk_chars
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self.answers = {} # requirement id -> gold ARXML
+        self.requirement_texts = {} # requirement id -> requirement text
+        if ground_truth_dir:
+            self._load_ground_truth(ground_truth_dir, requirements_dir)
+
+    def _load_ground_truth(self, ground_truth_dir: str, requirements_dir: str | None):
+        """Indexes '<req_id>_gold.arxml' files (and their requirements, if given)."""
+        gt_dir = Path(ground_truth_dir)
+        if not gt_dir.is_dir():
+            logger.warning(f"Ground truth directory not found: {ground_truth_dir}. Using template answers.")
+            return
+        for gold_path in sorted(gt_dir.glob("*_gold.arxml")):
+            req_id = gold_path.name[:-len("_gold.arxml")]
+            self.answers[req_id] = gold_path.read_text(encoding="utf-8").strip()
+        if requirements_dir and Path(requirements_dir).is_dir():
+            from experiments.dataset_loader import load_requirements # Local import: only needed for replay mapping
+            for req in load_requirements(requirements_dir):
+                if req["id"] in self.answers and req["text"]:
+                    self.requirement_texts[req["id"]] = req["text"].strip()
+        logger.info(f"Stub LLM loaded {len(self.answers)} ground truth answers.")
+
+    def choose_answer(self, prompt: str) -> str:
+        """Picks the ARXML to return for a prompt."""
+        for req_id, text in self.requirement_texts.items():
+            if text and text in prompt:
+                return self.answers[req_id]
+        if self.answers:
+            keys = sorted(self.answers)
+            digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+            return self.answers[keys[digest % len(keys)]]
+        short_name = "Pkg_" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return DEFAULT_TEMPLATE.format(short_name=short_name)
+
+    @staticmethod
+    def json_answer(xml_content: str) -> str:
+        """The ARXML answer as a JSON document (as JSON output mode expects from the LLM)."""
+        from src.generation_pipeline.json_output import arxml_to_json # Local import: only needed for JSON mode
+        try:
+            return json.dumps(arxml_to_json(xml_content))
+        except Exception as e:
+            logger.warning(f"Stub answer is not well-formed XML ({e}); returning an empty JSON object.")
+            return "{}"
+
+    def next_fault(self) -> str | None:
+        """Returns '429', '500' or None for this request, according to the configured rates."""
+        with self._lock:
+            self.request_count += 1
+            roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return "429"
+        if roll < self.rate_limit_rate + self.error_rate:
+            return "500"
+        return None
+
+    def completion(self, request: dict) -> tuple[str, str, dict]:
+        """Returns (content, finish_reason, usage) for a chat-completions request body."""
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        content = self.choose_answer(prompt)
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            content = self.json_answer(content)
+        finish_reason = "stop"
+        max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+        if max_tokens and len(content) > max_tokens * CHARS_PER_TOKEN:
+            content = content[:max_tokens * CHARS_PER_TOKEN]
+            finish_reason = "length"
+        usage = {
+            "prompt_tokens": len(prompt) // CHARS_PER_TOKEN + 1,
+            "completion_tokens": len(content) // CHARS_PER_TOKEN + 1,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return content, finish_reason, usage
+
+
+class _ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Implements POST /v1/chat/completions (plain JSON and server-sent events)."""
+
+    server_version = "StubLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("stub-llm: " + format % args)
+
+    def do_POST(self):
+        backend: StubLLMBackend = self.server.backend
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        latency = backend.latency.sample()
+        fault = backend.next_fault()
+        if fault == "429":
+            self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                            headers={"Retry-After": str(backend.retry_after)})
+            return
+        if fault == "500":
+            time.sleep(latency)
+            self._send_json(500, {"error": {"message": "Injected server error (stub)", "type": "server_error"}})
+            return
+
+        content, finish_reason, usage = backend.completion(request)
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        model = request.get("model", "stub-model")
+        if request.get("stream"):
+            self._send_stream(completion_id, model, content, finish_reason, usage, latency, request)
+            return
+
+        time.sleep(latency)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+    def _send_stream(self, completion_id, model, content, finish_reason, usage, latency, request):
+        """Streams the content as SSE chunks, spreading the latency over the chunks."""
+        backend: StubLLMBackend = self.server.backend
+        pieces = [content[i:i + backend.chunk_chars] for i in range(0, len(content), backend.chunk_chars)] or [""]
+        delay = latency / (len(pieces) + 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta: dict, finish: str | None, extra: dict | None = None):
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if extra:
+                payload.update(extra)
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            time.sleep(delay) # Time to first token
+            event({"role": "assistant", "content": ""}, None)
+            for piece in pieces:
+                time.sleep(delay)
+                event({"content": piece}, None)
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            event({}, finish_reason, {"usage": usage} if include_usage else None)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client closed the stream early.")
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubLLMServer:
+    """OpenAI-compatible chat-completions server for offline load and soak testing."""
+
+    def __init__(self, backend: StubLLMBackend, host: str = "127.0.0.1", port: int = 0):
+        self.backend = backend
+        self.httpd = ThreadingHTTPServer((host, port), _ChatCompletionsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.backend = backend
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """Value for llm.base_url in the config."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubLLMServer":
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-llm-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Stub LLM server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in LLM server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ground-truth", default="data/ground_truth/", help="Directory of <req_id>_gold.arxml answers")
+    parser.add_argument("--requirements", default="data/requirements/", help="Requirement files used to map prompts to answers")
+    parser.add_argument("--latency", default="lognormal:-0.5,0.6", help="fixed:S | uniform:LO,HI | lognormal:MU,SIGMA (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--chunk-chars", type=int, default=16, help="Characters per streamed chunk")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stub_backend = StubLLMBackend(
+        ground_truth_dir=args.ground_truth, requirements_dir=args.requirements, latency=args.latency,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        chunk_chars=args.chunk_chars, seed=args.seed
+    )
+    server = StubLLMServer(stub_backend, args.host, args.port)
+    print(f"Set llm.base_url to {server.base_url} (any API key works). Ctrl+C to stop.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
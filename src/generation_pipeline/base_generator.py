@@ -1,12 +1,26 @@
+import asyncio
+import json
 import logging
+import threading
 from abc import ABC, abstractmethod
+from typing import Callable
+
+from src.validation.xsd_content_model import content_model_of
+from src.validation.xsd_validator import validate_xsd
+from .few_shot import DEFAULT_TOP_K, FewShotIndex, get_few_shot_index
+from .json_output import JSON_RESPONSE_FORMAT, ArxmlJsonSerializer, element_key, serializer_of
+from .pipeline import CheckStage, FixStage, GenerationPipeline, SingleFlightMemo, StageCache, run_checks
+from .repair import get_repair_memo
+from .repair_policy import RepairPolicy
+from .xml_recovery import extract_xml_payload, recover_xml
 
 logger = logging.getLogger(__name__)
 
 class BaseGenerator(ABC):
     """Abstract base class for different XML generation strategies."""
 
-    def __init__(self, config: dict, llm_client=None, kg_querier=None, xsd_schema=None, drools_validator=None):
+    def __init__(self, config: dict, llm_client=None, kg_querier=None, xsd_schema=None, drools_validator=None,
+                 initial_memo: SingleFlightMemo | None = None):
         """
         Initializes the base generator.
 
@@ -16,59 +30,304 @@ class BaseGenerator(ABC):
             kg_querier: Instance of KGQuerier.
             xsd_schema: Loaded XSD schema object (e.g., from lxml).
             drools_validator: Instance of DroolsValidator.
+            initial_memo: Run-scoped memo shared by generators so identical initial prompts
+                are sent to the LLM only once (None: every generator samples independently).
         """
         self.config = config
         self.llm_client = llm_client
         self.kg_querier = kg_querier
         self.xsd_schema = xsd_schema
         self.drools_validator = drools_validator
+        self.initial_memo = initial_memo
+        generation_config = config.get("generation", {}) or {}
+        # >1 enables the concurrent first-valid-wins candidate race for the initial generation
+        self.num_candidates = max(1, generation_config.get("num_candidates", 1))
+        # 'slices' sends only the failing subtrees to the LLM for XSD repairs; 'full' resends the document
+        self.repair_mode = generation_config.get("repair_mode", "full")
+        self.parallel_checks = generation_config.get("parallel_checks", False) # Run XSD and Drools concurrently
+        self.auto_repair = generation_config.get("auto_repair", True) # Schema-driven fixes before LLM repairs
+        # Prompt with the XSD-derived mandatory skeleton of the target element instead of asking for a whole document
+        self.skeleton_prompt = generation_config.get("skeleton_prompt", False)
+        # 'json': the LLM returns a compact JSON object model (provider JSON mode), serialized to ARXML locally
+        self.output_format = generation_config.get("output_format", "xml")
+        # Generate the independent elements named by the NLP entities concurrently (KG-enhanced method)
+        self.fragment_generation = generation_config.get("fragment_generation", False)
+        # Attach the most similar solved ground-truth examples to the initial prompt
+        few_shot_config = generation_config.get("few_shot") or {}
+        self.few_shot_k = few_shot_config.get("top_k", DEFAULT_TOP_K)
+        self.few_shot_max_tokens = few_shot_config.get("max_example_tokens", 1500) # Longer examples are skipped
+        self.few_shot_index = self._few_shot_index(config) if few_shot_config.get("enabled", False) else None
+        stage_cache_config = generation_config.get("stage_cache") or {}
+        self.stage_cache = StageCache(stage_cache_config.get("max_entries", 1024)) if stage_cache_config.get("enabled") else None
+        # Known repairs keyed by canonical XML + error signature, shared across generators (and runs, if persisted)
+        self.repair_memo = get_repair_memo(generation_config.get("repair_memo") or {})
+        # How many repair rounds to spend, based on progress and the requirement's time/token budget
+        self.repair_policy = RepairPolicy.from_config(generation_config.get("repair_policy") or {})
+        self._last_run = threading.local() # Per thread, so parallel generate() calls do not mix their last_* results
         logger.info(f"Initializing {self.__class__.__name__}")
 
-    @abstractmethod
     def generate(self, requirement_text: str, parsed_requirement: dict) -> tuple[str | None, list[str]]:
         """
         Generates the AUTOSAR XML based on the input requirement.
 
         Args:
             requirement_text: The original natural language requirement.
-            parsed_requirement: The result from the NLProcessor.
+            parsed_requirement: The result from the NLProcessor, optionally with the
+                'requirement_id' (dataset id), which few-shot retrieval leaves out.
 
         Returns:
             A tuple containing:
             - The generated XML string (or None if generation failed).
             - A list of validation errors encountered (if any).
         """
+        logger.info(f"Running {self.__class__.__name__}...")
+        preflight_errors = self._preflight_errors()
+        if preflight_errors:
+            logger.error(f"{self.__class__.__name__} cannot run: {preflight_errors[0]}")
+            return None, preflight_errors
+
+        ctx = self.build_pipeline().run(requirement_text, parsed_requirement)
+        self._last_run.stage_timings = dict(ctx.timings)
+        self._last_run.repair_stop_reason = ctx.repair_stop_reason
+        self._last_run.model_tier = ctx.model_tier
+        return ctx.xml, ctx.errors
+
+    @property
+    def last_stage_timings(self) -> dict[str, float]:
+        """Stage name -> seconds, for this thread's most recent generate() call."""
+        return getattr(self._last_run, "stage_timings", {})
+
+    @property
+    def last_repair_stop_reason(self) -> str | None:
+        """Why repairs stopped in this thread's most recent generate() call (None if valid)."""
+        return getattr(self._last_run, "repair_stop_reason", None)
+
+    @property
+    def last_model_tier(self) -> str | None:
+        """Cascade tier of this thread's most recent generate() call (None without a cascade)."""
+        return getattr(self._last_run, "model_tier", None)
+
+    @abstractmethod
+    def build_pipeline(self) -> GenerationPipeline:
+        """Composes the stages of this generation method."""
         pass
 
-    def _validate_xml(self, xml_content: str) -> tuple[bool, list[str]]:
-        """Helper method to perform configured validations."""
-        all_errors = []
-        xsd_valid = True
-        drools_valid = True
+    def _preflight_errors(self) -> list[str]:
+        """Errors that prevent this generator from running at all (missing components)."""
+        if not self.llm_client:
+            return ["LLM client not available."]
+        return []
 
-        # 1. XSD Validation (if schema is provided)
+    def check_stages(self) -> list[CheckStage]:
+        """Validation stages used by _validate_xml: XSD (if a schema is loaded), then Drools (if configured)."""
+        checks = []
         if self.xsd_schema:
-            from src.validation.xsd_validator import validate_xsd # Local import
-            xsd_valid, xsd_errors = validate_xsd(xml_content, self.xsd_schema)
-            if not xsd_valid:
-                all_errors.extend(xsd_errors)
-
-        # Only proceed to Drools if XSD is valid (or no XSD check) and Drools is enabled
-        if xsd_valid and self.drools_validator:
-            # Convert XML to the format Drools expects (e.g., facts dict)
-            # This conversion logic might be complex and specific
-            drools_input_data = self._prepare_data_for_drools(xml_content)
-            if drools_input_data is not None:
-                 drools_valid, drools_errors = self.drools_validator.validate_data(drools_input_data)
-                 if not drools_valid:
-                     all_errors.extend(drools_errors)
-            else:
-                 logger.warning("Could not prepare data for Drools validation from XML.")
-                 # Decide if this failure itself constitutes an error
-                 # all_errors.append("Failed to prepare data for Drools validation.")
-
-        is_fully_valid = xsd_valid and drools_valid
-        return is_fully_valid, all_errors
+            checks.append(CheckStage("xsd", self._xsd_errors, self.stage_cache))
+        if self.drools_validator:
+            checks.append(CheckStage("drools", self._drools_errors, self.stage_cache))
+        return checks
+
+    def initial_prompt(self, requirement_text: str, parsed_requirement: dict) -> str:
+        """
+        Returns the prompt used for the first LLM generation of a requirement.
+
+        Exposed so callers (e.g. batch pre-generation in run_experiment) can issue the
+        initial completions ahead of time. With skeleton_prompt or JSON output enabled,
+        the schema-guided prompt is used instead (see _schema_guided_prompt); with
+        few_shot enabled, similar solved examples are attached (see _with_examples).
+        """
+        from src.llm_interaction.prompt_formatter import format_basic_prompt # Local import
+        prompt = self._schema_guided_prompt(requirement_text, parsed_requirement) or format_basic_prompt(requirement_text)
+        return self._with_examples(requirement_text, prompt, parsed_requirement.get("requirement_id"))
+
+    def initial_response_format(self) -> dict | None:
+        """The response_format of the initial completion (JSON mode in JSON output mode, else None)."""
+        return JSON_RESPONSE_FORMAT if self._json_serializer() is not None else None
+
+    @staticmethod
+    def _few_shot_index(config: dict) -> FewShotIndex | None:
+        """The shared ground-truth example index, synced with paths.ground_truth / paths.requirements."""
+        paths = config.get("paths", {}) or {}
+        if not (paths.get("ground_truth") and paths.get("requirements")):
+            logger.warning("Few-shot examples enabled but paths.ground_truth / paths.requirements not set.")
+            return None
+        return get_few_shot_index(paths["ground_truth"], paths["requirements"])
+
+    def _with_examples(self, requirement_text: str, prompt: str, requirement_id: str | None = None) -> str:
+        """
+        Prepends the top-k most similar solved examples to a prompt (unchanged if few-shot is off
+        or nothing similar is indexed). In JSON output mode the examples are shown as JSON.
+
+        The example indexed under requirement_id is left out, so a ground-truth requirement
+        never sees its own gold answer, even if its text differs from the indexed one.
+        """
+        if self.few_shot_index is None:
+            return prompt
+        from src.llm_interaction.prompt_formatter import format_few_shot_prompt # Local import
+        from src.llm_interaction.token_budget import count_tokens # Local import
+        model = self._prompt_budget()["model"]
+        serializer = self._json_serializer()
+        examples = []
+        for example, similarity in self.few_shot_index.query(requirement_text, self.few_shot_k, requirement_id):
+            output = example.xml
+            if serializer is not None:
+                try:
+                    output = json.dumps(serializer.from_xml(example.xml), indent=1)
+                except Exception as e:
+                    logger.warning(f"Few-shot example '{example.example_id}' could not be converted to JSON: {e}")
+                    continue
+            if count_tokens(output, model) > self.few_shot_max_tokens:
+                logger.debug(f"Few-shot example '{example.example_id}' exceeds {self.few_shot_max_tokens} tokens; skipped.")
+                continue
+            logger.debug(f"Few-shot example '{example.example_id}' (similarity {similarity:.2f}).")
+            examples.append({"requirement_text": example.requirement, "output": output})
+        return format_few_shot_prompt(prompt, examples)
+
+    def _prompt_budget(self) -> dict:
+        """
+        max_prompt_tokens / model for the prompt builders, from the clients that may serve the prompt.
+
+        Each client (every endpoint of a router pool) is sized with its own config and
+        model; the tightest budget wins. Without client details, the llm config is used.
+        """
+        from src.llm_interaction.token_budget import prompt_token_budget # Local import
+        budgets = [(prompt_token_budget(config, model), model) for config, model in self._serving_models()]
+        if not budgets:
+            llm_config = self.config.get("llm", {}) or {}
+            return dict(max_prompt_tokens=prompt_token_budget(llm_config), model=llm_config.get("default_model"))
+        max_prompt_tokens, model = min(budgets, key=lambda budget: budget[0])
+        return dict(max_prompt_tokens=max_prompt_tokens, model=model)
+
+    def _serving_models(self) -> list[tuple[dict, str]]:
+        """(llm config, model) of every client that may answer this generator's prompts."""
+        return client_models(self.llm_client)
+
+    def _schema_guided_prompt(self, requirement_text: str, parsed_requirement: dict, kg_context: str | None = None) -> str | None:
+        """
+        JSON-output or skeleton prompt, if enabled and supported by the loaded schema.
+
+        Returns None when neither applies, so the caller falls back to its own prompt.
+        """
+        from src.llm_interaction.prompt_formatter import format_json_prompt, format_skeleton_prompt # Local import
+        budget = self._prompt_budget()
+        skeleton = self._skeleton_for(requirement_text, parsed_requirement)
+        serializer = self._json_serializer()
+        if serializer is not None:
+            skeleton_json = json.dumps(serializer.from_xml(skeleton), indent=1) if skeleton else None
+            document_elements = list(serializer.model.elements)
+            root_key = element_key(document_elements[0]) if len(document_elements) == 1 else None
+            return format_json_prompt(requirement_text, root_key, skeleton_json, kg_context=kg_context, **budget)
+        if skeleton:
+            return format_skeleton_prompt(requirement_text, skeleton, kg_context=kg_context, **budget)
+        return None
+
+    def _json_serializer(self) -> ArxmlJsonSerializer | None:
+        """Serializer for JSON output mode (None if disabled or the schema's content model is unknown)."""
+        if self.output_format != "json" or not self.xsd_schema:
+            return None
+        content_model = content_model_of(self.xsd_schema)
+        return serializer_of(content_model) if content_model is not None else None
+
+    def _skeleton_for(self, requirement_text: str, parsed_requirement: dict) -> str | None:
+        """Mandatory element skeleton for the requirement's target element, if skeleton prompts apply."""
+        if not (self.skeleton_prompt and self.xsd_schema):
+            return None
+        from src.generation_pipeline.skeleton import skeleton_builder_of # Local import
+        content_model = content_model_of(self.xsd_schema)
+        if content_model is None:
+            return None
+        return skeleton_builder_of(content_model).skeleton_for(requirement_text, parsed_requirement)
+
+    def fixer_stages(self) -> list[FixStage]:
+        """Deterministic fixes tried before an LLM repair: XSD content-model auto-repair, if available."""
+        if not (self.auto_repair and self.xsd_schema):
+            return []
+        from src.generation_pipeline.repair import XsdAutoRepairer # Local import
+        content_model = content_model_of(self.xsd_schema)
+        if content_model is None:
+            return []
+        return [FixStage("auto_repair", XsdAutoRepairer(content_model).repair, self.stage_cache)]
+
+    def _validate_xml(self, xml_content: str) -> tuple[bool, list[str]]:
+        """Helper method to perform configured validations (see check_stages)."""
+        return run_checks(self.check_stages(), xml_content, parallel=self.parallel_checks)
+
+    def _xsd_errors(self, xml_content: str) -> list[str]:
+        _, errors = validate_xsd(xml_content, self.xsd_schema)
+        return errors
+
+    def _drools_errors(self, xml_content: str) -> list[str]:
+        # Convert XML to the format Drools expects (e.g., facts dict)
+        # This conversion logic might be complex and specific
+        drools_input_data = self._prepare_data_for_drools(xml_content)
+        if drools_input_data is None:
+            logger.warning("Could not prepare data for Drools validation from XML.")
+            # Decide if this failure itself constitutes an error
+            return []
+        _, drools_errors = self.drools_validator.validate_data(drools_input_data)
+        return drools_errors
+
+    def _generate_initial(self, prompt: str, validate: Callable[[str], tuple[bool, list[str]]]) -> tuple[str | None, list[str] | None]:
+        """
+        Produces the initial XML, racing several candidates if num_candidates > 1.
+
+        Args:
+            prompt: The generation prompt.
+            validate: Validation function applied to each candidate (e.g. XSD only, or XSD + Drools).
+
+        Returns:
+            A tuple (xml, errors). errors is [] if the returned XML already passed
+            validation, and None if it has not been validated yet.
+        """
+        if self.num_candidates <= 1:
+            return self._complete(prompt), None
+        return asyncio.run(self._race_candidates(prompt, validate))
+
+    def _complete(self, prompt: str, llm_client=None) -> str | None:
+        """
+        One initial completion as XML; in JSON output mode the JSON answer is serialized to ARXML.
+
+        llm_client overrides the generator's client (e.g. the fast model of a cascade).
+        """
+        llm_client = llm_client or self.llm_client
+        serializer = self._json_serializer()
+        if serializer is None:
+            return llm_client.generate_text(prompt)
+        response = llm_client.generate_text(prompt, response_format=JSON_RESPONSE_FORMAT)
+        return serializer.parse_response(response) if response else None
+
+    async def _complete_async(self, prompt: str) -> str | None:
+        """Async counterpart of _complete."""
+        serializer = self._json_serializer()
+        if serializer is None:
+            return await self.llm_client.generate_text_async(prompt)
+        response = await self.llm_client.generate_text_async(prompt, response_format=JSON_RESPONSE_FORMAT)
+        return serializer.parse_response(response) if response else None
+
+    async def _race_candidates(self, prompt: str, validate: Callable[[str], tuple[bool, list[str]]]) -> tuple[str | None, list[str] | None]:
+        """Requests num_candidates completions concurrently; the first one that validates wins."""
+        logger.info(f"Racing {self.num_candidates} candidate generations.")
+        tasks = [asyncio.create_task(self._complete_async(prompt)) for _ in range(self.num_candidates)]
+        best_xml, best_errors = None, None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                candidate = await next_done
+                candidate = recover_xml(candidate) if candidate else None
+                if not candidate:
+                    continue
+                is_valid, errors = await asyncio.to_thread(validate, candidate)
+                if is_valid:
+                    logger.info("Candidate passed validation; cancelling outstanding requests.")
+                    return candidate, []
+                if best_errors is None or len(errors) < len(best_errors):
+                    best_xml, best_errors = candidate, errors
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        logger.warning(f"No valid candidate among {self.num_candidates}; continuing with the one with fewest errors.")
+        return best_xml, None
 
     def _prepare_data_for_drools(self, xml_content: str) -> dict | str | None:
         """
@@ -103,6 +362,12 @@ class BaseGenerator(ABC):
             logger.warning("No errors provided for repair attempt.")
             return incorrect_xml # Or None?
 
+        if self.repair_mode == "slices":
+            repaired_xml = self._repair_xml_slices(requirement_text, incorrect_xml, errors)
+            if repaired_xml:
+                return repaired_xml
+            logger.info("Slice repair not applicable; falling back to full-document repair.")
+
         logger.info(f"Attempting LLM-based repair for {len(errors)} errors.")
         from src.llm_interaction.prompt_formatter import format_repair_prompt # Local import
         repair_prompt = format_repair_prompt(requirement_text, incorrect_xml, errors)
@@ -110,11 +375,47 @@ class BaseGenerator(ABC):
 
         if repaired_xml:
             logger.info("Received repaired XML suggestion from LLM.")
-            # Basic check: is it still XML-like?
-            if not (repaired_xml.strip().startswith("<") and repaired_xml.strip().endswith(">")):
-                 logger.warning("LLM repair output doesn't look like XML.")
+            # Basic check: does it contain XML at all? Fences, prose and trivial breakage are recovered before validation
+            if extract_xml_payload(repaired_xml) is None:
+                 logger.warning("LLM repair output doesn't contain XML.")
                  return None # Or return the original incorrect one?
             return repaired_xml
         else:
             logger.error("LLM failed to generate a repair suggestion.")
-            return None
\ No newline at end of file
+            return None
+
+    def _repair_xml_slices(self, requirement_text: str, incorrect_xml: str, errors: list[str]) -> str | None:
+        """
+        Repairs only the failing subtrees located by the XSD errors and splices them back.
+
+        Returns None when slicing does not apply (e.g. errors without line numbers,
+        syntax errors, an error on the root) or the LLM answer cannot be spliced.
+        """
+        from src.generation_pipeline.repair import extract_failing_slices, parse_fragment_response, splice_fragments # Local import
+        from src.llm_interaction.prompt_formatter import format_slice_repair_prompt # Local import
+        sliced = extract_failing_slices(incorrect_xml, errors)
+        if sliced is None:
+            return None
+        root, slices = sliced
+        logger.info(f"Attempting slice repair of {len(slices)} fragments for {len(errors)} errors.")
+        repair_prompt = format_slice_repair_prompt(
+            requirement_text, [{"index": s.index, "path": s.path, "xml": s.xml, "errors": s.errors} for s in slices]
+        )
+        response = self.llm_client.generate_text(repair_prompt)
+        if not response:
+            logger.error("LLM failed to generate a slice repair suggestion.")
+            return None
+        return splice_fragments(root, slices, parse_fragment_response(response),
+                                xml_declaration=incorrect_xml.lstrip().startswith("<?xml"))
+
+
+def client_models(llm_client) -> list[tuple[dict, str]]:
+    """(config, model) per endpoint of an LLMRouter, or of a single LLMClient (empty if unknown, e.g. a mock)."""
+    endpoints = getattr(llm_client, "endpoints", None)
+    clients = [client for _, client, _ in endpoints] if isinstance(endpoints, list) else [llm_client]
+    models = []
+    for client in clients:
+        config, model = getattr(client, "config", None), getattr(client, "model", None)
+        if isinstance(config, dict) and isinstance(model, str):
+            models.append((config, model))
+    return models
@@ -0,0 +1,70 @@
+import logging
+from typing import Callable
+
+from .pipeline import GenerationContext, GenerationPipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DIFFICULTY = 0.5 # Requirements scoring above this go straight to the strong model
+LONG_REQUIREMENT_WORDS = 80 # Requirement length at which the length term saturates
+MANY_ENTITIES = 4 # Entity count at which the entity term saturates
+
+MODEL_TIER_FAST = "fast"
+MODEL_TIER_STRONG = "strong"
+
+
+def requirement_difficulty(requirement_text: str, parsed_requirement: dict) -> float:
+    """
+    Cheap difficulty score in [0, 1] from the requirement length and its NLP entity count.
+
+    A short definition of a single element scores near 0; a long requirement naming
+    several elements scores near 1.
+    """
+    words = len(requirement_text.split())
+    entities = len(parsed_requirement.get("entities", []))
+    length_term = min(1.0, words / LONG_REQUIREMENT_WORDS)
+    entity_term = min(1.0, max(0, entities - 1) / (MANY_ENTITIES - 1))
+    return 0.5 * length_term + 0.5 * entity_term
+
+
+class CascadeStage(Stage):
+    """
+    Build stage trying a fast, cheaper model before the strong one.
+
+    Runs a sub-pipeline with the fast model (local XML recovery, auto-fixes and full
+    validation, but no LLM repair). Its XML is kept only if it validates; otherwise,
+    or when the requirement is too difficult, the stage produces no XML and the
+    following build stages generate with the strong model.
+    """
+    name = "fast_model"
+
+    def __init__(self, fast_pipeline: Callable[[str], GenerationPipeline], max_difficulty: float = DEFAULT_MAX_DIFFICULTY):
+        """
+        Args:
+            fast_pipeline: Prompt -> pipeline generating and validating with the fast model.
+            max_difficulty: Requirements with a higher requirement_difficulty skip the fast model.
+        """
+        super().__init__()
+        self.fast_pipeline = fast_pipeline
+        self.max_difficulty = max_difficulty
+
+    def run(self, ctx: GenerationContext) -> str | None:
+        difficulty = requirement_difficulty(ctx.requirement_text, ctx.parsed_requirement)
+        if difficulty > self.max_difficulty:
+            logger.info(f"Requirement difficulty {difficulty:.2f} > {self.max_difficulty}; using the strong model directly.")
+            return None
+        # The outer pipeline times this stage as a whole ('fast_model'); sub-stage timings would count it twice
+        fast_ctx = self.fast_pipeline(ctx.prompt).run(ctx.requirement_text, ctx.parsed_requirement)
+        if fast_ctx.xml is None or fast_ctx.errors:
+            logger.info(f"Fast model output failed validation ({len(fast_ctx.errors)} errors); escalating to the strong model.")
+            return None
+        logger.info("Fast model output passed validation.")
+        return fast_ctx.xml
+
+    def apply(self, ctx: GenerationContext, result: str | None):
+        if result:
+            ctx.xml = result
+            ctx.validated = True
+            ctx.model_tier = MODEL_TIER_FAST
+        else:
+            ctx.model_tier = MODEL_TIER_STRONG
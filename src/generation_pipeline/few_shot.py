@@ -0,0 +1,206 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+
+from src.utils.file_io import load_json, load_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 2 # Examples attached to a prompt
+GOLD_SUFFIX = "_gold.arxml" # req_001.txt <-> req_001_gold.arxml (same convention as the dataset loader)
+REQUIREMENT_SUFFIXES = (".txt", ".json")
+
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_CAMEL_PART_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+_shared_indexes = {}
+_shared_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class FewShotExample:
+    """A solved requirement: its text and the gold ARXML."""
+    example_id: str
+    requirement: str
+    xml: str
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased terms; CamelCase words also contribute their parts ('VehicleSpeed' -> vehiclespeed, vehicle, speed)."""
+    terms = []
+    for word in _WORD_RE.findall(text):
+        terms.append(word.lower())
+        parts = _CAMEL_PART_RE.findall(word)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts)
+    return [term for term in terms if len(term) > 1]
+
+
+class FewShotIndex:
+    """
+    TF-IDF similarity index over solved examples, held in NumPy arrays.
+
+    Raw term counts are kept per example, so examples can be added, replaced or
+    removed one at a time; the IDF-weighted, L2-normalized matrix is rebuilt lazily
+    on the first query after a change. A query only reads the matrix columns of its
+    own terms, which keeps lookups well below a millisecond for a corpus of
+    ground-truth size.
+    """
+
+    def __init__(self):
+        self.examples = [] # Row -> FewShotExample
+        self._rows = {} # Example id -> row
+        self._vocab = {} # Term -> column
+        self._counts = np.zeros((0, 0), dtype=np.float32)
+        self._weights = None # Normalized TF-IDF matrix (None: stale)
+        self._idf = None
+        self._sources = {} # Example id -> (gold mtime, requirement mtime) at the last sync
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def add(self, example: FewShotExample):
+        """Indexes an example, replacing an earlier one with the same id."""
+        terms = tokenize(example.requirement)
+        with self._lock:
+            for term in terms:
+                if term not in self._vocab:
+                    self._vocab[term] = len(self._vocab)
+            rows, columns = self._counts.shape
+            if len(self._vocab) > columns:
+                self._counts = np.pad(self._counts, ((0, 0), (0, len(self._vocab) - columns)))
+            row = self._rows.get(example.example_id)
+            if row is None:
+                row = rows
+                self._counts = np.pad(self._counts, ((0, 1), (0, 0)))
+                self._rows[example.example_id] = row
+                self.examples.append(example)
+            else:
+                self._counts[row] = 0
+                self.examples[row] = example
+            for term in terms:
+                self._counts[row, self._vocab[term]] += 1
+            self._weights = None
+
+    def remove(self, example_id: str):
+        """Drops an example from the index (no-op for unknown ids)."""
+        with self._lock:
+            row = self._rows.pop(example_id, None)
+            if row is None:
+                return
+            self._counts = np.delete(self._counts, row, axis=0)
+            del self.examples[row]
+            self._rows = {example.example_id: index for index, example in enumerate(self.examples)}
+            self._sources.pop(example_id, None)
+            self._weights = None
+
+    def query(self, text: str, top_k: int = DEFAULT_TOP_K, exclude_id: str | None = None) -> list[tuple[FewShotExample, float]]:
+        """
+        The top_k examples most similar to a requirement (cosine similarity of TF-IDF vectors).
+
+        Examples with no shared term, the example `exclude_id` (leave-one-out: the
+        requirement being generated) and the requirement itself (identical text) are
+        never returned, so a ground-truth requirement does not retrieve its own solution.
+
+        Returns:
+            (example, similarity) pairs, most similar first.
+        """
+        terms = {}
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + 1
+        with self._lock:
+            columns = [self._vocab[t] for t in terms if t in self._vocab]
+            if not columns or not self.examples: # Removed examples leave their terms in the vocabulary
+                return []
+            weights, idf = self._matrix()
+            query = np.log1p(np.array([terms[t] for t in terms if t in self._vocab], dtype=np.float32)) * idf[columns]
+            scores = weights[:, columns] @ (query / np.linalg.norm(query))
+            examples = self.examples
+        normalized = " ".join(text.split())
+        count = min(len(scores), top_k + 2) # Spares for a skipped excluded id and self-match
+        best = np.argpartition(-scores, count - 1)[:count]
+        results = []
+        for row in best[np.argsort(-scores[best])]:
+            if scores[row] > 0 and examples[row].example_id != exclude_id \
+                    and " ".join(examples[row].requirement.split()) != normalized:
+                results.append((examples[row], float(scores[row])))
+        return results[:top_k]
+
+    def sync_directory(self, ground_truth_dir: str | Path, requirements_dir: str | Path) -> int:
+        """
+        Brings the index in line with the *_gold.arxml files and their requirement files.
+
+        Only examples that are new or whose files changed since the last sync are read
+        and indexed; examples whose gold file disappeared are removed.
+
+        Returns:
+            The number of examples (re)indexed.
+        """
+        ground_truth_dir, requirements_dir = Path(ground_truth_dir), Path(requirements_dir)
+        if not ground_truth_dir.is_dir():
+            logger.warning(f"Ground truth directory not found: {ground_truth_dir}. Few-shot index is empty.")
+            return 0
+        seen, indexed = set(), 0
+        for gold_path in sorted(ground_truth_dir.glob(f"*{GOLD_SUFFIX}")):
+            example_id = gold_path.name[:-len(GOLD_SUFFIX)]
+            requirement_path = next((requirements_dir / f"{example_id}{suffix}" for suffix in REQUIREMENT_SUFFIXES
+                                     if (requirements_dir / f"{example_id}{suffix}").is_file()), None)
+            if requirement_path is None:
+                logger.debug(f"No requirement file for ground truth '{gold_path.name}'; not indexed.")
+                continue
+            seen.add(example_id)
+            stamp = (gold_path.stat().st_mtime_ns, requirement_path.stat().st_mtime_ns)
+            with self._lock:
+                if self._sources.get(example_id) == stamp:
+                    continue
+            requirement, xml = _load_requirement(requirement_path), load_text(gold_path)
+            if not requirement or not xml:
+                continue
+            self.add(FewShotExample(example_id, requirement, xml))
+            with self._lock:
+                self._sources[example_id] = stamp
+            indexed += 1
+        with self._lock:
+            removed = [e for e in self._sources if e not in seen]
+        for example_id in removed:
+            self.remove(example_id)
+        if indexed:
+            logger.info(f"Few-shot index: {indexed} examples (re)indexed, {len(self)} in total.")
+        return indexed
+
+    def _matrix(self) -> tuple[np.ndarray, np.ndarray]:
+        """The normalized TF-IDF matrix and the IDF vector, rebuilt if examples changed (caller holds the lock)."""
+        if self._weights is None:
+            documents = max(1, self._counts.shape[0])
+            document_frequency = (self._counts > 0).sum(axis=0)
+            self._idf = (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(np.float32)
+            weights = np.log1p(self._counts) * self._idf
+            norms = np.linalg.norm(weights, axis=1, keepdims=True)
+            self._weights = weights / np.where(norms > 0, norms, 1)
+        return self._weights, self._idf
+
+
+def _load_requirement(path: Path) -> str | None:
+    if path.suffix == ".json":
+        data = load_json(path)
+        return data.get("requirement") if isinstance(data, dict) else None
+    return load_text(path)
+
+
+def get_few_shot_index(ground_truth_dir: str, requirements_dir: str) -> FewShotIndex:
+    """
+    Returns the process-wide index for a ground-truth directory, shared by all generators.
+
+    Every call syncs the index with the directory, which re-reads only new or changed examples.
+    """
+    key = (str(ground_truth_dir), str(requirements_dir))
+    with _shared_lock:
+        index = _shared_indexes.get(key)
+        if index is None:
+            index = _shared_indexes[key] = FewShotIndex()
+        index.sync_directory(ground_truth_dir, requirements_dir)
+    return index
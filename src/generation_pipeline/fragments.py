@@ -0,0 +1,225 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+from lxml import etree
+
+from src.validation.xsd_content_model import XsdContentModel
+from .pipeline import GenerationContext, Stage
+from .repair import parse_error_location
+from .skeleton import LEAF_PLACEHOLDER, element_name_candidates, skeleton_builder_of
+from .xml_recovery import diagnose_xml, recover_xml
+
+logger = logging.getLogger(__name__)
+
+MIN_FRAGMENTS = 2 # A requirement with fewer independent elements is generated in one completion
+
+_START_MARKER = "fragment-start"
+_END_MARKER = "fragment-end"
+
+
+@dataclass(frozen=True)
+class FragmentSpec:
+    """One independently generated element of a requirement."""
+    element: str # XSD element name, e.g. 'I-SIGNAL'
+    name: str # Instance name (SHORT-NAME) taken from the entity text
+    entity: tuple # The NLProcessor entity it came from
+
+
+def plan_fragments(content_model: XsdContentModel, parsed_requirement: dict,
+                   min_fragments: int = MIN_FRAGMENTS) -> list[FragmentSpec] | None:
+    """
+    Splits a requirement into independent element generations.
+
+    Every (text, label) entity whose label names a complex schema element below the
+    document element (e.g. ('VehicleSpeed', 'ISignal')) becomes one fragment.
+
+    Returns:
+        The fragments, or None if fewer than `min_fragments` were found.
+    """
+    builder = skeleton_builder_of(content_model)
+    specs = []
+    for entity in parsed_requirement.get("entities", []):
+        if not isinstance(entity, (list, tuple)) or len(entity) < 2:
+            continue
+        text, label = str(entity[0]).strip(), str(entity[1])
+        element = next((n for n in element_name_candidates(label) if builder.is_complex(n)), None)
+        if not text or element is None:
+            continue
+        path = builder.path(element)
+        spec = FragmentSpec(element, text, tuple(entity))
+        if path is not None and len(path) > 1 and spec not in specs:
+            specs.append(spec)
+    return specs if len(specs) >= min_fragments else None
+
+
+class FragmentAssembler:
+    """
+    Validates single-element fragments and merges them into one document.
+
+    The document frame (e.g. AUTOSAR/AR-PACKAGES/AR-PACKAGE/ELEMENTS) comes from the
+    schema skeleton; its mandatory SHORT-NAMEs are derived from the element names.
+    Elements on the path that already exist are shared, so fragments of one package
+    end up in the same AR-PACKAGE.
+    """
+
+    def __init__(self, content_model: XsdContentModel):
+        self.model = content_model
+        self.skeletons = skeleton_builder_of(content_model)
+
+    def fragment_skeleton(self, spec: FragmentSpec) -> str | None:
+        """Mandatory structure of the fragment's element, with its SHORT-NAME filled in."""
+        tree = self.skeletons.skeleton_tree(spec.element)
+        if tree is None:
+            return None
+        _, target = tree
+        short_name = self._child(target, "SHORT-NAME")
+        if short_name is not None:
+            short_name.text = spec.name
+        return etree.tostring(target, pretty_print=True, encoding="unicode")
+
+    def extract(self, response: str | None, element: str) -> str | None:
+        """The `element` fragment from an LLM answer (fences, wrappers and namespaces normalized)."""
+        if not response:
+            return None
+        xml = recover_xml(response)
+        if xml is None:
+            logger.warning(f"Fragment <{element}> is not well-formed XML: {diagnose_xml(response).message}")
+            return None
+        root = etree.fromstring(xml.encode("utf-8"))
+        found = next((node for node in root.iter() if isinstance(node.tag, str) and etree.QName(node).localname == element), None)
+        if found is None:
+            logger.warning(f"LLM answer does not contain a <{element}> element.")
+            return None
+        fragment = etree.fromstring(etree.tostring(found))
+        fragment.tail = None
+        for node in fragment.iter():
+            if isinstance(node.tag, str):
+                name = etree.QName(node).localname
+                node.tag = self.model.instance_tag(name, self.model.global_element(name))
+        etree.cleanup_namespaces(fragment)
+        return etree.tostring(fragment, encoding="unicode")
+
+    def fragment_errors(self, fragment_xml: str, element: str, check: Callable[[str], list[str]]) -> list[str]:
+        """
+        Validates a fragment against its type by placing it in the schema skeleton.
+
+        Only errors located inside the fragment are returned; errors in the frame
+        (which still holds placeholders) are not the fragment's concern.
+        """
+        root, target = self.skeletons.skeleton_tree(element)
+        fragment = etree.fromstring(fragment_xml.encode("utf-8"))
+        target.getparent().replace(target, fragment)
+        fragment.addprevious(etree.Comment(_START_MARKER))
+        fragment.addnext(etree.Comment(_END_MARKER))
+        self._name_frame(root)
+        etree.indent(root)
+        document = etree.tostring(root, encoding="unicode")
+        lines = document.splitlines()
+        start = next(i for i, line in enumerate(lines, 1) if _START_MARKER in line)
+        end = next(i for i, line in enumerate(lines, 1) if _END_MARKER in line)
+        errors = []
+        for error in check(document):
+            location = parse_error_location(error)
+            if location is None or start < location[0] < end:
+                errors.append(error)
+        return errors
+
+    def merge(self, fragments: list[tuple[FragmentSpec, str]]) -> str | None:
+        """Places all fragments into one document; None if a fragment has no place in it."""
+        root, target = self.skeletons.skeleton_tree(fragments[0][0].element)
+        target.getparent().remove(target)
+        for spec, fragment_xml in fragments:
+            container = self._container_for(root, spec.element)
+            if container is None:
+                logger.warning(f"No place for <{spec.element}> '{spec.name}' in the merged document.")
+                return None
+            parent, declaration = container
+            parent.append(etree.fromstring(fragment_xml.encode("utf-8")))
+            self._order_children(parent, declaration)
+        self._name_frame(root)
+        etree.indent(root)
+        logger.info(f"Merged {len(fragments)} fragments into one document.")
+        return etree.tostring(root, encoding="unicode")
+
+    def _container_for(self, root: etree._Element, element: str) -> tuple[etree._Element, etree._Element] | None:
+        """Parent element (and its declaration) for a fragment, creating missing path elements."""
+        path = self.skeletons.path(element)
+        if path is None or path[0].get("name") != etree.QName(root).localname:
+            return None
+        node = root
+        for parent_decl, declaration in zip(path[:-2], path[1:-1]):
+            child = self._child(node, declaration.get("name"))
+            if child is None:
+                child = etree.SubElement(node, self.model.instance_tag(declaration.get("name"), declaration))
+                self.skeletons.fill(child, declaration)
+                self._order_children(node, parent_decl)
+            node = child
+        return node, path[-2]
+
+    def _order_children(self, element: etree._Element, declaration: etree._Element):
+        model = self.model.model_for(declaration)
+        if model is None:
+            return
+        children = sorted(element, key=lambda c: model.position(etree.QName(c).localname) if isinstance(c.tag, str) else -1)
+        for child in children:
+            element.append(child) # Re-appending moves the child; sorted() keeps repeated elements in order
+
+    def _name_frame(self, root: etree._Element):
+        """Replaces SHORT-NAME placeholders of frame elements by names derived from their element names."""
+        for short_name in root.iter():
+            if isinstance(short_name.tag, str) and etree.QName(short_name).localname == "SHORT-NAME" \
+                    and short_name.text == LEAF_PLACEHOLDER:
+                owner = etree.QName(short_name.getparent()).localname
+                short_name.text = "".join(part.capitalize() for part in owner.split("-"))
+
+    @staticmethod
+    def _child(element: etree._Element, name: str) -> etree._Element | None:
+        return next((c for c in element if isinstance(c.tag, str) and etree.QName(c).localname == name), None)
+
+
+class FragmentStage(Stage):
+    """
+    Build stage generating the independent elements of a requirement concurrently.
+
+    Produces no XML (so the following build stages run the monolithic generation)
+    when the requirement does not decompose or a fragment could not be generated.
+    """
+    name = "fragments"
+
+    def __init__(self, plan: Callable[[dict], list[FragmentSpec] | None],
+                 generate_fragment: Callable[[str, FragmentSpec], str | None],
+                 merge: Callable[[list[tuple[FragmentSpec, str]]], str | None], max_workers: int = 8):
+        """
+        Args:
+            plan: Parsed requirement -> fragments (None if it does not decompose).
+            generate_fragment: (requirement_text, fragment) -> validated (or best-effort) fragment XML.
+            merge: Combines the fragments into one document.
+            max_workers: Fragments generated at the same time.
+        """
+        super().__init__()
+        self.plan = plan
+        self.generate_fragment = generate_fragment
+        self.merge = merge
+        self.max_workers = max_workers
+
+    def run(self, ctx: GenerationContext) -> str | None:
+        specs = self.plan(ctx.parsed_requirement)
+        if not specs:
+            return None
+        logger.info(f"Generating {len(specs)} fragments concurrently: {[f'{s.element}[{s.name}]' for s in specs]}")
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(specs))), thread_name_prefix="fragment") as executor:
+            # Each fragment runs in a copy of the caller's context, so deadlines and telemetry follow it
+            futures = [executor.submit(contextvars.copy_context().run, self.generate_fragment, ctx.requirement_text, spec)
+                       for spec in specs]
+            fragments = [future.result() for future in futures]
+        failed = [spec.name for spec, xml in zip(specs, fragments) if not xml]
+        if failed:
+            logger.warning(f"Fragment generation failed for {failed}; falling back to a single completion.")
+            return None
+        return self.merge(list(zip(specs, fragments)))
+
+    def apply(self, ctx: GenerationContext, result: str | None):
+        if result:
+            ctx.xml = result
@@ -1,218 +1,141 @@
 import logging
-from .base_generator import BaseGenerator
-from src.llm_interaction.prompt_formatter import format_basic_prompt, format_kg_enhanced_prompt
-from src.validation.xsd_validator import validate_xsd # Direct import for XSD-specific generator
+from .base_generator import BaseGenerator, client_models
+from .cascade import DEFAULT_MAX_DIFFICULTY, CascadeStage
+from .fragments import FragmentAssembler, FragmentSpec, FragmentStage, plan_fragments
+from .repair import RepairMemo, strip_error_position
+from .pipeline import GenerateStage, GenerationPipeline, PromptStage, RepairStage, StructureCheck, XmlRecoveryStage
+from src.llm_interaction.prompt_formatter import (
+    format_basic_prompt, format_fragment_prompt, format_kg_enhanced_prompt, format_repair_prompt
+)
+from src.llm_interaction.prompt_templates import templates_fingerprint
+from src.validation.xsd_content_model import content_model_of
 
 logger = logging.getLogger(__name__)
 
-MAX_REPAIR_ATTEMPTS = 2 # Configurable: How many times to try repairing
+REPAIR_TEMPLATES = ["repair", "slice_repair", "slice_repair_fragment"] # Prompt templates a memoized repair depends on
 
 class NaiveGenerator(BaseGenerator):
     """Baseline 1: Generates XML using only the LLM with a basic prompt."""
 
-    def generate(self, requirement_text: str, parsed_requirement: dict) -> tuple[str | None, list[str]]:
-        logger.info("Running NaiveGenerator...")
-        if not self.llm_client:
-            logger.error("LLM client not configured for NaiveGenerator.")
-            return None, ["LLM client not available."]
-
-        prompt = format_basic_prompt(requirement_text)
-        generated_xml = self.llm_client.generate_text(prompt)
-
-        if not generated_xml:
-            logger.error("LLM failed to generate any output.")
-            return None, ["LLM generation failed."]
-
-        # Basic check if it looks like XML
-        if not (generated_xml.strip().startswith("<") and generated_xml.strip().endswith(">")):
-             logger.warning("LLM output doesn't look like XML.")
-             return None, ["LLM output is not valid XML structure."]
-
-        logger.info("Naive generation complete.")
-        # No validation performed in this baseline
-        return generated_xml, []
+    def build_pipeline(self) -> GenerationPipeline:
+        # No validation performed in this baseline; output that is not well-formed XML (after local recovery) is discarded
+        return GenerationPipeline(
+            name="NaiveGenerator",
+            build=[
+                PromptStage(self.initial_prompt),
+                GenerateStage(lambda prompt: (self.llm_client.generate_text(prompt), None), "LLM generation failed.",
+                              cache=self.initial_memo),
+            ],
+            prechecks=[StructureCheck()],
+            discard_invalid=True,
+            normalizers=[XmlRecoveryStage()],
+        )
+
+    def initial_prompt(self, requirement_text: str, parsed_requirement: dict) -> str:
+        """Always the basic prompt: this baseline gets no schema-derived skeleton or few-shot examples."""
+        return format_basic_prompt(requirement_text)
 
 
 class XsdConstrainedGenerator(BaseGenerator):
     """Baseline 2: LLM generation followed by XSD validation and optional repair."""
 
-    def generate(self, requirement_text: str, parsed_requirement: dict) -> tuple[str | None, list[str]]:
-        logger.info("Running XsdConstrainedGenerator...")
-        if not self.llm_client:
-            logger.error("LLM client not configured.")
-            return None, ["LLM client not available."]
+    def _preflight_errors(self) -> list[str]:
         if not self.xsd_schema:
-             logger.error("XSD schema not provided for validation.")
-             return None, ["XSD schema not available."]
-
-        prompt = format_basic_prompt(requirement_text) # Start with basic prompt
-        current_xml = self.llm_client.generate_text(prompt)
-        final_errors = ["Initial LLM generation failed."] # Default error
-
-        if not current_xml:
-            logger.error("Initial LLM generation failed.")
-            return None, final_errors
-
-        for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
-            logger.info(f"Validation attempt {attempt + 1}/{MAX_REPAIR_ATTEMPTS + 1}")
-
-            # Basic XML structure check before validation
-            if not (current_xml.strip().startswith("<") and current_xml.strip().endswith(">")):
-                final_errors = ["LLM output is not valid XML structure."]
-                logger.warning(final_errors[0])
-                if attempt >= MAX_REPAIR_ATTEMPTS: break # Stop if structure is bad and no more repairs
-                 # Try to repair even if structure is bad? Maybe not useful.
-                current_xml = self._repair_xml(requirement_text, current_xml, final_errors)
-                if not current_xml: break # Repair failed
-                continue # Retry validation with repaired XML
-
-
-            is_valid, errors = validate_xsd(current_xml, self.xsd_schema)
-            final_errors = errors # Store errors from this attempt
-
-            if is_valid:
-                logger.info("XSD validation successful.")
-                return current_xml, [] # Success
-            else:
-                logger.warning(f"XSD validation failed with {len(errors)} errors.")
-                if attempt < MAX_REPAIR_ATTEMPTS:
-                    repaired_xml = self._repair_xml(requirement_text, current_xml, errors)
-                    if repaired_xml:
-                        current_xml = repaired_xml
-                    else:
-                        logger.error("Repair attempt failed. Stopping.")
-                        break # Stop if repair fails
-                else:
-                    logger.error("Max repair attempts reached. Returning last invalid XML with errors.")
-                    break # Stop after max attempts
-
-        # If loop finishes without returning success
-        return current_xml, final_errors # Return the last generated (possibly invalid) XML and its errors
+            return super()._preflight_errors() or ["XSD schema not available."]
+        return super()._preflight_errors()
+
+    def check_stages(self):
+        return [check for check in super().check_stages() if check.name == "xsd"] # XSD only, even if Drools is configured
+
+    def build_pipeline(self) -> GenerationPipeline:
+        return _validated_pipeline(self, "XsdConstrainedGenerator", "Initial LLM generation failed.")
 
 
 class FullConstrainedGenerator(BaseGenerator):
     """Baseline 3: LLM + XSD Validation + Drools Validation + Repair."""
 
-    def generate(self, requirement_text: str, parsed_requirement: dict) -> tuple[str | None, list[str]]:
-        logger.info("Running FullConstrainedGenerator...")
-        if not self.llm_client:
-            logger.error("LLM client not configured.")
-            return None, ["LLM client not available."]
+    def build_pipeline(self) -> GenerationPipeline:
         if not self.xsd_schema:
-             logger.warning("XSD schema not provided. Skipping XSD checks.")
-             # Allow proceeding without XSD if needed, but log warning
-             # return None, ["XSD schema not available."]
+            logger.warning("XSD schema not provided. Skipping XSD checks.")
         if not self.drools_validator:
-             logger.warning("Drools validator not configured. Skipping Drools checks.")
-             # Allow proceeding without Drools if needed, but log warning
-             # return None, ["Drools validator not available."]
-
-
-        prompt = format_basic_prompt(requirement_text) # Start with basic prompt
-        current_xml = self.llm_client.generate_text(prompt)
-        final_errors = ["Initial LLM generation failed."]
-
-        if not current_xml:
-            logger.error("Initial LLM generation failed.")
-            return None, final_errors
-
-        for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
-            logger.info(f"Validation attempt {attempt + 1}/{MAX_REPAIR_ATTEMPTS + 1}")
-
-            # Basic XML structure check
-            if not (current_xml.strip().startswith("<") and current_xml.strip().endswith(">")):
-                final_errors = ["LLM output is not valid XML structure."]
-                logger.warning(final_errors[0])
-                if attempt >= MAX_REPAIR_ATTEMPTS: break
-                current_xml = self._repair_xml(requirement_text, current_xml, final_errors)
-                if not current_xml: break
-                continue
-
-            # Use the combined validation method from BaseGenerator
-            is_valid, errors = self._validate_xml(current_xml)
-            final_errors = errors
-
-            if is_valid:
-                logger.info("Full validation (XSD + Drools) successful.")
-                return current_xml, [] # Success
-            else:
-                logger.warning(f"Full validation failed with {len(errors)} errors.")
-                if attempt < MAX_REPAIR_ATTEMPTS:
-                    repaired_xml = self._repair_xml(requirement_text, current_xml, errors)
-                    if repaired_xml:
-                        current_xml = repaired_xml
-                    else:
-                        logger.error("Repair attempt failed. Stopping.")
-                        break
-                else:
-                    logger.error("Max repair attempts reached. Returning last invalid XML with errors.")
-                    break
-
-        return current_xml, final_errors
+            logger.warning("Drools validator not configured. Skipping Drools checks.")
+        return _validated_pipeline(self, "FullConstrainedGenerator", "Initial LLM generation failed.")
 
 
 class KgEnhancedGenerator(BaseGenerator):
     """Proposed Method: Uses KG Queries to enhance the prompt, then full validation + repair."""
 
-    def generate(self, requirement_text: str, parsed_requirement: dict) -> tuple[str | None, list[str]]:
-        logger.info("Running KgEnhancedGenerator...")
-        if not self.llm_client:
-            logger.error("LLM client not configured.")
-            return None, ["LLM client not available."]
+    def _preflight_errors(self) -> list[str]:
         if not self.kg_querier:
-            logger.error("KG Querier not configured.")
             # Decide: Fallback to FullConstrained or fail? Let's fail for now.
-            return None, ["KG Querier not available."]
-        # XSD/Drools checks are optional but recommended, handled by _validate_xml
+            return super()._preflight_errors() or ["KG Querier not available."]
+        return super()._preflight_errors()
 
-        # --- 1. Query Knowledge Graph ---
+    def build_pipeline(self) -> GenerationPipeline:
+        # XSD/Drools checks are optional but recommended, handled by _validate_xml
+        pipeline = _validated_pipeline(self, "KgEnhancedGenerator", "Initial LLM generation failed (KG enhanced).")
+        fragment_stage = self._fragment_stage()
+        if fragment_stage is not None:
+            pipeline.build.insert(0, fragment_stage) # Multi-element requirements skip the single completion
+        return pipeline
+
+    def _fragment_stage(self) -> FragmentStage | None:
+        """Concurrent per-element generation, if enabled and the schema's content model is known."""
+        if not (self.fragment_generation and self.xsd_schema):
+            return None
+        content_model = content_model_of(self.xsd_schema)
+        if content_model is None:
+            return None
+        assembler = FragmentAssembler(content_model)
+        return FragmentStage(
+            lambda parsed: plan_fragments(content_model, parsed),
+            lambda requirement_text, spec: self._generate_fragment(assembler, requirement_text, spec),
+            assembler.merge,
+            max_workers=(self.config.get("llm", {}) or {}).get("max_concurrency", 8),
+        )
+
+    def _generate_fragment(self, assembler: FragmentAssembler, requirement_text: str, spec: FragmentSpec) -> str | None:
+        """Generates one fragment and validates / repairs it on its own (XSD only; Drools runs on the merged XML)."""
+        def validate(fragment_xml: str) -> tuple[bool, list[str]]:
+            errors = assembler.fragment_errors(fragment_xml, spec.element, self._xsd_errors)
+            return not errors, errors
+
+        def repair(requirement: str, fragment_xml: str, errors: list[str]) -> str | None:
+            prompt = format_repair_prompt(requirement, fragment_xml, [strip_error_position(e) for e in errors])
+            return assembler.extract(self.llm_client.generate_text(prompt), spec.element)
+
+        pipeline = GenerationPipeline(
+            name=f"Fragment {spec.element}[{spec.name}]",
+            build=[
+                PromptStage(lambda requirement, _: self._fragment_prompt(assembler, requirement, spec)),
+                GenerateStage(lambda prompt: (assembler.extract(self.llm_client.generate_text(prompt), spec.element), None),
+                              f"Generation of fragment '{spec.name}' failed."),
+            ],
+            validator=validate,
+            repair=RepairStage(repair),
+            repair_policy=self.repair_policy,
+        )
+        return pipeline.run(requirement_text, {"entities": [spec.entity]}).xml
+
+    def _fragment_prompt(self, assembler: FragmentAssembler, requirement_text: str, spec: FragmentSpec) -> str:
+        kg_context = self._query_kg_for_context({"entities": [spec.entity]})
+        return format_fragment_prompt(
+            requirement_text, spec.element, spec.name, assembler.fragment_skeleton(spec), kg_context=kg_context,
+            **self._prompt_budget()
+        )
+
+    def initial_prompt(self, requirement_text: str, parsed_requirement: dict) -> str:
+        """
+        Builds the KG-enhanced prompt (queries the KG for context); schema-guided prompts carry the context too.
+        Few-shot examples are attached to either.
+        """
         kg_context = self._query_kg_for_context(parsed_requirement)
-
-        # --- 2. Format Prompt with KG Context ---
-        prompt = format_kg_enhanced_prompt(requirement_text, kg_context)
-
-        # --- 3. Generate Initial XML ---
-        current_xml = self.llm_client.generate_text(prompt)
-        final_errors = ["Initial LLM generation failed (KG enhanced)."]
-
-        if not current_xml:
-            logger.error("Initial LLM generation failed.")
-            return None, final_errors
-
-        # --- 4. Validate and Repair Loop (using BaseGenerator's methods) ---
-        for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
-            logger.info(f"Validation attempt {attempt + 1}/{MAX_REPAIR_ATTEMPTS + 1}")
-
-            # Basic XML structure check
-            if not (current_xml.strip().startswith("<") and current_xml.strip().endswith(">")):
-                final_errors = ["LLM output is not valid XML structure."]
-                logger.warning(final_errors[0])
-                if attempt >= MAX_REPAIR_ATTEMPTS: break
-                current_xml = self._repair_xml(requirement_text, current_xml, final_errors)
-                if not current_xml: break
-                continue
-
-            # Use the combined validation method
-            is_valid, errors = self._validate_xml(current_xml)
-            final_errors = errors
-
-            if is_valid:
-                logger.info("KG Enhanced generation and validation successful.")
-                return current_xml, [] # Success
-            else:
-                logger.warning(f"KG Enhanced validation failed with {len(errors)} errors.")
-                if attempt < MAX_REPAIR_ATTEMPTS:
-                    repaired_xml = self._repair_xml(requirement_text, current_xml, errors)
-                    if repaired_xml:
-                        current_xml = repaired_xml
-                    else:
-                        logger.error("Repair attempt failed. Stopping.")
-                        break
-                else:
-                    logger.error("Max repair attempts reached. Returning last invalid XML with errors.")
-                    break
-
-        return current_xml, final_errors
+        guided = self._schema_guided_prompt(requirement_text, parsed_requirement, kg_context)
+        requirement_id = parsed_requirement.get("requirement_id")
+        if guided:
+            return self._with_examples(requirement_text, guided, requirement_id)
+        prompt = format_kg_enhanced_prompt(requirement_text, kg_context, **self._prompt_budget())
+        return self._with_examples(requirement_text, prompt, requirement_id)
 
     def _query_kg_for_context(self, parsed_requirement: dict) -> str:
         """
@@ -244,4 +167,96 @@ class KgEnhancedGenerator(BaseGenerator):
             context_str = "\n".join(all_related_info)
 
         logger.debug(f"Generated KG context: {context_str}")
-        return context_str
\ No newline at end of file
+        return context_str
+
+
+class CascadeGenerator(BaseGenerator):
+    """
+    Model cascade: LLM + XSD + Drools validation, trying a fast, cheaper model first.
+
+    The fast model's answer is kept if it validates after local recovery and
+    auto-fixes. Otherwise, and for requirements whose difficulty score exceeds
+    generation.cascade.max_difficulty, the requirement is generated and repaired with
+    the configured default_model as in baseline 3.
+    """
+
+    def __init__(self, config: dict, fast_llm_client=None, **kwargs):
+        """
+        Args:
+            config: General project configuration.
+            fast_llm_client: Client for the fast model (None: every requirement uses the strong model).
+            **kwargs: See BaseGenerator.
+        """
+        super().__init__(config, **kwargs)
+        self.fast_llm_client = fast_llm_client
+        cascade_config = (config.get("generation", {}) or {}).get("cascade") or {}
+        self.max_difficulty = cascade_config.get("max_difficulty", DEFAULT_MAX_DIFFICULTY)
+        if fast_llm_client is None:
+            logger.warning("No fast LLM client configured; the cascade always uses the strong model.")
+
+    def build_pipeline(self) -> GenerationPipeline:
+        pipeline = _validated_pipeline(self, "CascadeGenerator", "Initial LLM generation failed (strong model).")
+        if self.fast_llm_client is not None:
+            pipeline.build.insert(1, CascadeStage(self._fast_pipeline, self.max_difficulty)) # After the prompt stage
+        return pipeline
+
+    def _serving_models(self) -> list[tuple[dict, str]]:
+        """The prompt goes to the fast model first, so it must fit both models."""
+        return super()._serving_models() + client_models(self.fast_llm_client)
+
+    def _fast_pipeline(self, prompt: str) -> GenerationPipeline:
+        """Fast-model generation with local fixes only; failing output escalates instead of being repaired."""
+        def validate(xml: str) -> tuple[bool, list[str]]:
+            return self._validate_xml(xml)
+
+        return GenerationPipeline(
+            name="CascadeGenerator (fast model)",
+            build=[
+                PromptStage(lambda requirement, parsed: prompt),
+                # Not shared through initial_memo: the memo is keyed by prompt and holds strong-model answers
+                GenerateStage(lambda fast_prompt: (self._complete(fast_prompt, self.fast_llm_client), None),
+                              "Fast model generation failed."),
+            ],
+            prechecks=[StructureCheck()],
+            validator=validate,
+            fixers=self.fixer_stages(),
+            normalizers=[XmlRecoveryStage()],
+        )
+
+
+def _validated_pipeline(generator: BaseGenerator, name: str, failure_message: str) -> GenerationPipeline:
+    """
+    The generate -> precheck -> validate -> repair pipeline shared by the validating methods.
+
+    Validation and repair go through the generator's _validate_xml / _repair_xml, so
+    subclasses (and tests) can override them. Single initial generations are shared
+    through the run-scoped memo; raced candidates are not, since the race winner
+    depends on this generator's validators.
+    """
+    def validate(xml: str) -> tuple[bool, list[str]]:
+        return generator._validate_xml(xml)
+
+    return GenerationPipeline(
+        name=name,
+        build=[
+            PromptStage(generator.initial_prompt),
+            GenerateStage(lambda prompt: generator._generate_initial(prompt, validate), failure_message,
+                          cache=generator.initial_memo if generator.num_candidates <= 1 else None),
+        ],
+        prechecks=[StructureCheck()],
+        validator=validate,
+        fixers=generator.fixer_stages(),
+        repair=RepairStage(
+            lambda *args: generator._repair_xml(*args), cache=generator.repair_memo,
+            key=lambda requirement, xml, errors: _repair_memo_key(generator, requirement, xml, errors)
+        ),
+        repair_policy=generator.repair_policy,
+        normalizers=[XmlRecoveryStage()],
+    )
+
+
+def _repair_memo_key(generator: BaseGenerator, requirement_text: str, xml: str, errors: list[str]) -> str:
+    """Repair memo key; covers the serving model(s) and repair prompt version, as the memo outlives the run."""
+    models = ",".join(sorted({model for _, model in client_models(generator.llm_client)}))
+    return RepairMemo.make_key(xml, errors, generator.repair_mode, model=models,
+                               prompt_version=templates_fingerprint(REPAIR_TEMPLATES), requirement_text=requirement_text)
@@ -0,0 +1,155 @@
+import json
+import logging
+import re
+from lxml import etree
+
+from src.validation.xsd_content_model import XsdContentModel
+from .skeleton import element_name_candidates
+
+logger = logging.getLogger(__name__)
+
+JSON_RESPONSE_FORMAT = {"type": "json_object"} # Provider JSON mode (OpenAI chat completions)
+ATTRIBUTE_PREFIX = "@" # '@DEST': XML attribute
+TEXT_KEY = "#text" # Text of an element that also has attributes
+
+_FENCE_RE = re.compile(r"^```[\w-]*\s*$", re.MULTILINE)
+
+
+def element_key(name: str) -> str:
+    """Short JSON key for an XSD element name: 'SHORT-NAME' -> 'shortName', 'I-SIGNAL' -> 'iSignal'."""
+    first, *rest = name.lower().split("-")
+    return first + "".join(part.capitalize() for part in rest)
+
+
+class ArxmlJsonSerializer:
+    """
+    Converts between ARXML and a compact JSON object model, driven by the XSD content model.
+
+    Keys are element names in lowerCamelCase (see element_key); child objects nest,
+    repeated elements become arrays and leaves are scalars. '@NAME' keys hold
+    attributes and '#text' the text of an element that also has attributes. to_xml()
+    writes children in schema order and the namespaces the schema requires, so the
+    resulting document is always well-formed and ordered however the JSON is laid out.
+    """
+
+    def __init__(self, content_model: XsdContentModel):
+        self.model = content_model
+        self._names = {element_key(name): name for name in content_model.declarations} # JSON key -> element name
+
+    def element_name(self, key: str) -> str:
+        """
+        Element name for a JSON key; unknown keys map to the hyphenated upper-case form.
+
+        Raises:
+            ValueError: If the key contains no word characters (e.g. '' or ' ').
+        """
+        if key in self.model.declarations:
+            return key # Already an element name
+        name = self._names.get(key)
+        if name:
+            return name
+        candidates = element_name_candidates(key)
+        if not candidates:
+            raise ValueError(f"JSON key {key!r} is not an element name.")
+        return candidates[0]
+
+    def to_xml(self, document: dict) -> str:
+        """
+        Serializes a JSON document ({root_key: content}) to XML.
+
+        Raises:
+            ValueError: If the document is not an object with exactly one (root) key.
+        """
+        if not isinstance(document, dict) or len(document) != 1:
+            raise ValueError("JSON document must be an object with exactly one key (the root element).")
+        key, content = next(iter(document.items()))
+        name = self.element_name(key)
+        declaration = self.model.global_element(name)
+        root = etree.Element(self.model.instance_tag(name, declaration), nsmap=self.model.instance_nsmap())
+        self._fill(root, declaration, content)
+        return etree.tostring(root, encoding="unicode")
+
+    def from_xml(self, xml_content: str) -> dict:
+        """Inverse of to_xml (e.g. to show a skeleton in JSON form)."""
+        return arxml_to_json(xml_content)
+
+    def parse_response(self, response: str) -> str | None:
+        """XML for an LLM JSON response (code fences tolerated), or None if it is not a usable JSON document."""
+        text = _FENCE_RE.sub("", response).strip()
+        try:
+            return self.to_xml(json.loads(text))
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Could not serialize JSON output to XML: {e}")
+            return None
+
+    def _fill(self, element: etree._Element, declaration: etree._Element | None, content):
+        if isinstance(content, dict):
+            model = self.model.model_for(declaration) if declaration is not None else None
+            children = []
+            for key, value in content.items():
+                if key == TEXT_KEY:
+                    element.text = _scalar(value)
+                elif key.startswith(ATTRIBUTE_PREFIX):
+                    element.set(key[len(ATTRIBUTE_PREFIX):], _scalar(value))
+                else:
+                    children.append((self.element_name(key), value))
+            if model is not None:
+                children.sort(key=lambda child: model.position(child[0])) # Stable: repeated elements keep their order
+            for name, value in children:
+                child_decl = model.child(name) if model is not None else None
+                child_decl = child_decl.declaration if child_decl is not None else self.model.global_element(name)
+                for item in value if isinstance(value, list) else [value]:
+                    if item is None:
+                        continue
+                    child = etree.SubElement(element, self.model.instance_tag(name, child_decl))
+                    self._fill(child, child_decl, item)
+        elif content is not None:
+            element.text = _scalar(content)
+
+
+def arxml_to_json(xml_content: str) -> dict:
+    """
+    JSON object model of an ARXML document ({root_key: content}).
+
+    Needs no schema (the schema only matters for ordering in the other direction), so
+    it also serves tools without one, e.g. the stub LLM server's JSON mode.
+
+    Raises:
+        etree.XMLSyntaxError: If the XML is not well-formed.
+    """
+    root = etree.fromstring(xml_content.encode("utf-8"))
+    return {element_key(etree.QName(root).localname): _to_value(root)}
+
+
+def _to_value(element: etree._Element):
+    children = [c for c in element if isinstance(c.tag, str)]
+    if not children and not element.attrib:
+        return element.text or ""
+    value = {f"{ATTRIBUTE_PREFIX}{name}": attr for name, attr in element.attrib.items()}
+    if element.text and element.text.strip():
+        value[TEXT_KEY] = element.text.strip()
+    for child in children:
+        key = element_key(etree.QName(child).localname)
+        child_value = _to_value(child)
+        if key not in value:
+            value[key] = child_value
+        elif isinstance(value[key], list):
+            value[key].append(child_value)
+        else:
+            value[key] = [value[key], child_value]
+    return value
+
+
+def _scalar(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def serializer_of(content_model: XsdContentModel) -> ArxmlJsonSerializer:
+    """JSON serializer for a content model, created once per schema."""
+    serializer = getattr(content_model, "_json_serializer", None)
+    if serializer is None:
+        serializer = ArxmlJsonSerializer(content_model)
+        content_model._json_serializer = serializer
+    return serializer
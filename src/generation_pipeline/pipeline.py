@@ -0,0 +1,449 @@
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from .xml_recovery import XML_OK, diagnose_xml, recover_xml
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_current_context = contextvars.ContextVar("generation_context", default=None)
+
+STRUCTURE_ERROR = "LLM output is not valid XML structure."
+
+
+@dataclass
+class GenerationContext:
+    """State of one generate() call, passed from stage to stage."""
+    requirement_text: str
+    parsed_requirement: dict
+    prompt: str | None = None
+    xml: str | None = None
+    errors: list[str] = field(default_factory=list)
+    validated: bool = False # The current XML already passed validation (e.g. it won a candidate race)
+    failed: bool = False    # A build stage produced no output; the pipeline stops
+    attempt: int = 0
+    repair_stop_reason: str | None = None # Why the repair policy ended the repair loop (None: validation passed)
+    model_tier: str | None = None # Model cascade tier that produced the XML ('fast' / 'strong'; None without a cascade)
+    timings: dict[str, float] = field(default_factory=dict) # Stage name -> cumulative seconds
+    cache_hits: dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, stage_name: str, elapsed_s: float, cached: bool = False):
+        with self._lock:
+            self.timings[stage_name] = self.timings.get(stage_name, 0.0) + elapsed_s
+            if cached:
+                self.cache_hits[stage_name] = self.cache_hits.get(stage_name, 0) + 1
+
+
+class StageCache:
+    """Thread-safe in-memory LRU cache for stage results."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key: str, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = lambda result: True) -> tuple[Any, bool]:
+        """Returns (result, was_cached); computed results are stored if cacheable(result)."""
+        result = self.get(key, _MISSING)
+        if result is not _MISSING:
+            return result, True
+        result = compute()
+        if cacheable(result):
+            self.put(key, result)
+        return result, False
+
+
+class SingleFlightMemo(StageCache):
+    """
+    Run-scoped memo in which concurrent callers with the same key share one computation.
+
+    The first caller computes; callers arriving while it is in flight block on its
+    result instead of starting their own; later callers get the stored result.
+    Results that are not cacheable (e.g. a failed LLM call) are handed to the waiting
+    callers but not stored, so subsequent callers try again.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        super().__init__(max_entries)
+        self._inflight = {} # key -> Future of the running computation
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = lambda result: True) -> tuple[Any, bool]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key], True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result(), True
+
+        try:
+            result = compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if cacheable(result):
+                self._put(key, result)
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        return result, False
+
+
+class Stage:
+    """
+    A build or repair step. run() computes a result from the context, apply() stores it.
+
+    Stages with a cache (and a non-None cache_key) are skipped when the key was seen before.
+    """
+    name = "stage"
+
+    def __init__(self, cache: StageCache | None = None):
+        self.cache = cache
+
+    def cache_key(self, ctx: GenerationContext) -> str | None:
+        return None
+
+    def cacheable(self, result: Any) -> bool:
+        """Whether a computed result may be stored in the stage cache."""
+        return True
+
+    def run(self, ctx: GenerationContext) -> Any:
+        raise NotImplementedError
+
+    def apply(self, ctx: GenerationContext, result: Any):
+        pass
+
+
+class CheckStage:
+    """A validation step: maps an XML string to a list of error messages (empty if it passes)."""
+
+    def __init__(self, name: str, check: Callable[[str], list[str]], cache: StageCache | None = None):
+        self.name = name
+        self.check = check
+        self.cache = cache
+
+    def cache_key(self, xml: str) -> str | None:
+        return hashlib.sha256(f"{self.name}\0{xml}".encode("utf-8")).hexdigest()
+
+
+class StructureCheck(CheckStage):
+    """
+    Cheap precheck that the output is a single well-formed XML document.
+
+    A failure names the kind of problem (truncated, multiple roots, unbalanced tags,
+    ...) so the repair prompt can address it.
+    """
+
+    def __init__(self):
+        super().__init__("precheck", self._check)
+
+    @staticmethod
+    def _check(xml: str) -> list[str]:
+        diagnosis = diagnose_xml(xml)
+        if diagnosis.kind != XML_OK:
+            return [f"{STRUCTURE_ERROR} {diagnosis.message}"]
+        if diagnosis.payload != xml.strip():
+            return [f"{STRUCTURE_ERROR} Output contains text around the XML document."]
+        return []
+
+
+class PromptStage(Stage):
+    """Builds the initial prompt."""
+    name = "prompt"
+
+    def __init__(self, build_prompt: Callable[[str, dict], str], cache: StageCache | None = None):
+        super().__init__(cache)
+        self.build_prompt = build_prompt
+
+    def run(self, ctx: GenerationContext) -> str:
+        return self.build_prompt(ctx.requirement_text, ctx.parsed_requirement)
+
+    def apply(self, ctx: GenerationContext, result: str):
+        ctx.prompt = result
+
+
+class GenerateStage(Stage):
+    """
+    Calls the LLM for the initial XML.
+
+    `generate` returns (xml, errors) like BaseGenerator._generate_initial: errors == []
+    marks XML that was already validated (candidate race), None means not validated yet.
+    """
+    name = "llm_generate"
+
+    def __init__(self, generate: Callable[[str], tuple[str | None, list[str] | None]],
+                 failure_message: str = "Initial LLM generation failed.", cache: StageCache | None = None):
+        super().__init__(cache)
+        self.generate = generate
+        self.failure_message = failure_message
+
+    def cache_key(self, ctx: GenerationContext) -> str | None:
+        return hashlib.sha256(ctx.prompt.encode("utf-8")).hexdigest() if ctx.prompt else None
+
+    def cacheable(self, result: tuple[str | None, list[str] | None]) -> bool:
+        return bool(result[0]) # Never share a failed generation
+
+    def run(self, ctx: GenerationContext) -> tuple[str | None, list[str] | None]:
+        return self.generate(ctx.prompt)
+
+    def apply(self, ctx: GenerationContext, result: tuple[str | None, list[str] | None]):
+        xml, errors = result
+        if not xml:
+            logger.error(self.failure_message)
+            ctx.failed = True
+            ctx.errors = [self.failure_message]
+            return
+        ctx.xml = xml
+        ctx.validated = errors == []
+
+
+class RepairStage(Stage):
+    """Asks for a corrected XML given the current XML and its errors."""
+    name = "repair"
+
+    def __init__(self, repair: Callable[[str, str, list[str]], str | None], cache: StageCache | None = None,
+                 key: Callable[[str, str, list[str]], str | None] | None = None):
+        super().__init__(cache)
+        self.repair = repair
+        self.key = key # (requirement_text, xml, errors) -> cache key; without it results are not cached
+
+    def cache_key(self, ctx: GenerationContext) -> str | None:
+        return self.key(ctx.requirement_text, ctx.xml, ctx.errors) if self.key else None
+
+    def cacheable(self, result: str | None) -> bool:
+        return bool(result)
+
+    def run(self, ctx: GenerationContext) -> str | None:
+        return self.repair(ctx.requirement_text, ctx.xml, ctx.errors)
+
+    def apply(self, ctx: GenerationContext, result: str | None):
+        if result:
+            ctx.xml = result
+        else:
+            logger.error("Repair attempt failed. Stopping.")
+            ctx.failed = True
+
+
+class FixStage(Stage):
+    """Deterministic rewrite of the current XML (no LLM), e.g. schema-driven auto-repair."""
+
+    def __init__(self, name: str, fix: Callable[[str], str | None], cache: StageCache | None = None):
+        super().__init__(cache)
+        self.name = name
+        self.fix = fix
+
+    def cache_key(self, ctx: GenerationContext) -> str | None:
+        return hashlib.sha256(f"{self.name}\0{ctx.xml}".encode("utf-8")).hexdigest()
+
+    def run(self, ctx: GenerationContext) -> str | None:
+        return self.fix(ctx.xml)
+
+    def apply(self, ctx: GenerationContext, result: str | None):
+        if result:
+            ctx.xml = result
+
+
+class XmlRecoveryStage(FixStage):
+    """
+    Normalizes raw LLM output before validation: extracts the XML from code fences or
+    prose and fixes trivially recoverable documents locally (see xml_recovery), which
+    would otherwise cost an LLM repair round.
+    """
+
+    def __init__(self):
+        super().__init__("xml_recovery", recover_xml)
+
+
+def _timed(name: str, cache: StageCache | None, key: str | None, compute: Callable[[], Any],
+           ctx: GenerationContext | None, cacheable: Callable[[Any], bool] = lambda result: True) -> Any:
+    """Runs one stage computation, consulting the stage cache and recording its wall time."""
+    started = time.perf_counter()
+    if cache is not None and key is not None:
+        result, cached = cache.get_or_compute(key, compute, cacheable)
+    else:
+        result, cached = compute(), False
+    if ctx is not None:
+        ctx.record(name, time.perf_counter() - started, cached)
+    return result
+
+
+def run_checks(checks: list[CheckStage], xml: str, parallel: bool = False,
+               ctx: GenerationContext | None = None) -> tuple[bool, list[str]]:
+    """
+    Runs validation stages on one XML string.
+
+    Sequentially, checks are gated: the first failing check ends the run, since later
+    checks (e.g. Drools rules) assume the earlier ones (XSD) passed. In parallel mode
+    all checks run concurrently and their errors are merged in check order.
+
+    Args:
+        checks: The check stages, in order.
+        xml: The XML to validate.
+        parallel: Run the checks concurrently instead of gated.
+        ctx: Context receiving the stage timings (defaults to the running pipeline's).
+
+    Returns:
+        (is_valid, errors).
+    """
+    ctx = ctx or _current_context.get()
+    if parallel and len(checks) > 1:
+        with ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix="check") as executor:
+            futures = [executor.submit(_timed, c.name, c.cache, c.cache_key(xml), lambda c=c: c.check(xml), ctx) for c in checks]
+            errors = [e for future in futures for e in future.result()]
+        return not errors, errors
+    for check in checks:
+        errors = _timed(check.name, check.cache, check.cache_key(xml), lambda: check.check(xml), ctx)
+        if errors:
+            return False, list(errors)
+    return True, []
+
+
+class GenerationPipeline:
+    """
+    Declarative generate -> precheck -> validate -> repair engine shared by all generators.
+
+    Build stages (prompt, LLM call) run once, in order, until one has produced ctx.xml.
+    Then the normalizers, prechecks and validator run on the current XML; on failure the repair
+    stage produces the next candidate for as long as the repair policy allows. Every stage is timed into the context.
+    """
+
+    def __init__(self, name: str, build: list[Stage], prechecks: list[CheckStage] | None = None,
+                 validator: Callable[[str], tuple[bool, list[str]]] | None = None, fixers: list[Stage] | None = None,
+                 repair: Stage | None = None, repair_policy=None, discard_invalid: bool = False,
+                 normalizers: list[Stage] | None = None):
+        """
+        Args:
+            name: Pipeline name used in logs (e.g. the generator class).
+            build: Stages producing ctx.xml, run once in order.
+            prechecks: Cheap checks run before the validator each round (a failure skips validation).
+            validator: Function returning (is_valid, errors) for an XML string, usually built on run_checks.
+            fixers: Deterministic fix stages tried (and revalidated) before each repair; a fix
+                is kept only if it does not increase the number of errors.
+            repair: Stage producing a new ctx.xml from ctx.errors.
+            repair_policy: Decides after each failed validation whether to repair again
+                (default: RepairPolicy()).
+            discard_invalid: Return no XML (only errors) when the result is still invalid.
+            normalizers: Stages rewriting ctx.xml before every validation round (e.g. XmlRecoveryStage).
+        """
+        self.name = name
+        self.build = build
+        self.prechecks = prechecks or []
+        self.validator = validator
+        self.fixers = fixers or []
+        self.repair = repair
+        from .repair_policy import RepairPolicy # Local import (repair_policy builds on this module)
+        self.repair_policy = repair_policy or RepairPolicy()
+        self.discard_invalid = discard_invalid
+        self.normalizers = normalizers or []
+
+    def run(self, requirement_text: str, parsed_requirement: dict) -> GenerationContext:
+        """Executes the pipeline; the result is in ctx.xml / ctx.errors."""
+        ctx = GenerationContext(requirement_text, parsed_requirement)
+        token = _current_context.set(ctx)
+        try:
+            self._run(ctx)
+        finally:
+            _current_context.reset(token)
+        if self.discard_invalid and ctx.errors:
+            ctx.xml = None
+        return ctx
+
+    def run_stage(self, stage: Stage, ctx: GenerationContext):
+        result = _timed(stage.name, stage.cache, stage.cache_key(ctx) if stage.cache is not None else None,
+                        lambda: stage.run(ctx), ctx, stage.cacheable)
+        stage.apply(ctx, result)
+
+    def _run(self, ctx: GenerationContext):
+        for stage in self.build:
+            if ctx.xml is not None:
+                break # An earlier build stage (e.g. fragment generation) already produced the XML
+            self.run_stage(stage, ctx)
+            if ctx.failed:
+                return
+        if ctx.validated:
+            logger.info(f"{self.name}: initial output already validated.")
+            ctx.errors = []
+            return
+
+        session = self.repair_policy.start()
+        while True:
+            ctx.attempt = session.repairs
+            logger.info(f"Validation attempt {session.repairs + 1}")
+            for normalizer in self.normalizers:
+                self.run_stage(normalizer, ctx)
+            ctx.errors = self._validate(ctx)
+            if ctx.errors and self.fixers:
+                self._run_fixers(ctx)
+            if not ctx.errors:
+                logger.info(f"{self.name}: validation successful.")
+                return
+
+            logger.warning(f"{self.name}: validation failed with {len(ctx.errors)} errors.")
+            if self.repair is None:
+                return
+            if not session.should_repair(ctx.errors):
+                ctx.repair_stop_reason = session.stop_reason
+                logger.error(f"{self.name}: returning last invalid XML with errors ({session.stop_reason}).")
+                return
+            self.run_stage(self.repair, ctx)
+            if ctx.failed:
+                ctx.repair_stop_reason = "repair failed"
+                return
+
+    def _validate(self, ctx: GenerationContext) -> list[str]:
+        """Prechecks, then (if they pass) the validator, on ctx.xml."""
+        _, errors = run_checks(self.prechecks, ctx.xml, ctx=ctx)
+        if errors:
+            logger.warning(errors[0])
+        elif self.validator is not None:
+            _, errors = self.validator(ctx.xml)
+        return list(errors)
+
+    def _run_fixers(self, ctx: GenerationContext):
+        """Applies the deterministic fixers; ctx.errors ends up as the errors of the kept XML."""
+        for fixer in self.fixers:
+            before_xml, before_errors = ctx.xml, ctx.errors
+            self.run_stage(fixer, ctx)
+            if ctx.xml == before_xml:
+                continue
+            errors = self._validate(ctx)
+            if len(errors) > len(before_errors):
+                logger.info(f"{fixer.name} made validation worse ({len(before_errors)} -> {len(errors)} errors); reverted.")
+                ctx.xml = before_xml
+                continue
+            logger.info(f"{fixer.name}: {len(before_errors)} -> {len(errors)} errors.")
+            ctx.errors = errors
+            if not errors:
+                return
@@ -1,26 +1,397 @@
+import hashlib
+import json
 import logging
-# This file might not need code if repair logic is within BaseGenerator._repair_xml
-# Or, it could contain more sophisticated repair strategy functions called by BaseGenerator.
+import re
+import threading
+from dataclasses import dataclass, field
+from lxml import etree
+
+from src.llm_interaction.response_cache import ResponseCache, DEFAULT_MAX_BYTES
+from src.validation.xsd_content_model import ContentModel, XsdContentModel
+from .pipeline import StageCache
 
 logger = logging.getLogger(__name__)
 
-logger.info("Repair module loaded (currently logic might be in BaseGenerator or specific generators).")
-
-# Example of a more complex repair strategy function (if needed)
-# def analyze_errors_and_suggest_changes(errors: list[str]) -> str:
-#     """Analyzes errors and generates specific suggestions for LLM repair prompt."""
-#     suggestions = "Consider the following potential fixes:\n"
-#     for error in errors:
-#         if "missing element" in error.lower():
-#             suggestions += "- Ensure all required child elements are present.\n"
-#         elif "attribute" in error.lower() and "required" in error.lower():
-#             suggestions += "- Check if all mandatory attributes are included and correctly named.\n"
-#         elif "drools" in error.lower():
-#             suggestions += "- Review semantic rules related to the reported violation.\n"
-#     return suggestions
-
-# if __name__ == "__main__":
-#     logging.basicConfig(level=logging.INFO)
-#     test_errors = ["XSD Error: Element 'LENGTH' is missing (Line: 5, Col: 10)", "Drools Rule Violated: Signal name must start with 'Sig_'."]
-#     suggestion = analyze_errors_and_suggest_changes(test_errors)
-#     print(suggestion)
\ No newline at end of file
+DEFAULT_MAX_SLICE_FRACTION = 0.5 # Above this share of the document, slicing saves too little; repair the whole XML
+
+_LOCATION_RE = re.compile(r"\(Line: (\d+), Col: (\d+)\)")
+_FRAGMENT_MARKER_RE = re.compile(r"^=== FRAGMENT (\d+) ===\s*$", re.MULTILINE)
+_FENCE_RE = re.compile(r"^```[\w-]*\s*$", re.MULTILINE)
+# Positions in validate_xsd / lxml messages: '(Line: 3, Col: 0)', 'line 3, column 7', '(<string>, line 3)'
+_ERROR_POSITION_RE = re.compile(r"\s*\(Line: \d+, Col: \d+\)|,?\s*line \d+, column \d+|\s*\(<string>, line \d+\)")
+
+_shared_repair_memos = {}
+_shared_lock = threading.Lock()
+
+
+@dataclass
+class XmlSlice:
+    """A failing subtree of a document, sent to the LLM instead of the whole XML."""
+    index: int
+    element: etree._Element
+    path: str # Ancestor path, e.g. 'AUTOSAR/AR-PACKAGES/AR-PACKAGE[Signals]'
+    xml: str
+    errors: list[str] = field(default_factory=list)
+
+
+def parse_error_location(error: str) -> tuple[int, int] | None:
+    """Extracts (line, column) from a validate_xsd error message, if present."""
+    match = _LOCATION_RE.search(error)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def _element_path(element: etree._Element) -> str:
+    """Readable ancestor path; elements with a SHORT-NAME child are labelled with it."""
+    parts = []
+    for node in reversed([element, *element.iterancestors()]):
+        label = etree.QName(node).localname
+        short_name = next((c.text for c in node if isinstance(c.tag, str) and etree.QName(c).localname == "SHORT-NAME"), None)
+        parts.append(f"{label}[{short_name.strip()}]" if short_name and short_name.strip() else label)
+    return "/".join(parts)
+
+
+def _element_for_error(root: etree._Element, line: int, message: str) -> etree._Element | None:
+    """
+    Finds the smallest subtree responsible for an error reported at `line`.
+
+    Content-model errors ('This element is not expected') are fixed in the parent's
+    child sequence, so the parent is returned for those. lxml reports no start column
+    per element, so if several elements start on the error line (e.g. single-line XML)
+    the culprit is ambiguous and None is returned.
+    """
+    element, on_line = None, 0
+    for node in root.iter():
+        if not isinstance(node.tag, str) or node.sourceline is None:
+            continue
+        if node.sourceline > line:
+            break
+        element = node # Last element starting at or before the error line (document order)
+        on_line += node.sourceline == line
+    if on_line > 1:
+        return None
+    if element is not None and "not expected" in message and element.getparent() is not None:
+        element = element.getparent()
+    return element
+
+
+def extract_failing_slices(xml_content: str, errors: list[str],
+                           max_fraction: float = DEFAULT_MAX_SLICE_FRACTION) -> tuple[etree._Element, list[XmlSlice]] | None:
+    """
+    Cuts the document down to the subtrees that fail validation.
+
+    Args:
+        xml_content: The XML that failed validation.
+        errors: validate_xsd error messages (with line/column information).
+        max_fraction: Give up if the slices make up more than this share of the document.
+
+    Returns:
+        (parsed root, slices), or None if slicing is not applicable (unlocated or
+        syntax errors, an error on the root element, or slices too large to pay off).
+    """
+    locations = [parse_error_location(e) for e in errors]
+    if not errors or any(loc is None for loc in locations):
+        return None
+    try:
+        root = etree.fromstring(xml_content.encode("utf-8")) # Same parse as validate_xsd, so line numbers agree
+    except etree.XMLSyntaxError:
+        return None
+
+    by_element = {} # element -> errors, in order of first error
+    for error, (line, _) in zip(errors, locations):
+        element = _element_for_error(root, line, error)
+        if element is None or element is root:
+            return None
+        by_element.setdefault(element, []).append(error)
+
+    # Drop slices nested in another slice; the outer one carries their errors
+    selected = {}
+    for element, element_errors in by_element.items():
+        outer = element
+        for ancestor in element.iterancestors():
+            if ancestor in by_element:
+                outer = ancestor # Keep climbing: the outermost failing ancestor wins
+        selected.setdefault(outer, []).extend(element_errors)
+
+    slices = []
+    for index, (element, element_errors) in enumerate(selected.items(), start=1):
+        fragment = etree.tostring(element, encoding="unicode", with_tail=False)
+        slices.append(XmlSlice(index, element, _element_path(element), fragment, element_errors))
+    slice_chars = sum(len(s.xml) for s in slices)
+    if slice_chars > max_fraction * len(xml_content):
+        logger.debug(f"Failing slices cover {slice_chars}/{len(xml_content)} chars; not worth slicing.")
+        return None
+    return root, slices
+
+
+def parse_fragment_response(response: str) -> dict[int, str]:
+    """Splits an LLM answer of '=== FRAGMENT n ===' sections into {n: xml}."""
+    markers = list(_FRAGMENT_MARKER_RE.finditer(response))
+    fragments = {}
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(response)
+        text = _FENCE_RE.sub("", response[marker.end():end]).strip()
+        if text:
+            fragments[int(marker.group(1))] = text
+    return fragments
+
+
+def splice_fragments(root: etree._Element, slices: list[XmlSlice], repaired: dict[int, str],
+                     xml_declaration: bool = False) -> str | None:
+    """
+    Replaces each slice's subtree with its repaired fragment and serializes the document.
+
+    Returns:
+        The spliced XML, or None if a fragment is missing or not well-formed.
+    """
+    replacements = []
+    for xml_slice in slices:
+        text = repaired.get(xml_slice.index)
+        if not text:
+            logger.warning(f"Repair response is missing fragment {xml_slice.index} ({xml_slice.path}).")
+            return None
+        try:
+            # Parse in the namespace context of the original element so unprefixed fragments keep their namespace
+            nsmap_decl = "".join(f' xmlns{":" + p if p else ""}="{uri}"' for p, uri in xml_slice.element.nsmap.items())
+            wrapper = etree.fromstring(f"<_fragment{nsmap_decl}>{text}</_fragment>".encode("utf-8"))
+        except etree.XMLSyntaxError as e:
+            logger.warning(f"Repaired fragment {xml_slice.index} is not well-formed: {e}")
+            return None
+        new_elements = [c for c in wrapper if isinstance(c.tag, str)]
+        if len(new_elements) != 1:
+            logger.warning(f"Repaired fragment {xml_slice.index} must contain exactly one element, got {len(new_elements)}.")
+            return None
+        replacements.append((xml_slice.element, new_elements[0]))
+
+    for old, new in replacements:
+        new.tail = old.tail
+        old.getparent().replace(old, new)
+    etree.cleanup_namespaces(root)
+    if xml_declaration:
+        return etree.tostring(root, encoding="UTF-8", xml_declaration=True).decode("utf-8")
+    return etree.tostring(root, encoding="unicode")
+
+
+class XsdAutoRepairer:
+    """
+    Fixes mechanical XSD violations directly on the lxml tree, without an LLM round trip.
+
+    Driven by the schema's content model: moves elements into the target namespace,
+    removes stray wrapper elements (root or nested), restores the declared child
+    order of plain sequences and inserts a missing mandatory SHORT-NAME. Anything
+    else is left for the LLM repair.
+    """
+
+    def __init__(self, content_model: XsdContentModel):
+        self.model = content_model
+        self.fixes = [] # Descriptions of the fixes applied in the last repair() call
+        self._short_names_added = 0
+
+    def repair(self, xml_content: str) -> str | None:
+        """
+        Returns the rewritten XML, or None if nothing could be fixed (or it does not parse).
+        """
+        self.fixes = []
+        self._short_names_added = 0
+        try:
+            root = etree.fromstring(xml_content.encode("utf-8"))
+        except etree.XMLSyntaxError:
+            return None
+
+        root = self._unwrap_root(root)
+        root = self._fix_namespace(root)
+        declaration = self.model.global_element(etree.QName(root).localname)
+        if declaration is not None:
+            self._fix_children(root, declaration)
+        if not self.fixes:
+            return None
+        logger.info(f"Auto-repair applied {len(self.fixes)} fixes: {self.fixes}")
+        if xml_content.lstrip().startswith("<?xml"):
+            return etree.tostring(root, encoding="UTF-8", xml_declaration=True).decode("utf-8")
+        return etree.tostring(root, encoding="unicode")
+
+    def _unwrap_root(self, root: etree._Element) -> etree._Element:
+        """Drops a root element the schema does not know if it wraps a single known document element."""
+        if self.model.global_element(etree.QName(root).localname) is not None:
+            return root
+        children = [c for c in root if isinstance(c.tag, str)]
+        if len(children) == 1 and self.model.global_element(etree.QName(children[0]).localname) is not None:
+            self.fixes.append(f"removed wrapper <{etree.QName(root).localname}>")
+            child = children[0]
+            child.tail = None
+            return etree.fromstring(etree.tostring(child)) # Detached copy keeps in-scope namespaces
+        return root
+
+    def _fix_namespace(self, root: etree._Element) -> etree._Element:
+        """Moves elements into the target namespace (all of them if elementFormDefault is qualified)."""
+        namespace = self.model.target_namespace
+        if not namespace:
+            return root
+        root_ok = etree.QName(root).namespace == namespace
+        strays = [element for element in root.iterdescendants()
+                  if isinstance(element.tag, str) and etree.QName(element).namespace != namespace] if self.model.qualified else []
+        if root_ok and not strays:
+            return root
+        self.fixes.append(f"moved elements into namespace {namespace}")
+        if not root_ok:
+            nsmap = {p: uri for p, uri in root.nsmap.items() if p is not None and uri != namespace}
+            nsmap[None] = namespace
+            new_root = etree.Element(etree.QName(namespace, etree.QName(root).localname), attrib=dict(root.attrib), nsmap=nsmap)
+            new_root.text = root.text
+            new_root.extend(list(root))
+            root = new_root
+        for element in strays: # Still the same element objects after the root was rebuilt
+            element.tag = etree.QName(namespace, etree.QName(element).localname)
+        etree.cleanup_namespaces(root)
+        return root
+
+    def _fix_children(self, element: etree._Element, declaration: etree._Element):
+        model = self.model.model_for(declaration)
+        if model is None:
+            return
+        name = etree.QName(element).localname
+        if not model.open:
+            self._unwrap_strays(element, model, name)
+        if model.ordered:
+            self._reorder(element, model, name)
+        self._insert_short_name(element, model, name)
+        for child in element:
+            if isinstance(child.tag, str):
+                child_decl = model.child(etree.QName(child).localname)
+                if child_decl is not None:
+                    self._fix_children(child, child_decl.declaration)
+
+    def _unwrap_strays(self, element: etree._Element, model: ContentModel, name: str):
+        """Replaces an unexpected child by its own children if those are all allowed here."""
+        for child in [c for c in element if isinstance(c.tag, str)]:
+            child_name = etree.QName(child).localname
+            grandchildren = [g for g in child if isinstance(g.tag, str)]
+            if model.child(child_name) is not None or not grandchildren:
+                continue
+            if all(model.child(etree.QName(g).localname) is not None for g in grandchildren):
+                index = element.index(child)
+                grandchildren[-1].tail = child.tail
+                element.remove(child)
+                for offset, grandchild in enumerate(grandchildren):
+                    element.insert(index + offset, grandchild)
+                self.fixes.append(f"removed stray wrapper <{child_name}> in <{name}>")
+
+    def _reorder(self, element: etree._Element, model: ContentModel, name: str):
+        """Sorts children into the declared sequence order (whitespace stays in place)."""
+        children = [c for c in element if isinstance(c.tag, str)]
+        if len(children) != len(element) or any(model.child(etree.QName(c).localname) is None for c in children):
+            return # Comments, PIs or unknown children: leave the order alone
+        ordered = sorted(children, key=lambda c: model.position(etree.QName(c).localname))
+        if ordered == children:
+            return
+        tails = [c.tail for c in children]
+        for child in children:
+            element.remove(child)
+        for child, tail in zip(ordered, tails):
+            child.tail = tail
+            element.append(child)
+        self.fixes.append(f"reordered children of <{name}>")
+
+    def _insert_short_name(self, element: etree._Element, model: ContentModel, name: str):
+        """Adds a mandatory SHORT-NAME derived from the element name (e.g. I-SIGNAL -> ISignal_1)."""
+        decl = model.child("SHORT-NAME")
+        if decl is None or not decl.required:
+            return
+        if any(isinstance(c.tag, str) and etree.QName(c).localname == "SHORT-NAME" for c in element):
+            return
+        namespace = etree.QName(element).namespace
+        short_name = etree.Element(etree.QName(namespace, "SHORT-NAME") if namespace else "SHORT-NAME")
+        self._short_names_added += 1
+        short_name.text = "".join(part.capitalize() for part in name.split("-")) + f"_{self._short_names_added}"
+        position = model.position("SHORT-NAME")
+        children = [c for c in element if isinstance(c.tag, str)]
+        later = [c for c in children if model.position(etree.QName(c).localname) > position]
+        if later:
+            index = element.index(later[0])
+            short_name.tail = element[index - 1].tail if index > 0 else element.text
+        else:
+            index = len(element)
+            short_name.tail = element[-1].tail if len(element) else None
+        element.insert(index, short_name)
+        self.fixes.append(f"inserted SHORT-NAME in <{name}>")
+
+
+def canonical_xml_hash(xml_content: str) -> str:
+    """
+    SHA-256 of the exclusive C14N form of the XML, so formatting-only differences hash alike.
+
+    Whitespace-only text (indentation) is dropped first. Output that does not parse is
+    hashed as whitespace-normalized text instead.
+    """
+    try:
+        root = etree.fromstring(xml_content.strip().encode("utf-8"))
+        for element in root.iter():
+            if element.text is not None and not element.text.strip():
+                element.text = None
+            if element.tail is not None and not element.tail.strip():
+                element.tail = None
+        canonical = etree.tostring(root, method="c14n", exclusive=True)
+    except etree.XMLSyntaxError:
+        canonical = " ".join(xml_content.split()).encode("utf-8")
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def strip_error_position(error: str) -> str:
+    """Removes line/column information from a validation error message."""
+    return _ERROR_POSITION_RE.sub("", error).strip()
+
+
+def error_signature(errors: list[str]) -> str:
+    """Errors with line/column positions stripped, deduplicated and sorted."""
+    return "\n".join(sorted({strip_error_position(e) for e in errors}))
+
+
+class RepairMemo(StageCache):
+    """
+    Memo of LLM repairs keyed by (canonical XML, error signature, repair mode, model,
+    repair prompt version, requirement).
+
+    Entries are kept in memory and, if a path is given, in a SQLite ResponseCache so
+    known repairs survive across runs. Since the key covers everything the repair
+    prompt depends on, a stored repair is only reused for the same requirement,
+    model and prompt templates.
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = 1024):
+        super().__init__(max_entries)
+        self.store = ResponseCache(path, max_bytes=max_bytes) if path else None
+
+    @staticmethod
+    def make_key(xml_content: str, errors: list[str], repair_mode: str = "full", model: str = "",
+                 prompt_version: str = "", requirement_text: str = "") -> str:
+        payload = json.dumps([canonical_xml_hash(xml_content), error_signature(errors), repair_mode, model, prompt_version,
+                              hashlib.sha256(requirement_text.encode("utf-8")).hexdigest()])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, default=None):
+        value = super().get(key, default)
+        if value is default and self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                super().put(key, stored)
+                return stored
+        return value
+
+    def put(self, key: str, value):
+        super().put(key, value)
+        if self.store is not None and value:
+            self.store.put(key, value)
+
+
+def get_repair_memo(memo_config: dict) -> RepairMemo | None:
+    """Returns the process-wide repair memo for the config (None if disabled), shared by all generators."""
+    if not memo_config.get("enabled", False):
+        return None
+    path = memo_config.get("path")
+    with _shared_lock:
+        if path not in _shared_repair_memos:
+            try:
+                _shared_repair_memos[path] = RepairMemo(path, memo_config.get("max_bytes", DEFAULT_MAX_BYTES))
+            except Exception as e:
+                logger.error(f"Failed to open repair memo: {e}", exc_info=True)
+                return None
+        return _shared_repair_memos[path]
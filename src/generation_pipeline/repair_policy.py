@@ -0,0 +1,96 @@
+import logging
+import time
+from dataclasses import dataclass
+
+from src.llm_interaction.deadline import remaining_time
+from src.llm_interaction.telemetry import current_tracker
+from .repair import error_signature
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RepairPolicy:
+    """
+    Decides how many LLM repair rounds a generation gets, based on its progress.
+
+    The base budget (max_attempts) grows by up to max_extra_attempts rounds while
+    every round reduces the error count. Repairs stop early when the error count
+    has not decreased for more than `patience` rounds, when an error set seen
+    before comes back (oscillation), or when the wall-clock or token budget of the
+    requirement would be exceeded.
+    """
+    max_attempts: int = 2 # Repair rounds granted regardless of progress
+    max_extra_attempts: int = 2 # Further rounds granted while errors keep decreasing
+    patience: int = 1 # Rounds without fewer errors tolerated before giving up
+    time_budget_s: float | None = None # Wall-clock limit for one generation (an enclosing deadline_scope also applies)
+    token_budget: int | None = None # LLM tokens (prompt + completion) per requirement, as tracked by track_usage
+
+    @classmethod
+    def from_config(cls, policy_config: dict) -> "RepairPolicy":
+        """Builds the policy from the generation.repair_policy config section."""
+        known = {k: v for k, v in (policy_config or {}).items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+    def start(self) -> "RepairSession":
+        """Fresh per-generation state."""
+        return RepairSession(self)
+
+
+class RepairSession:
+    """Progress of one generation's repair loop under a RepairPolicy."""
+
+    def __init__(self, policy: RepairPolicy):
+        self.policy = policy
+        self.history = [] # (error count, error signature) per validation round
+        self.repairs = 0
+        self.stop_reason = None
+        self.started = time.monotonic()
+        self._round_started = self.started
+        self._longest_round_s = 0.0
+
+    def should_repair(self, errors: list[str]) -> bool:
+        """
+        Records the errors of the latest validation and decides whether to repair again.
+
+        The reason for stopping is kept in `stop_reason`.
+        """
+        now = time.monotonic()
+        if self.history:
+            self._longest_round_s = max(self._longest_round_s, now - self._round_started)
+        self._round_started = now
+        self.history.append((len(errors), error_signature(errors)))
+        self.stop_reason = self._stop_reason(now)
+        if self.stop_reason:
+            logger.info(f"Stopping repairs after {self.repairs} rounds: {self.stop_reason}.")
+            return False
+        self.repairs += 1
+        return True
+
+    def _stop_reason(self, now: float) -> str | None:
+        policy = self.policy
+        counts = [count for count, _ in self.history]
+        if self.repairs >= policy.max_attempts + policy.max_extra_attempts:
+            return "maximum repair rounds reached"
+        if self.repairs >= policy.max_attempts and not (len(counts) > 1 and counts[-1] < counts[-2]):
+            return "repair budget exhausted without steady progress"
+        signature = self.history[-1][1]
+        if len(self.history) > 2 and signature != self.history[-2][1] \
+                and any(signature == earlier for _, earlier in self.history[:-2]):
+            return "errors are oscillating"
+        stalled = 0
+        for index in range(len(counts) - 1, 0, -1): # Trailing rounds without a new minimum
+            if counts[index] < min(counts[:index]):
+                break
+            stalled += 1
+        if stalled > policy.patience:
+            return f"no fewer errors for {stalled} rounds"
+        if policy.time_budget_s is not None and now - self.started + self._longest_round_s > policy.time_budget_s:
+            return "time budget exhausted"
+        remaining = remaining_time()
+        if remaining is not None and remaining < self._longest_round_s:
+            return "requirement deadline too close for another round"
+        tracker = current_tracker()
+        if policy.token_budget is not None and tracker is not None and tracker.total_tokens >= policy.token_budget:
+            return "token budget exhausted"
+        return None
@@ -0,0 +1,163 @@
+import logging
+import re
+from collections import deque
+from lxml import etree
+
+from src.validation.xsd_content_model import XsdContentModel
+
+logger = logging.getLogger(__name__)
+
+LEAF_PLACEHOLDER = "{{VALUE}}" # Text of mandatory leaves; the LLM replaces it with the actual value
+MAX_SKELETON_DEPTH = 20 # Guards against recursive mandatory content
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9-]*")
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+
+
+def element_name_candidates(text: str) -> list[str]:
+    """
+    XSD-style element names a requirement term may refer to.
+
+    'ComSignal', 'com signal' and 'COM-SIGNAL' all map to 'COM-SIGNAL'; 'ISignal' to 'I-SIGNAL'.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    hyphenated = "-".join(part for word in re.split(r"[\s_]+", text) for part in _CAMEL_RE.split(word) if part)
+    return list(dict.fromkeys([hyphenated.upper(), text.upper()]))
+
+
+class SkeletonBuilder:
+    """
+    Builds the mandatory element skeleton of a document from the XSD content model.
+
+    The skeleton runs from a document (global) element down to the target element
+    along the shortest declared path. Every element on it carries its minOccurs >= 1
+    children in declaration order, and mandatory leaves hold LEAF_PLACEHOLDER, so the
+    LLM only supplies values and optional branches.
+    """
+
+    def __init__(self, content_model: XsdContentModel):
+        self.model = content_model
+        self._skeletons = {} # Target element name -> skeleton XML (None if unreachable)
+        self._paths = {} # Target element name -> declaration chain from a document element (None if unreachable)
+
+    def target_element(self, requirement_text: str, parsed_requirement: dict) -> str | None:
+        """
+        Picks the element type the requirement asks for.
+
+        Entities from the NLProcessor are tried first, then the words of the requirement
+        text. Only complex elements qualify, so leaf names such as 'VALUE' mentioned in
+        passing are not mistaken for the target. With a single global element and no
+        match, that element is the target.
+        """
+        terms = [entity[0] if isinstance(entity, (list, tuple)) else str(entity)
+                 for entity in parsed_requirement.get("entities", [])]
+        terms += _WORD_RE.findall(requirement_text)
+        for term in terms:
+            for name in element_name_candidates(term):
+                if self.is_complex(name):
+                    return name
+        if len(self.model.elements) == 1:
+            return next(iter(self.model.elements))
+        return None
+
+    def skeleton(self, target: str) -> str | None:
+        """Skeleton XML reaching the `target` element, or None if no document element contains it."""
+        if target not in self._skeletons:
+            self._skeletons[target] = self._build(target)
+        return self._skeletons[target]
+
+    def skeleton_tree(self, target: str) -> tuple[etree._Element, etree._Element] | None:
+        """A fresh skeleton tree for `target` as (root, target element), or None if unreachable."""
+        path = self.path(target)
+        if path is None:
+            return None
+        root = self._element(None, path[0])
+        return root, self._fill(root, path[0], path[1:], depth=1)
+
+    def path(self, target: str) -> list[etree._Element] | None:
+        """Declarations from the document element down to `target`, or None if unreachable."""
+        if target not in self._paths:
+            self._paths[target] = self._path_to(target)
+        return self._paths[target]
+
+    def skeleton_for(self, requirement_text: str, parsed_requirement: dict) -> str | None:
+        """Skeleton for the requirement's target element (None if no target is found)."""
+        target = self.target_element(requirement_text, parsed_requirement)
+        if target is None:
+            logger.info("No schema element matches the requirement; no skeleton built.")
+            return None
+        return self.skeleton(target)
+
+    def is_complex(self, name: str) -> bool:
+        """True if some declaration of `name` has element content (not just a text value)."""
+        models = [self.model.model_for(d) for d in self.model.declarations.get(name, [])]
+        return any(model is not None and not model.text for model in models)
+
+    def _path_to(self, target: str) -> list[etree._Element] | None:
+        """Shortest chain of declarations from a global element to a declaration of `target`."""
+        queue = deque((declaration, [declaration]) for declaration in self.model.elements.values())
+        seen = set()
+        while queue:
+            declaration, path = queue.popleft()
+            if declaration.get("name") == target:
+                return path
+            key = declaration.getroottree().getpath(declaration)
+            if key in seen or len(path) >= MAX_SKELETON_DEPTH:
+                continue
+            seen.add(key)
+            model = self.model.model_for(declaration)
+            if model is not None:
+                queue.extend((child.declaration, path + [child.declaration]) for child in model.children)
+        return None
+
+    def _build(self, target: str) -> str | None:
+        tree = self.skeleton_tree(target)
+        if tree is None:
+            logger.warning(f"Element '{target}' is not reachable from any document element; no skeleton built.")
+            return None
+        root, _ = tree
+        logger.info(f"Built skeleton for '{target}' ({sum(1 for _ in root.iter())} elements).")
+        return etree.tostring(root, pretty_print=True, encoding="unicode")
+
+    def _element(self, parent: etree._Element | None, declaration: etree._Element) -> etree._Element:
+        tag = self.model.instance_tag(declaration.get("name"), declaration)
+        if parent is None:
+            return etree.Element(tag, nsmap=self.model.instance_nsmap())
+        return etree.SubElement(parent, tag)
+
+    def fill(self, element: etree._Element, declaration: etree._Element):
+        """Adds the mandatory content of `declaration` to an existing `element`."""
+        self._fill(element, declaration, [], depth=1)
+
+    def _fill(self, element: etree._Element, declaration: etree._Element, chain: list[etree._Element],
+              depth: int) -> etree._Element:
+        """
+        Adds the mandatory children of `element`, plus the next element of `chain` at its
+        declared position. Returns the element created for the end of the chain.
+        """
+        target = element
+        model = self.model.model_for(declaration)
+        if model is None or model.text:
+            element.text = LEAF_PLACEHOLDER
+            return target
+        if depth >= MAX_SKELETON_DEPTH:
+            return target
+        next_name = chain[0].get("name") if chain else None
+        for child in model.children:
+            if child.name == next_name:
+                target = self._fill(self._element(element, chain[0]), chain[0], chain[1:], depth + 1)
+                next_name = None
+            elif child.required:
+                self._fill(self._element(element, child.declaration), child.declaration, [], depth + 1)
+        return target
+
+
+def skeleton_builder_of(content_model: XsdContentModel) -> SkeletonBuilder:
+    """Skeleton builder for a content model, created once so its skeletons are reused."""
+    builder = getattr(content_model, "_skeleton_builder", None)
+    if builder is None:
+        builder = SkeletonBuilder(content_model)
+        content_model._skeleton_builder = builder
+    return builder
@@ -0,0 +1,159 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+XML_OK = "ok"
+XML_NOT_XML = "not_xml"
+XML_TRUNCATED = "truncated" # Input ended with elements still open
+XML_MULTIPLE_ROOTS = "multiple_roots" # Further elements after the document element closed
+XML_UNBALANCED = "unbalanced" # A closing tag does not match the open element
+XML_MALFORMED = "malformed" # Any other syntax error
+
+_FENCED_BLOCK_RE = re.compile(r"```[ \t]*(?:xml|arxml|XML)?[ \t]*\n(.*?)(?:\n[ \t]*```|\Z)", re.DOTALL)
+_XML_START_RE = re.compile(r"<(?:\?xml|[A-Za-z_])")
+_START_TAG_RE = re.compile(r"<[A-Za-z_][\w.\-:]*")
+
+
+@dataclass
+class XmlDiagnosis:
+    """Well-formedness verdict for an LLM answer."""
+    kind: str
+    payload: str | None = None # The XML part of the answer (code fences and prose removed)
+    recovered: str | None = None # Locally fixed XML, if the problem was trivially recoverable
+    open_elements: list[str] = field(default_factory=list) # Element stack where a truncated answer stopped
+    message: str = ""
+
+
+def extract_xml_payload(text: str) -> str | None:
+    """
+    Returns the XML part of an LLM answer, or None if it contains no XML.
+
+    Markdown code fences (even an unclosed one, as left by a truncated answer) and
+    prose before the first tag are dropped. Trailing prose is kept; diagnose_xml
+    removes it once it knows where the document element ends.
+    """
+    if not text:
+        return None
+    for block in _FENCED_BLOCK_RE.findall(text):
+        if _XML_START_RE.match(block.strip()):
+            text = block
+            break
+    start = _XML_START_RE.search(text)
+    if start is None:
+        return None
+    return text[start.start():].strip()
+
+
+def diagnose_xml(text: str) -> XmlDiagnosis:
+    """
+    Classifies an LLM answer as well-formed XML or by the kind of its structural problem.
+
+    Trivially recoverable problems are fixed on the way (see XmlDiagnosis.recovered):
+    prose after the document element, a repeated identical document, closing tags
+    missing at the very end, and a mismatched closing tag that lxml's recovering
+    parser can place without losing an element.
+    """
+    payload = extract_xml_payload(text)
+    if payload is None:
+        return XmlDiagnosis(XML_NOT_XML, message="Output contains no XML element.")
+    parser = etree.XMLPullParser(events=("start", "end"))
+    stack = []
+    try:
+        parser.feed(payload)
+        stack = _open_elements(parser, stack)
+        parser.close()
+    except etree.XMLSyntaxError as e:
+        stack = _open_elements(parser, stack)
+        return _classify(payload, e, stack)
+    return XmlDiagnosis(XML_OK, payload=payload, recovered=payload if payload != text else None)
+
+
+def recover_xml(text: str) -> str | None:
+    """Well-formed XML for an LLM answer (extracted or locally recovered), or None if that needs the LLM."""
+    diagnosis = diagnose_xml(text)
+    if diagnosis.kind == XML_OK:
+        return diagnosis.payload
+    if diagnosis.recovered:
+        logger.info(f"Recovered {diagnosis.kind} XML locally.")
+    return diagnosis.recovered
+
+
+def _open_elements(parser: etree.XMLPullParser, stack: list[str]) -> list[str]:
+    for event, element in parser.read_events():
+        if event == "start":
+            local = etree.QName(element).localname
+            stack.append(f"{element.prefix}:{local}" if element.prefix else local)
+        elif stack:
+            stack.pop()
+    return stack
+
+
+def _classify(payload: str, error: etree.XMLSyntaxError, stack: list[str]) -> XmlDiagnosis:
+    if error.code == etree.ErrorTypes.ERR_DOCUMENT_END:
+        return _extra_content(payload, error)
+    if error.code == etree.ErrorTypes.ERR_TAG_NAME_MISMATCH:
+        return XmlDiagnosis(XML_UNBALANCED, payload, _recover_unbalanced(payload), stack, f"Unbalanced tags: {error.msg}")
+    if stack and _at_end(payload, error):
+        recovered = None
+        if payload.endswith(">"): # Cut right after a complete tag: only closing tags are missing
+            recovered = payload + "".join(f"</{name}>" for name in reversed(stack))
+        return XmlDiagnosis(XML_TRUNCATED, payload, recovered, stack,
+                            f"Output is truncated; open elements: {'/'.join(stack)}.")
+    return XmlDiagnosis(XML_MALFORMED, payload, None, stack, f"Malformed XML: {error.msg}")
+
+
+def _extra_content(payload: str, error: etree.XMLSyntaxError) -> XmlDiagnosis:
+    """
+    Content after the document element: trailing prose is dropped, repeated documents deduplicated.
+
+    Trailing text that contains further elements is left to the repair, as they may
+    belong in the document.
+    """
+    line, column = error.position
+    data = payload.encode("utf-8")
+    offset = sum(len(l) + 1 for l in data.split(b"\n")[:line - 1]) + column - 1 # libxml2 columns count bytes
+    document, extra = data[:offset].decode("utf-8", "replace").rstrip(), data[offset:].decode("utf-8", "replace").strip()
+    roots = extract_xml_payload(extra)
+    if roots is None:
+        return XmlDiagnosis(XML_MULTIPLE_ROOTS, payload, document, message="Text after the document element.")
+    if _canonical_roots(roots) == {_canonical(document)}:
+        return XmlDiagnosis(XML_MULTIPLE_ROOTS, payload, document, message="The document is repeated.")
+    if not _XML_START_RE.match(extra):
+        return XmlDiagnosis(XML_MULTIPLE_ROOTS, payload, None,
+                            message="Text after the document element contains further elements; move them into the document element.")
+    return XmlDiagnosis(XML_MULTIPLE_ROOTS, payload, None,
+                        message="Output has several root elements; wrap them in a single document element.")
+
+
+def _canonical(xml: str) -> str | None:
+    try:
+        return etree.tostring(etree.fromstring(xml.encode("utf-8"), etree.XMLParser(remove_blank_text=True)), method="c14n").decode("utf-8")
+    except etree.XMLSyntaxError:
+        return None
+
+
+def _canonical_roots(xml: str) -> set[str | None]:
+    """Canonical forms of each top-level element of a sequence of documents."""
+    try:
+        wrapper = etree.fromstring(f"<wrapper>{re.sub(r'<[?]xml[^>]*[?]>', '', xml)}</wrapper>".encode("utf-8"),
+                                   etree.XMLParser(remove_blank_text=True))
+    except etree.XMLSyntaxError:
+        return {None}
+    return {etree.tostring(child, method="c14n").decode("utf-8") for child in wrapper if isinstance(child.tag, str)}
+
+
+def _recover_unbalanced(payload: str) -> str | None:
+    """lxml's recovering parse, accepted only if it kept every element of the answer."""
+    root = etree.fromstring(payload.encode("utf-8"), etree.XMLParser(recover=True))
+    if root is None or sum(1 for e in root.iter() if isinstance(e.tag, str)) != len(_START_TAG_RE.findall(payload)):
+        return None
+    return etree.tostring(root, encoding="unicode")
+
+
+def _at_end(payload: str, error: etree.XMLSyntaxError) -> bool:
+    """True if the syntax error is reported at the end of the input (the answer stopped early)."""
+    line, _ = error.position
+    return line >= payload.count("\n") + 1
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def write_batch_file(prompts: dict[str, str], path: str | Path, request_params: Callable[[str], dict]) -> Path:
+    """
+    Writes one JSONL line per prompt in the provider's batch input format.
+
+    Args:
+        prompts: Mapping of custom_id (e.g. '<req_id>::<method>') to prompt.
+        path: Output path of the job file.
+        request_params: Function building the chat completion body for a prompt.
+
+    Returns:
+        The path of the written job file.
+    """
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, prompt in prompts.items():
+            line = {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": request_params(prompt)}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    logger.info(f"Wrote batch job file with {len(prompts)} requests: {path}")
+    return path
+
+
+def parse_batch_output(lines: list[str]) -> dict[str, str | None]:
+    """Maps custom_id to generated text (None for failed lines) from batch output JSONL."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error") or response.get("status_code", 200) != 200 or not body.get("choices"):
+            logger.warning(f"Batch request '{custom_id}' failed: {record.get('error') or response.get('status_code')}")
+            results[custom_id] = None
+            continue
+        content = body["choices"][0].get("message", {}).get("content")
+        results[custom_id] = content.strip() if content else None
+    return results
+
+
+class OpenAIBatchBackend:
+    """Submits job files through the OpenAI Batch API (files + batches endpoints)."""
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, job_path: Path) -> str:
+        with open(job_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=self.completion_window
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        return self.client.batches.retrieve(job_id).status
+
+    def results(self, job_id: str) -> list[str]:
+        batch = self.client.batches.retrieve(job_id)
+        lines = []
+        for file_id in (batch.output_file_id, getattr(batch, "error_file_id", None)):
+            if file_id:
+                lines.extend(self.client.files.content(file_id).text.splitlines())
+        return lines
+
+
+class LocalBatchBackend:
+    """
+    In-process stand-in for the batch API, used in tests and offline runs.
+
+    Jobs complete on the first status poll; each request is answered by `responder`
+    (for example an LLMClient's generate_text pointed at the stub server).
+    """
+
+    def __init__(self, responder: Callable[[str], str | None]):
+        self.responder = responder
+        self.jobs = {} # job_id -> job file path
+        self.submitted_requests = 0
+
+    def submit(self, job_path: Path) -> str:
+        job_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        self.jobs[job_id] = Path(job_path)
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        return "completed" if job_id in self.jobs else "failed"
+
+    def results(self, job_id: str) -> list[str]:
+        lines = []
+        with open(self.jobs[job_id], "r", encoding="utf-8") as f:
+            for line in f:
+                request = json.loads(line)
+                self.submitted_requests += 1
+                prompt = request["body"]["messages"][-1]["content"]
+                text = self.responder(prompt)
+                if text is None:
+                    record = {"custom_id": request["custom_id"], "response": None,
+                              "error": {"code": "local_failure", "message": "Responder returned no text."}}
+                else:
+                    record = {"custom_id": request["custom_id"], "error": None, "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                              "finish_reason": "stop"}]}}}
+                lines.append(json.dumps(record))
+        return lines
+
+
+def run_batch(backend, prompts: dict[str, str], job_path: str | Path, request_params: Callable[[str], dict],
+              poll_interval_s: float = 30.0, max_wait_s: float | None = None) -> dict[str, str | None]:
+    """
+    Writes, submits and polls a batch job, returning results keyed by custom_id.
+
+    Prompts that are missing from the output (or the whole job, if it fails or times out)
+    map to None so callers can fall back to interactive calls.
+    """
+    results = {custom_id: None for custom_id in prompts}
+    if not prompts:
+        return results
+    job_path = write_batch_file(prompts, job_path, request_params)
+    job_id = backend.submit(job_path)
+    logger.info(f"Submitted batch job {job_id} ({len(prompts)} requests).")
+
+    started = time.monotonic()
+    while True:
+        status = backend.status(job_id)
+        if status in TERMINAL_STATES:
+            break
+        if max_wait_s is not None and time.monotonic() - started > max_wait_s:
+            logger.error(f"Batch job {job_id} still '{status}' after {max_wait_s:.0f}s; giving up on it.")
+            return results
+        logger.debug(f"Batch job {job_id} status: {status}")
+        time.sleep(poll_interval_s)
+
+    if status != "completed":
+        logger.error(f"Batch job {job_id} ended with status '{status}'.")
+        return results
+    results.update(parse_batch_output(backend.results(job_id)))
+    succeeded = sum(1 for text in results.values() if text is not None)
+    logger.info(f"Batch job {job_id} completed: {succeeded}/{len(prompts)} requests succeeded.")
+    return results
@@ -0,0 +1,43 @@
+import logging
+import re
+
+from .xml_stream import XmlStreamMonitor, STREAM_CONTINUE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONTINUATIONS = 2 # Continuation requests per call before returning the truncated text
+MIN_OVERLAP_CHARS = 16 # Shorter repeats at the seam may be coincidental (e.g. a lone '<')
+MAX_OVERLAP_CHARS = 2000 # How far back a continuation that repeats the answer's tail is matched
+
+_LEADING_FENCE_RE = re.compile(r"^\s*```[\w-]*[ \t]*\n?")
+_TRAILING_FENCE_RE = re.compile(r"\n?[ \t]*```\s*$")
+
+
+def truncated_open_elements(text: str) -> list[str] | None:
+    """
+    Open-element stack of an XML answer that stopped before its root element closed.
+
+    Returns:
+        The open elements (outermost first), or None if the text is complete XML, not
+        XML at all, or malformed (continuing it would not help).
+    """
+    monitor = XmlStreamMonitor(max_preamble_chars=len(text))
+    if monitor.feed(text) != STREAM_CONTINUE or not monitor.open_elements:
+        return None
+    return monitor.open_elements
+
+
+def stitch_continuation(partial: str, continuation: str) -> str:
+    """
+    Appends a continuation to a truncated answer.
+
+    Code fences around the continuation are dropped, and so is a repeat of the
+    answer's tail at its start (models often restate the last line before continuing).
+    """
+    piece = _TRAILING_FENCE_RE.sub("", _LEADING_FENCE_RE.sub("", continuation, count=1))
+    for size in range(min(len(partial), len(piece), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if partial.endswith(piece[:size]):
+            logger.debug(f"Continuation repeats the last {size} chars of the answer; dropped.")
+            piece = piece[size:]
+            break
+    return partial + piece
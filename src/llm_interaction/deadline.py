@@ -0,0 +1,43 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Absolute time.monotonic() deadline for all LLM calls made in the current context.
+# Context variables are copied into asyncio tasks and asyncio.to_thread, so the
+# budget follows the work wherever it is scheduled.
+_current_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """
+    Limits every LLM call made inside the block to a shared time budget.
+
+    Nested scopes can only tighten the deadline, never extend it.
+
+    Args:
+        seconds: Budget in seconds for the block, or None for no limit.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _current_deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """Seconds left in the enclosing deadline_scope (may be negative), or None if unbounded."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
@@ -1,7 +1,22 @@
 
+import asyncio
+import json
 import logging
 import os
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 # Add imports for specific LLM libraries (e.g., openai, langchain)
+from .response_cache import ResponseCache, DEFAULT_MAX_BYTES
+from .rate_limiter import estimate_tokens, get_shared_limiter, parse_retry_after
+from .batch import LocalBatchBackend, OpenAIBatchBackend, run_batch
+from .deadline import remaining_time
+from .telemetry import CallStats, current_tracker, record_call
+from .continuation import DEFAULT_MAX_CONTINUATIONS, stitch_continuation, truncated_open_elements
+from .prompt_formatter import format_continuation_prompt
+from .xml_stream import XmlStreamMonitor, STREAM_CONTINUE, DEFAULT_MAX_PREAMBLE_CHARS
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +36,61 @@ class LLMClient:
         self.provider = llm_config.get("default_provider", "openai")
         self.model = llm_config.get("default_model", "gpt-4") # Example default
         self.client = None # Placeholder for the actual LLM API client
+        self.async_client = None # Async counterpart used by generate_text_async / generate_many
+        self.max_concurrency = llm_config.get("max_concurrency", 8) # Max in-flight async requests
+        self._semaphores = {} # One semaphore per event loop (asyncio primitives are loop-bound)
+        self.cache = None # Optional persistent ResponseCache
+        self.rate_limiter = None # Optional process-wide RateLimiter shared per provider/model
+        self.max_rate_limit_retries = 0
+        self.streaming = llm_config.get("streaming", False) # Stream and stop once the XML root closes
+        self.hedging_enabled = (llm_config.get("hedging") or {}).get("enabled", False)
+        self.hedged_count = 0
+        self._latencies = deque(maxlen=(llm_config.get("hedging") or {}).get("window", 200))
+        self._latency_lock = threading.Lock()
+        self._hedge_executor = None
+        self._prefilled = {} # (prompt, response_format) -> texts produced ahead of time (e.g. by a batch job), each served once
+        self._prefill_lock = threading.Lock()
         logger.info(f"Initializing LLMClient for provider '{self.provider}' and model '{self.model}'")
+        self._setup_cache()
+        self._setup_rate_limiter()
         self._setup_client()
 
+    def _setup_cache(self):
+        """Opens the on-disk response cache if enabled in the config."""
+        cache_config = self.config.get("cache") or {}
+        if not cache_config.get("enabled", False):
+            return
+        mode = cache_config.get("mode", "read_write") # 'read_write' or 'replay_only'
+        if mode not in ("read_write", "replay_only"):
+            logger.error(f"Unknown LLM cache mode '{mode}'. Cache disabled.")
+            return
+        try:
+            self.cache = ResponseCache(
+                cache_config.get("path", "results/cache/llm_responses.sqlite"),
+                max_bytes=cache_config.get("max_bytes", DEFAULT_MAX_BYTES),
+                replay_only=(mode == "replay_only")
+            )
+        except Exception as e:
+            logger.error(f"Failed to open LLM response cache: {e}", exc_info=True)
+            self.cache = None
+
+    def _setup_rate_limiter(self):
+        """Attaches the shared client-side rate limiter if limits are configured (see _limiter_key)."""
+        rate_config = self.config.get("rate_limit") or {}
+        rpm = rate_config.get("requests_per_minute")
+        tpm = rate_config.get("tokens_per_minute")
+        self.max_rate_limit_retries = rate_config.get("max_retries", 3)
+        if rpm or tpm:
+            self.rate_limiter = get_shared_limiter(self._limiter_key(), rpm, tpm)
+
+    def _limiter_key(self) -> str:
+        """
+        Identity of the deployment whose quota the limiter tracks: clients of the same
+        provider/model share it, but each endpoint of a router pool gets its own.
+        """
+        deployment = self.config.get("endpoint_name") or self.config.get("base_url") or "default"
+        return f"{self.provider}:{self.model}:{deployment}"
+
     def _setup_client(self):
         """Sets up the specific LLM client based on the provider."""
         api_key = self.api_keys.get(self.provider)
@@ -42,7 +109,9 @@ class LLMClient:
                 import openai
                 # Use the new client initialization method (check OpenAI docs)
                 # openai.api_key = api_key # Old way
-                self.client = openai.OpenAI(api_key=api_key) # Example for newer versions
+                base_url = self.config.get("base_url") # e.g. the local stub server for load tests
+                self.client = openai.OpenAI(api_key=api_key, base_url=base_url) # Example for newer versions
+                self.async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
                 logger.info("OpenAI client initialized.")
             # Add elif blocks for other providers (Azure, HuggingFace via transformers/langchain, etc.)
             # elif self.provider == "huggingface":
@@ -58,33 +127,49 @@ class LLMClient:
             logger.error(f"Failed to initialize LLM client for '{self.provider}': {e}", exc_info=True)
 
 
-    def generate_text(self, prompt: str) -> str | None:
+    def generate_text(self, prompt: str, timeout: float | None = None, response_format: dict | None = None) -> str | None:
         """
         Sends a prompt to the LLM and returns the generated text.
 
         Args:
             prompt: The input prompt for the LLM.
+            timeout: Optional deadline in seconds for this call. It is further capped by
+                     llm.request_timeout_s and by any enclosing deadline_scope.
+            response_format: Provider structured-output setting, e.g. {"type": "json_object"}.
+                     Such calls are never streamed (the stream monitor expects XML) nor continued.
+
+        An XML answer cut off at max_tokens (finish_reason 'length') is completed by up to
+        llm.max_continuations continuation requests resuming from its open elements.
 
         Returns:
             The generated text as a string, or None if an error occurred.
+
+        Raises:
+            CacheMissError: If the response cache is in replay-only mode and has no entry for the prompt.
         """
+        stats = CallStats(model=self.model)
+        started = time.monotonic()
+        cache_key, cached = self._cache_lookup(prompt, response_format)
+        if cached is not None:
+            self._finish_stats(stats, started, cached=True)
+            return cached
+
         if not self.client:
             logger.error("LLM client is not initialized. Cannot generate text.")
             return None
 
+        deadline_at = self._deadline_at(timeout)
         logger.debug(f"Sending prompt to LLM (model: {self.model}):\n{prompt[:100]}...") # Log truncated prompt
         try:
             if self.provider == "openai":
                 # Example using OpenAI's chat completion endpoint (adjust as needed)
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=self.config.get("temperature", 0.7),
-                    max_tokens=self.config.get("max_tokens", 1024),
-                    # Add other parameters as needed
-                )
-                # Accessing the response content might vary slightly based on API version
-                generated_text = response.choices[0].message.content.strip()
+                if self.hedging_enabled:
+                    generated_text = self._request_text_hedged(prompt, deadline_at, stats, response_format)
+                else:
+                    generated_text = self._request_text(prompt, deadline_at, stats, response_format)
+                if stats.finish_reason == "length" and response_format is None:
+                    generated_text = self._continue_truncated(prompt, generated_text, deadline_at)
+                generated_text = generated_text.strip()
 
             # Add elif blocks for other providers
             # elif self.provider == "huggingface":
@@ -97,11 +182,588 @@ class LLMClient:
                 return None
 
             logger.debug(f"LLM response received:\n{generated_text[:100]}...")
+            self._cache_store(cache_key, generated_text)
+            self._finish_stats(stats, started, success=True)
             return generated_text
 
+        except TimeoutError as e:
+            logger.error(f"LLM call exceeded its deadline ({self.provider}): {e}")
+            self._finish_stats(stats, started)
+            return None
         except Exception as e:
             logger.error(f"Error during LLM API call ({self.provider}): {e}", exc_info=True)
+            self._finish_stats(stats, started)
+            return None
+
+    async def generate_text_async(self, prompt: str, timeout: float | None = None,
+                                  response_format: dict | None = None) -> str | None:
+        """
+        Async variant of generate_text, bounded by the client's concurrency limit.
+
+        Args:
+            prompt: The input prompt for the LLM.
+            timeout: Optional deadline in seconds for this call (see generate_text).
+            response_format: Provider structured-output setting (see generate_text).
+
+        Returns:
+            The generated text as a string, or None if an error occurred.
+
+        Raises:
+            CacheMissError: If the response cache is in replay-only mode and has no entry for the prompt.
+        """
+        stats = CallStats(model=self.model)
+        started = time.monotonic()
+        cache_key, cached = self._cache_lookup(prompt, response_format)
+        if cached is not None:
+            self._finish_stats(stats, started, cached=True)
+            return cached
+
+        if not self.async_client:
+            logger.error("Async LLM client is not initialized. Cannot generate text.")
+            return None
+
+        deadline_at = self._deadline_at(timeout)
+        logger.debug(f"Sending async prompt to LLM (model: {self.model}):\n{prompt[:100]}...")
+        try:
+            if self.provider == "openai":
+                request = self._request_text_hedged_async(prompt, deadline_at, stats, response_format) if self.hedging_enabled \
+                    else self._request_text_async(prompt, deadline_at, stats, response_format)
+                if deadline_at is not None:
+                    generated_text = await asyncio.wait_for(request, max(0.0, deadline_at - time.monotonic()))
+                else:
+                    generated_text = await request
+                if stats.finish_reason == "length" and response_format is None:
+                    generated_text = await self._continue_truncated_async(prompt, generated_text, deadline_at)
+                generated_text = generated_text.strip()
+            else:
+                logger.error(f"Async generation logic not implemented for provider: {self.provider}")
+                return None
+
+            logger.debug(f"Async LLM response received:\n{generated_text[:100]}...")
+            self._cache_store(cache_key, generated_text)
+            self._finish_stats(stats, started, success=True)
+            return generated_text
+
+        except TimeoutError as e:
+            logger.error(f"Async LLM call exceeded its deadline ({self.provider}): {e}")
+            self._finish_stats(stats, started)
+            return None
+        except Exception as e:
+            logger.error(f"Error during async LLM API call ({self.provider}): {e}", exc_info=True)
+            self._finish_stats(stats, started)
+            return None
+
+    async def generate_many(self, prompts: list[str]) -> list[str | None]:
+        """
+        Sends several prompts concurrently (at most max_concurrency in flight).
+
+        Args:
+            prompts: The input prompts.
+
+        Returns:
+            The generated texts in the same order as the prompts (None for failed calls).
+        """
+        logger.info(f"Dispatching {len(prompts)} prompts (max concurrency: {self.max_concurrency})")
+        return list(await asyncio.gather(*(self.generate_text_async(p) for p in prompts)))
+
+    def generate_batch(self, prompts: dict[str, str], job_path: str, backend=None,
+                       response_formats: dict[str, dict] | None = None) -> dict[str, str | None]:
+        """
+        Generates many prompts through an offline batch job instead of interactive calls.
+
+        Successful results are also prefilled (and cached, if enabled), so later
+        generate_text calls with the same prompts return them without an API call.
+        Each result is served once, so a prompt submitted for several custom_ids
+        yields one result per call.
+
+        Args:
+            prompts: Mapping of custom_id (e.g. '<req_id>::<method>') to prompt.
+            job_path: Where to write the JSONL job file.
+            backend: Batch backend; defaults to llm.batch.backend ('openai' or 'local').
+            response_formats: Optional custom_id -> response_format (e.g. JSON mode), as
+                generate_text would send for the same prompt.
+
+        Returns:
+            Mapping of custom_id to generated text (None where the batch had no result).
+        """
+        batch_config = self.config.get("batch") or {}
+        if backend is None:
+            if batch_config.get("backend", "openai") == "local":
+                backend = LocalBatchBackend(self.generate_text)
+            elif self.client:
+                backend = OpenAIBatchBackend(self.client, batch_config.get("completion_window", "24h"))
+            else:
+                logger.error("LLM client is not initialized. Cannot submit batch job.")
+                return {custom_id: None for custom_id in prompts}
+        formats = {prompts[custom_id]: response_format for custom_id, response_format in (response_formats or {}).items()
+                   if custom_id in prompts}
+        try:
+            results = run_batch(
+                backend, prompts, job_path, lambda prompt: self._completion_kwargs(prompt, response_format=formats.get(prompt)),
+                poll_interval_s=batch_config.get("poll_interval_s", 30.0),
+                max_wait_s=batch_config.get("max_wait_s")
+            )
+        except Exception as e:
+            logger.error(f"Batch job failed: {e}", exc_info=True)
+            return {custom_id: None for custom_id in prompts}
+
+        for custom_id, text in results.items():
+            if text and custom_id in prompts:
+                self.prefill(prompts[custom_id], text, (response_formats or {}).get(custom_id))
+        return results
+
+    def prefill(self, prompt: str, text: str, response_format: dict | None = None):
+        """Registers a response produced ahead of time for `prompt`; it is served to one later call."""
+        with self._prefill_lock:
+            self._prefilled.setdefault(_prefill_key(prompt, response_format), deque()).append(text)
+        if self.cache:
+            self._cache_store(self._cache_key(prompt, response_format), text)
+
+    def _request_text(self, prompt: str, deadline_at: float | None, stats: CallStats,
+                      response_format: dict | None = None, allow_stream: bool = True) -> str:
+        """
+        Sends one completion (rate-limited, retried on HTTP 429) and returns its text.
+
+        allow_stream=False forces a plain request, e.g. for continuations, which are not a
+        document on their own and would be aborted by the stream monitor.
+        """
+        request_tokens = estimate_tokens(prompt, self.config.get("max_tokens", 1024))
+        for attempt in range(self.max_rate_limit_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(request_tokens, deadline_at)
+            started = time.monotonic()
+            try:
+                stream = self.streaming and response_format is None and allow_stream
+                response = self.client.chat.completions.create(
+                    **self._completion_kwargs(prompt, stream, self._attempt_timeout(deadline_at), response_format)
+                )
+                if stream:
+                    generated_text = self._consume_stream(response, prompt, stats, started)
+                else:
+                    generated_text = self._extract_text(response)
+                    self._record_usage(stats, response, prompt, generated_text, started)
+            except Exception as e:
+                if not self._should_retry_rate_limit(e, attempt):
+                    raise
+                stats.retries += 1
+                time.sleep(self._backoff_delay(e, attempt, deadline_at))
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.record_success()
+            self._record_latency(time.monotonic() - started)
+            return generated_text
+
+    async def _request_text_async(self, prompt: str, deadline_at: float | None, stats: CallStats,
+                                  response_format: dict | None = None, allow_stream: bool = True) -> str:
+        """Async counterpart of _request_text; the semaphore is held only while a request is in flight."""
+        request_tokens = estimate_tokens(prompt, self.config.get("max_tokens", 1024))
+        for attempt in range(self.max_rate_limit_retries + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async(request_tokens, deadline_at)
+            try:
+                async with self._get_semaphore():
+                    started = time.monotonic()
+                    stream = self.streaming and response_format is None and allow_stream
+                    response = await self.async_client.chat.completions.create(
+                        **self._completion_kwargs(prompt, stream, self._attempt_timeout(deadline_at), response_format)
+                    )
+                    if stream:
+                        generated_text = await self._consume_stream_async(response, prompt, stats, started)
+                    else:
+                        generated_text = self._extract_text(response)
+                        self._record_usage(stats, response, prompt, generated_text, started)
+            except Exception as e:
+                if not self._should_retry_rate_limit(e, attempt):
+                    raise
+                stats.retries += 1
+                await asyncio.sleep(self._backoff_delay(e, attempt, deadline_at))
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.record_success()
+            self._record_latency(time.monotonic() - started)
+            return generated_text
+
+    def _request_text_hedged(self, prompt: str, deadline_at: float | None, stats: CallStats,
+                             response_format: dict | None = None) -> str:
+        """
+        Sends the request and, if it is still running after the observed p95 latency,
+        a duplicate; returns whichever finishes first.
+        """
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return self._request_text(prompt, deadline_at, stats, response_format)
+
+        executor = self._get_hedge_executor()
+        attempt_stats = {}
+        primary_stats = CallStats(model=self.model, started_at=time.monotonic())
+        primary = executor.submit(self._request_text, prompt, deadline_at, primary_stats, response_format)
+        attempt_stats[primary] = primary_stats
+        done, _ = wait([primary], timeout=hedge_after)
+        if not done:
+            logger.info(f"LLM request slower than p95 ({hedge_after:.2f}s); sending hedged duplicate.")
+            self.hedged_count += 1
+            stats.hedged = True
+            backup_stats = CallStats(model=self.model, started_at=time.monotonic())
+            backup = executor.submit(self._request_text, prompt, deadline_at, backup_stats, response_format)
+            attempt_stats[backup] = backup_stats
+
+        pending = set(attempt_stats)
+        while pending:
+            remaining = None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("Hedged LLM request exceeded its deadline.")
+            for future in done:
+                if future.exception() is None:
+                    stats.absorb(attempt_stats[future])
+                    tracker = current_tracker()
+                    for loser in attempt_stats.keys() - {future}:
+                        # The slower request finishes in the background; its answer is discarded, its tokens are not
+                        loser.add_done_callback(partial(self._record_hedge_loser, tracker, attempt_stats[loser]))
+                    return future.result()
+            if not pending:
+                stats.absorb(primary_stats)
+                raise done.pop().exception()
+
+    @staticmethod
+    def _record_hedge_loser(tracker, stats: CallStats, future):
+        """Reports the losing attempt of a hedged call as its own call once it finishes."""
+        stats.latency_s = time.monotonic() - stats.started_at
+        stats.hedged = True
+        stats.success = not future.cancelled() and future.exception() is None
+        if tracker is not None:
+            tracker.record(stats)
+        logger.debug(f"Hedged LLM attempt finished after losing: {stats}")
+
+    async def _request_text_hedged_async(self, prompt: str, deadline_at: float | None, stats: CallStats,
+                                         response_format: dict | None = None) -> str:
+        """Async counterpart of _request_text_hedged; the losing request is cancelled."""
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return await self._request_text_async(prompt, deadline_at, stats, response_format)
+
+        attempt_stats = {}
+        primary_stats = CallStats(model=self.model)
+        primary = asyncio.create_task(self._request_text_async(prompt, deadline_at, primary_stats, response_format))
+        attempt_stats[primary] = primary_stats
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if not done:
+            logger.info(f"Async LLM request slower than p95 ({hedge_after:.2f}s); sending hedged duplicate.")
+            self.hedged_count += 1
+            stats.hedged = True
+            backup_stats = CallStats(model=self.model)
+            backup = asyncio.create_task(self._request_text_async(prompt, deadline_at, backup_stats, response_format))
+            attempt_stats[backup] = backup_stats
+
+        pending = set(attempt_stats)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        stats.absorb(attempt_stats[task])
+                        return task.result()
+                if not pending:
+                    stats.absorb(primary_stats)
+                    raise done.pop().exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _continue_truncated(self, prompt: str, text: str, deadline_at: float | None) -> str:
+        """
+        Completes an answer that hit max_tokens by asking the LLM to continue from its
+        open elements; each continuation is recorded as its own call. Returns the
+        stitched text (still truncated if the continuations ran out or failed).
+        """
+        for round_index in range(self.config.get("max_continuations", DEFAULT_MAX_CONTINUATIONS)):
+            open_elements = truncated_open_elements(text)
+            if open_elements is None:
+                break # Complete, not XML, or malformed: continuing would not help
+            logger.info(f"LLM output truncated at max_tokens inside {'/'.join(open_elements)}; "
+                        f"requesting continuation {round_index + 1}.")
+            stats = CallStats(model=self.model)
+            started = time.monotonic()
+            try:
+                continuation = self._request_text(format_continuation_prompt(prompt, text, open_elements), deadline_at, stats,
+                                                  allow_stream=False)
+            except Exception as e:
+                logger.warning(f"Continuation request failed ({e}); returning the truncated output.")
+                self._finish_stats(stats, started)
+                break
+            self._finish_stats(stats, started, success=True)
+            text = stitch_continuation(text, continuation)
+            if stats.finish_reason != "length":
+                break
+        return text
+
+    async def _continue_truncated_async(self, prompt: str, text: str, deadline_at: float | None) -> str:
+        """Async counterpart of _continue_truncated."""
+        for round_index in range(self.config.get("max_continuations", DEFAULT_MAX_CONTINUATIONS)):
+            open_elements = truncated_open_elements(text)
+            if open_elements is None:
+                break
+            logger.info(f"Async LLM output truncated at max_tokens inside {'/'.join(open_elements)}; "
+                        f"requesting continuation {round_index + 1}.")
+            stats = CallStats(model=self.model)
+            started = time.monotonic()
+            try:
+                continuation = await self._request_text_async(
+                    format_continuation_prompt(prompt, text, open_elements), deadline_at, stats, allow_stream=False
+                )
+            except Exception as e:
+                logger.warning(f"Continuation request failed ({e}); returning the truncated output.")
+                self._finish_stats(stats, started)
+                break
+            self._finish_stats(stats, started, success=True)
+            text = stitch_continuation(text, continuation)
+            if stats.finish_reason != "length":
+                break
+        return text
+
+    def _deadline_at(self, timeout: float | None) -> float | None:
+        """Combines the per-call timeout, llm.request_timeout_s and the enclosing deadline_scope."""
+        candidates = [t for t in (timeout, self.config.get("request_timeout_s"), remaining_time()) if t is not None]
+        if not candidates:
+            return None
+        return time.monotonic() + min(candidates)
+
+    @staticmethod
+    def _attempt_timeout(deadline_at: float | None) -> float | None:
+        """Seconds left for the next HTTP attempt; raises TimeoutError once the deadline has passed."""
+        if deadline_at is None:
             return None
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("LLM request deadline exceeded before sending.")
+        return remaining
+
+    def _record_latency(self, seconds: float):
+        """Keeps a sliding window of successful request latencies for hedging decisions."""
+        with self._latency_lock:
+            self._latencies.append(seconds)
+
+    def _hedge_delay(self) -> float | None:
+        """Observed latency quantile after which a hedged duplicate is sent (None until enough samples)."""
+        hedging_config = self.config.get("hedging") or {}
+        with self._latency_lock:
+            samples = sorted(self._latencies)
+        if len(samples) < hedging_config.get("min_samples", 20):
+            return None
+        quantile = hedging_config.get("quantile", 0.95)
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        """Thread pool running the sync primary/backup requests of a hedged call."""
+        with self._latency_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=max(2, 2 * self.max_concurrency), thread_name_prefix="llm-hedge"
+                )
+            return self._hedge_executor
+
+    def _consume_stream(self, stream, prompt: str, stats: CallStats, started: float) -> str:
+        """Reads a streamed completion, closing the stream early once the XML is complete or hopeless."""
+        monitor = self._new_stream_monitor()
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if self._feed_chunk(monitor, chunk, stats, started) != STREAM_CONTINUE:
+                    break
+        finally:
+            stream.close() # Cancels the HTTP response if we stopped early
+        self._log_stream_outcome(monitor)
+        text = monitor.text # Stripped by the caller, after any continuation is stitched on
+        self._record_stream_usage(stats, usage, prompt, text)
+        return text
+
+    async def _consume_stream_async(self, stream, prompt: str, stats: CallStats, started: float) -> str:
+        """Async counterpart of _consume_stream."""
+        monitor = self._new_stream_monitor()
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if self._feed_chunk(monitor, chunk, stats, started) != STREAM_CONTINUE:
+                    break
+        finally:
+            await stream.close()
+        self._log_stream_outcome(monitor)
+        text = monitor.text # Stripped by the caller, after any continuation is stitched on
+        self._record_stream_usage(stats, usage, prompt, text)
+        return text
+
+    def _feed_chunk(self, monitor: XmlStreamMonitor, chunk, stats: CallStats, started: float) -> str:
+        """Feeds one streamed chunk to the monitor, noting time to first token and finish reason."""
+        text = self._chunk_text(chunk)
+        if text and stats.ttft_s is None:
+            stats.ttft_s = time.monotonic() - started
+        if chunk.choices and getattr(chunk.choices[0], "finish_reason", None):
+            stats.finish_reason = chunk.choices[0].finish_reason
+        return monitor.feed(text)
+
+    def _new_stream_monitor(self) -> XmlStreamMonitor:
+        return XmlStreamMonitor(self.config.get("stream_max_preamble_chars", DEFAULT_MAX_PREAMBLE_CHARS))
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Extracts the text delta from a streamed chat completion chunk."""
+        if not chunk.choices:
+            return ""
+        return chunk.choices[0].delta.content or ""
+
+    @staticmethod
+    def _log_stream_outcome(monitor: XmlStreamMonitor):
+        if monitor.state == STREAM_CONTINUE:
+            logger.debug("Stream ended before the XML root element closed.")
+        else:
+            logger.debug(f"Stream finished with state '{monitor.state}' after {len(monitor.text)} chars.")
+
+    def _record_usage(self, stats: CallStats, response, prompt: str, generated_text: str, started: float):
+        """Copies token usage and finish reason from a non-streaming response."""
+        stats.ttft_s = time.monotonic() - started # The whole answer arrives at once
+        stats.finish_reason = getattr(response.choices[0], "finish_reason", None) if response.choices else None
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            stats.prompt_tokens = usage.prompt_tokens or 0
+            stats.completion_tokens = usage.completion_tokens or 0
+        else:
+            stats.prompt_tokens = estimate_tokens(prompt)
+            stats.completion_tokens = estimate_tokens(generated_text)
+            stats.usage_estimated = True
+
+    def _record_stream_usage(self, stats: CallStats, usage, prompt: str, generated_text: str):
+        """Uses the final usage chunk if it arrived, otherwise estimates (e.g. stream closed early)."""
+        if usage is not None:
+            stats.prompt_tokens = usage.prompt_tokens or 0
+            stats.completion_tokens = usage.completion_tokens or 0
+        else:
+            stats.prompt_tokens = estimate_tokens(prompt)
+            stats.completion_tokens = estimate_tokens(generated_text)
+            stats.usage_estimated = True
+
+    def _finish_stats(self, stats: CallStats, started: float, success: bool = False, cached: bool = False):
+        """Stamps total latency on the call's stats and reports them to the active UsageTracker."""
+        stats.started_at = started
+        stats.latency_s = time.monotonic() - started
+        stats.success = success or cached
+        stats.cached = cached
+        record_call(stats)
+
+    def _should_retry_rate_limit(self, error: Exception, attempt: int) -> bool:
+        """True if the error is an HTTP 429 and the limiter still has retries left."""
+        if getattr(error, "status_code", None) != 429 or not self.rate_limiter:
+            return False
+        if attempt >= self.max_rate_limit_retries:
+            logger.error(f"Rate limited after {attempt + 1} attempts; giving up.")
+            return False
+        return True
+
+    def _backoff_delay(self, error: Exception, attempt: int, deadline_at: float | None) -> float:
+        """
+        Back-off before retrying a rate-limited request.
+
+        Raises:
+            TimeoutError: If the back-off would run past the deadline (no point sleeping first).
+        """
+        delay = self.rate_limiter.record_rate_limited(self._retry_after(error), attempt)
+        if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            raise TimeoutError(f"Rate limit back-off of {delay:.2f}s would exceed the request deadline.") from error
+        return delay
+
+    @staticmethod
+    def _retry_after(error: Exception) -> float | None:
+        """Reads the provider's Retry-After hint from a rate limit error, if present."""
+        response = getattr(error, "response", None)
+        return parse_retry_after(getattr(response, "headers", None))
+
+    def _cache_lookup(self, prompt: str, response_format: dict | None = None) -> tuple[str | None, str | None]:
+        """Returns (cache_key, cached_text); both None when caching is disabled."""
+        prefilled = self._take_prefilled(prompt, response_format)
+        if prefilled is not None:
+            logger.debug("LLM response served from prefilled batch results.")
+            return None, prefilled
+        if not self.cache:
+            return None, None
+        cache_key = self._cache_key(prompt, response_format)
+        cached = self.cache.get(cache_key) # Raises CacheMissError in replay-only mode
+        if cached is not None:
+            logger.debug(f"LLM response served from cache (key: {cache_key[:12]}).")
+        return cache_key, cached
+
+    def _take_prefilled(self, prompt: str, response_format: dict | None = None) -> str | None:
+        """Pops the next prefilled response for a prompt, if any."""
+        key = _prefill_key(prompt, response_format)
+        with self._prefill_lock:
+            texts = self._prefilled.get(key)
+            if not texts:
+                return None
+            text = texts.popleft()
+            if not texts:
+                del self._prefilled[key]
+            return text
+
+    def _cache_key(self, prompt: str, response_format: dict | None = None) -> str:
+        return ResponseCache.make_key(
+            self.provider, self.model,
+            self.config.get("temperature", 0.7), self.config.get("max_tokens", 1024),
+            prompt, response_format
+        )
+
+    def _cache_store(self, cache_key: str | None, generated_text: str):
+        """Persists a successful response if caching is enabled."""
+        if self.cache and cache_key and generated_text:
+            try:
+                self.cache.put(cache_key, generated_text)
+            except Exception as e:
+                logger.warning(f"Failed to write LLM response to cache: {e}")
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Returns the concurrency semaphore bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            # Drop semaphores of closed loops (e.g. previous asyncio.run calls)
+            self._semaphores = {l: s for l, s in self._semaphores.items() if not l.is_closed()}
+            semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    def _completion_kwargs(self, prompt: str, stream: bool = False, timeout: float | None = None,
+                           response_format: dict | None = None) -> dict:
+        """Builds the chat completion request parameters shared by sync and async calls."""
+        kwargs = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.config.get("temperature", 0.7),
+            "max_tokens": self.config.get("max_tokens", 1024),
+            # Add other parameters as needed
+        }
+        if stream:
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True} # Final chunk carries token usage
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+        return kwargs
+
+    @staticmethod
+    def _extract_text(response) -> str:
+        """
+        Pulls the generated text out of a chat completion response.
+
+        Not stripped: whitespace at the end of a truncated answer may belong to the text
+        a continuation completes. generate_text(_async) strips the final result.
+        """
+        # Accessing the response content might vary slightly based on API version
+        return response.choices[0].message.content or ""
+
+
+def _prefill_key(prompt: str, response_format: dict | None) -> tuple[str, str | None]:
+    """Prefilled responses are matched on the prompt and the response format (JSON mode answers differ)."""
+    return prompt, json.dumps(response_format, sort_keys=True) if response_format is not None else None
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -1,5 +1,10 @@
 import logging
 
+from .prompt_templates import (
+    BASIC_PROMPT, CONTINUATION_PROMPT, FEW_SHOT_EXAMPLE, FEW_SHOT_PROMPT, FRAGMENT_PROMPT, JSON_PROMPT, KG_ENHANCED_PROMPT, REPAIR_PROMPT, SKELETON_PROMPT, SLICE_REPAIR_FRAGMENT, SLICE_REPAIR_PROMPT
+)
+from .token_budget import count_tokens, fit_context
+
 logger = logging.getLogger(__name__)
 
 def format_basic_prompt(requirement_text: str) -> str:
@@ -12,43 +17,126 @@ def format_basic_prompt(requirement_text: str) -> str:
     Returns:
         The formatted prompt string.
     """
-    prompt = f"""
-Generate an AUTOSAR XML snippet corresponding to the following requirement.
-Ensure the XML is well-formed.
-
-Requirement:
-"{requirement_text}"
-
-AUTOSAR XML:
-"""
+    prompt = BASIC_PROMPT.render(requirement_text=requirement_text)
     logger.debug("Formatted basic prompt.")
     return prompt
 
-def format_kg_enhanced_prompt(requirement_text: str, kg_context: str) -> str:
+def format_kg_enhanced_prompt(requirement_text: str, kg_context: str,
+                              max_prompt_tokens: int | None = None, model: str | None = None) -> str:
     """
     Creates a prompt incorporating knowledge graph context.
 
     Args:
         requirement_text: The natural language requirement.
         kg_context: Relevant information retrieved from the knowledge graph.
+        max_prompt_tokens: Optional token budget for the whole prompt. Context lines are
+            ranked by relevance to the requirement and dropped until the prompt fits.
+        model: Model whose tokenizer is used to count tokens.
 
     Returns:
         The formatted prompt string.
     """
-    prompt = f"""
-Generate an AUTOSAR XML snippet corresponding to the following requirement.
-Use the provided Knowledge Graph Context to ensure correctness and consistency.
-Ensure the XML is well-formed.
+    if max_prompt_tokens is not None:
+        template_tokens = count_tokens(_kg_prompt(requirement_text, ""), model)
+        kg_context = fit_context(kg_context, requirement_text, max(0, max_prompt_tokens - template_tokens), model)
+    prompt = _kg_prompt(requirement_text, kg_context)
+    logger.debug("Formatted KG-enhanced prompt.")
+    return prompt
 
-Requirement:
-"{requirement_text}"
+def _kg_prompt(requirement_text: str, kg_context: str) -> str:
+    return KG_ENHANCED_PROMPT.render(requirement_text=requirement_text, kg_context=kg_context)
 
-Knowledge Graph Context:
-{kg_context}
+def format_skeleton_prompt(requirement_text: str, skeleton: str, kg_context: str | None = None,
+                           max_prompt_tokens: int | None = None, model: str | None = None) -> str:
+    """
+    Creates a prompt asking the LLM to complete a schema-derived XML skeleton.
 
-AUTOSAR XML:
-"""
-    logger.debug("Formatted KG-enhanced prompt.")
+    Args:
+        requirement_text: The natural language requirement.
+        skeleton: Mandatory element skeleton with placeholder leaf values (see SkeletonBuilder).
+        kg_context: Optional knowledge graph context to include.
+        max_prompt_tokens: Optional token budget for the whole prompt; only the KG
+            context is trimmed to meet it.
+        model: Model whose tokenizer is used to count tokens.
+
+    Returns:
+        The formatted prompt string.
+    """
+    if kg_context and max_prompt_tokens is not None:
+        template_tokens = count_tokens(_skeleton_prompt(requirement_text, skeleton, ""), model)
+        kg_context = fit_context(kg_context, requirement_text, max(0, max_prompt_tokens - template_tokens), model)
+    prompt = _skeleton_prompt(requirement_text, skeleton, kg_context)
+    logger.debug("Formatted skeleton prompt.")
+    return prompt
+
+def _skeleton_prompt(requirement_text: str, skeleton: str, kg_context: str | None) -> str:
+    return SKELETON_PROMPT.render(requirement_text=requirement_text, skeleton=skeleton.strip(),
+                                  context_section=_context_section(kg_context))
+
+def _context_section(kg_context: str | None) -> str:
+    return f"\nKnowledge Graph Context:\n{kg_context}\n" if kg_context else ""
+
+def format_json_prompt(requirement_text: str, root_key: str | None = None, skeleton_json: str | None = None,
+                       kg_context: str | None = None, max_prompt_tokens: int | None = None,
+                       model: str | None = None) -> str:
+    """
+    Creates a prompt asking the LLM for the compact JSON object model of the XML.
+
+    Args:
+        requirement_text: The natural language requirement.
+        root_key: JSON key of the document element (e.g. 'autosar'), if known.
+        skeleton_json: Optional mandatory skeleton in JSON form to complete.
+        kg_context: Optional knowledge graph context to include.
+        max_prompt_tokens: Optional token budget for the whole prompt; only the KG
+            context is trimmed to meet it.
+        model: Model whose tokenizer is used to count tokens.
+
+    Returns:
+        The formatted prompt string.
+    """
+    if kg_context and max_prompt_tokens is not None:
+        template_tokens = count_tokens(_json_prompt(requirement_text, root_key, skeleton_json, ""), model)
+        kg_context = fit_context(kg_context, requirement_text, max(0, max_prompt_tokens - template_tokens), model)
+    prompt = _json_prompt(requirement_text, root_key, skeleton_json, kg_context)
+    logger.debug("Formatted JSON output prompt.")
+    return prompt
+
+def _json_prompt(requirement_text: str, root_key: str | None, skeleton_json: str | None, kg_context: str | None) -> str:
+    skeleton_section = (
+        "\nComplete this skeleton: replace each {{VALUE}} placeholder and add the optional elements "
+        f"the requirement needs.\n```json\n{skeleton_json}\n```\n"
+    ) if skeleton_json else ""
+    return JSON_PROMPT.render(requirement_text=requirement_text, root_hint=f' ("{root_key}")' if root_key else "",
+                              context_section=_context_section(kg_context), skeleton_section=skeleton_section)
+
+def format_fragment_prompt(requirement_text: str, element: str, name: str, skeleton: str,
+                           kg_context: str | None = None, max_prompt_tokens: int | None = None,
+                           model: str | None = None) -> str:
+    """
+    Creates a prompt for one element of a requirement that is generated in fragments.
+
+    Args:
+        requirement_text: The natural language requirement.
+        element: XSD element name of the fragment (e.g. 'I-SIGNAL').
+        name: Name of the instance to generate.
+        skeleton: Mandatory structure of the element (see SkeletonBuilder).
+        kg_context: Optional knowledge graph context for this element.
+        max_prompt_tokens: Optional token budget for the whole prompt; only the KG
+            context is trimmed to meet it.
+        model: Model whose tokenizer is used to count tokens.
+
+    Returns:
+        The formatted prompt string.
+    """
+    def render(context: str | None) -> str:
+        return FRAGMENT_PROMPT.render(requirement_text=requirement_text, element=element, name=name,
+                                      skeleton=skeleton.strip(), context_section=_context_section(context))
+
+    if kg_context and max_prompt_tokens is not None:
+        template_tokens = count_tokens(render(""), model)
+        kg_context = fit_context(kg_context, requirement_text, max(0, max_prompt_tokens - template_tokens), model)
+    prompt = render(kg_context)
+    logger.debug(f"Formatted fragment prompt for {element} '{name}'.")
     return prompt
 
 def format_repair_prompt(original_requirement: str, incorrect_xml: str, error_messages: list[str]) -> str:
@@ -64,13 +152,67 @@ def format_repair_prompt(original_requirement: str, incorrect_xml: str, error_me
         The formatted repair prompt string.
     """
     errors = "\n".join(f"- {e}" for e in error_messages)
-    prompt = f"""
-The following AUTOSAR XML was generated for the requirement below, but it failed validation.
-Please correct the XML based on the provided error messages.
+    prompt = REPAIR_PROMPT.render(requirement_text=original_requirement, incorrect_xml=incorrect_xml, errors=errors)
+    logger.debug("Formatted repair prompt.")
+    return prompt
+
+def format_slice_repair_prompt(original_requirement: str, fragments: list[dict]) -> str:
+    """
+    Creates a repair prompt containing only the failing fragments of a document.
 
-Original Requirement:
-"{original_requirement}"
+    Args:
+        original_requirement: The initial requirement.
+        fragments: One dict per failing subtree with 'index', 'path' (ancestor path in
+            the document), 'xml' (the fragment) and 'errors' (its validation errors).
+
+    Returns:
+        The formatted repair prompt string.
+    """
+    sections = [
+        SLICE_REPAIR_FRAGMENT.render(
+            index=fragment["index"], path=fragment["path"], xml=fragment["xml"],
+            errors="\n".join(f"- {e}" for e in fragment["errors"])
+        )
+        for fragment in fragments
+    ]
+    prompt = SLICE_REPAIR_PROMPT.render(requirement_text=original_requirement, fragments="\n\n".join(sections))
+    logger.debug(f"Formatted slice repair prompt with {len(fragments)} fragments.")
+    return prompt
 
-Incorrect XML:
-```xml
-{incorrect_xml}"""
\ No newline at end of file
+def format_continuation_prompt(original_prompt: str, partial_answer: str, open_elements: list[str]) -> str:
+    """
+    Creates a prompt asking the LLM to continue an answer that hit the token limit.
+
+    Args:
+        original_prompt: The prompt that produced the truncated answer.
+        partial_answer: The answer received so far.
+        open_elements: Elements still open where the answer stops, outermost first.
+
+    Returns:
+        The formatted continuation prompt string.
+    """
+    prompt = CONTINUATION_PROMPT.render(
+        prompt=original_prompt.strip(), partial=partial_answer, open_elements=" > ".join(open_elements)
+    )
+    logger.debug(f"Formatted continuation prompt ({len(open_elements)} open elements).")
+    return prompt
+
+def format_few_shot_prompt(prompt: str, examples: list[dict]) -> str:
+    """
+    Puts solved examples in front of a generation prompt.
+
+    Args:
+        prompt: The formatted generation prompt.
+        examples: One dict per example with 'requirement_text' and 'output' (its XML or JSON).
+
+    Returns:
+        The prompt with the examples section, or the prompt unchanged if there are no examples.
+    """
+    if not examples:
+        return prompt
+    sections = [
+        FEW_SHOT_EXAMPLE.render(index=index, requirement_text=example["requirement_text"], output=example["output"].strip())
+        for index, example in enumerate(examples, 1)
+    ]
+    logger.debug(f"Attached {len(examples)} few-shot examples to the prompt.")
+    return FEW_SHOT_PROMPT.render(examples="\n\n".join(sections), prompt=prompt.lstrip("\n"))
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+from string import Template
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTemplate:
+    """
+    A named, versioned prompt template, compiled once at import.
+
+    Placeholders use string.Template syntax ('${name}'), so XML braces in prompts need
+    no escaping. `version` is bumped by hand on intentional prompt changes; `content_hash`
+    changes with any edit of the text, so a forgotten bump is still detectable.
+    """
+
+    def __init__(self, name: str, version: int, source: str):
+        self.name = name
+        self.version = version
+        self.source = source
+        self.content_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+        self._template = Template(source)
+        self.placeholders = set(self._template.get_identifiers())
+
+    @property
+    def template_id(self) -> str:
+        """Identifier for caches and result records, e.g. 'basic@v1+3f2a9c1b7e0d'."""
+        return f"{self.name}@v{self.version}+{self.content_hash}"
+
+    def render(self, **values) -> str:
+        """Fills in the placeholders; raises KeyError if one is missing."""
+        return self._template.substitute(values)
+
+
+BASIC_PROMPT = PromptTemplate("basic", 1, """
+Generate an AUTOSAR XML snippet corresponding to the following requirement.
+Ensure the XML is well-formed.
+
+Requirement:
+"${requirement_text}"
+
+AUTOSAR XML:
+""")
+
+KG_ENHANCED_PROMPT = PromptTemplate("kg_enhanced", 1, """
+Generate an AUTOSAR XML snippet corresponding to the following requirement.
+Use the provided Knowledge Graph Context to ensure correctness and consistency.
+Ensure the XML is well-formed.
+
+Requirement:
+"${requirement_text}"
+
+Knowledge Graph Context:
+${kg_context}
+
+AUTOSAR XML:
+""")
+
+SKELETON_PROMPT = PromptTemplate("skeleton", 1, """
+Complete the AUTOSAR XML skeleton below so it implements the following requirement.
+The skeleton already contains every mandatory element in the required order.
+Replace each {{VALUE}} placeholder with the value implied by the requirement and add
+the optional elements the requirement needs. Do not remove, rename or reorder the
+skeleton elements. Answer with the completed XML only.
+
+Requirement:
+"${requirement_text}"
+${context_section}
+Skeleton:
+```xml
+${skeleton}
+```
+
+Completed AUTOSAR XML:
+""")
+
+JSON_PROMPT = PromptTemplate("json", 1, """
+Describe the AUTOSAR XML for the following requirement as a JSON object.
+Use the XML element names as keys, written in lowerCamelCase (SHORT-NAME -> "shortName",
+I-SIGNAL -> "iSignal"). Nest child elements as objects, use arrays for repeated elements
+and strings or numbers for leaf values. Write XML attributes as "@NAME" keys and the text
+of an element that has attributes as "#text". The top-level object has exactly one key,
+the document element${root_hint}. Answer with the JSON object only.
+
+Requirement:
+"${requirement_text}"
+${context_section}${skeleton_section}
+JSON:
+""")
+
+FRAGMENT_PROMPT = PromptTemplate("fragment", 1, """
+Generate only the AUTOSAR <${element}> element named "${name}" for the requirement below.
+The other elements of the requirement are generated separately, so do not include them
+or the surrounding document. The mandatory structure of the element is:
+```xml
+${skeleton}
+```
+Replace each {{VALUE}} placeholder and add the optional elements the requirement needs.
+
+Requirement:
+"${requirement_text}"
+${context_section}
+AUTOSAR XML element:
+""")
+
+REPAIR_PROMPT = PromptTemplate("repair", 1, """
+The following AUTOSAR XML was generated for the requirement below, but it failed validation.
+Please correct the XML based on the provided error messages.
+
+Original Requirement:
+"${requirement_text}"
+
+Incorrect XML:
+```xml
+${incorrect_xml}
+```
+
+Validation Errors:
+${errors}
+
+Corrected AUTOSAR XML:
+""")
+
+SLICE_REPAIR_FRAGMENT = PromptTemplate("slice_repair_fragment", 1, """=== FRAGMENT ${index} ===
+Location: ${path}
+Errors:
+${errors}
+```xml
+${xml}
+```""")
+
+SLICE_REPAIR_PROMPT = PromptTemplate("slice_repair", 1, """
+The AUTOSAR XML generated for the requirement below failed validation.
+Only the failing fragments are shown, with their location in the document.
+Correct each fragment so it fixes its errors. Keep the same root element for each fragment.
+
+Original Requirement:
+"${requirement_text}"
+
+${fragments}
+
+Answer with every corrected fragment, each preceded by its marker line exactly as above
+(e.g. "=== FRAGMENT 1 ==="), and nothing else.
+""")
+
+CONTINUATION_PROMPT = PromptTemplate("continuation", 1, """
+Your answer to the request below was cut off because it reached the length limit.
+
+=== REQUEST ===
+${prompt}
+=== END OF REQUEST ===
+
+Your answer so far:
+${partial}
+
+The answer stops inside these open elements (outermost first): ${open_elements}
+Continue the answer exactly where it stops, starting with the very next character.
+Output only the remaining text: do not repeat anything from the answer so far and add no explanations or code fences.
+""")
+
+FEW_SHOT_EXAMPLE = PromptTemplate("few_shot_example", 1, """=== EXAMPLE ${index} ===
+Requirement:
+"${requirement_text}"
+
+Output:
+${output}""")
+
+FEW_SHOT_PROMPT = PromptTemplate("few_shot", 1, """
+Solved examples of similar requirements follow. Reuse their structure and naming conventions where they apply.
+
+${examples}
+=== END OF EXAMPLES ===
+${prompt}""")
+
+TEMPLATES = {t.name: t for t in (
+    BASIC_PROMPT, KG_ENHANCED_PROMPT, SKELETON_PROMPT, JSON_PROMPT, FRAGMENT_PROMPT, REPAIR_PROMPT, SLICE_REPAIR_FRAGMENT, SLICE_REPAIR_PROMPT,
+    CONTINUATION_PROMPT, FEW_SHOT_EXAMPLE, FEW_SHOT_PROMPT
+)}
+
+
+def templates_fingerprint(names: list[str] | None = None) -> str:
+    """Short hash over the ids of the named templates (default: all); changes whenever one of them changes."""
+    ids = ",".join(sorted(t.template_id for t in TEMPLATES.values() if names is None or t.name in names))
+    return hashlib.sha256(ids.encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4 # Rough heuristic for English/XML text
+MIN_RATE_SCALE = 0.1 # Adaptive throttling never drops below 10% of the configured rate
+RATE_RECOVERY_STEP = 0.05 # Additive recovery of the rate scale per successful request
+
+_shared_limiters = {}
+_shared_lock = threading.Lock()
+
+
+def estimate_tokens(prompt: str, max_completion_tokens: int = 0) -> int:
+    """
+    Estimates the tokens a request will consume against a tokens-per-minute limit.
+
+    Providers count the prompt plus the requested completion budget, so max_tokens
+    is reserved up front.
+    """
+    return len(prompt) // CHARS_PER_TOKEN + 1 + max_completion_tokens
+
+
+def parse_retry_after(headers) -> float | None:
+    """Extracts a delay in seconds from 'retry-after-ms' / 'retry-after' response headers."""
+    if not headers:
+        return None
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except Exception as e:
+        logger.debug(f"Could not parse Retry-After header: {e}")
+        return None
+
+
+class _TokenBucket:
+    """Token bucket refilled continuously at `capacity` units per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float, scale: float) -> float:
+        """Takes `amount` units (going into debt if needed) and returns the seconds to wait."""
+        refill_per_s = self.capacity * scale / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * refill_per_s)
+        self.updated = now
+        self.level -= min(amount, self.capacity) # Oversized requests must not block forever
+        return 0.0 if self.level >= 0 else -self.level / refill_per_s
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute / tokens-per-minute limiter with adaptive backoff.
+
+    Callers reserve capacity before each request and sleep for the returned delay.
+    A 429 response pauses every caller until the provider's Retry-After has passed and
+    halves the effective rate; successful requests restore it gradually.
+    """
+
+    def __init__(self, requests_per_minute: int | None = None, tokens_per_minute: int | None = None):
+        self._lock = threading.Lock()
+        self._request_bucket = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._blocked_until = 0.0
+        self.rate_scale = 1.0
+        self.throttled_count = 0
+
+    def reserve(self, tokens: int) -> float:
+        """Reserves capacity for one request of `tokens` tokens; returns seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._blocked_until - now)
+            if self._request_bucket:
+                delay = max(delay, self._request_bucket.reserve(1, now, self.rate_scale))
+            if self._token_bucket:
+                delay = max(delay, self._token_bucket.reserve(tokens, now, self.rate_scale))
+            return delay
+
+    def acquire(self, tokens: int, deadline_at: float | None = None):
+        """
+        Blocks the calling thread until the request may be sent.
+
+        Raises:
+            TimeoutError: If the wait would end after deadline_at (time.monotonic() based).
+        """
+        delay = _check_deadline(self.reserve(tokens), deadline_at)
+        if delay > 0:
+            logger.debug(f"Rate limiter delaying request by {delay:.2f}s")
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int, deadline_at: float | None = None):
+        """Suspends the calling task until the request may be sent (TimeoutError as in acquire)."""
+        delay = _check_deadline(self.reserve(tokens), deadline_at)
+        if delay > 0:
+            logger.debug(f"Rate limiter delaying async request by {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def record_rate_limited(self, retry_after: float | None, attempt: int = 0) -> float:
+        """
+        Registers a 429 response and blocks all callers for the back-off period.
+
+        Args:
+            retry_after: Delay requested by the provider (seconds), if any.
+            attempt: Zero-based retry attempt, used for exponential back-off without Retry-After.
+
+        Returns:
+            The back-off delay in seconds.
+        """
+        delay = retry_after if retry_after is not None else min(60.0, 2.0 ** attempt)
+        with self._lock:
+            self.throttled_count += 1
+            self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale * 0.5)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        logger.warning(f"Provider rate limit hit; backing off {delay:.2f}s (rate scale now {self.rate_scale:.2f}).")
+        return delay
+
+    def record_success(self):
+        """Gradually restores the effective rate after throttling."""
+        if self.rate_scale < 1.0:
+            with self._lock:
+                self.rate_scale = min(1.0, self.rate_scale + RATE_RECOVERY_STEP)
+
+
+def _check_deadline(delay: float, deadline_at: float | None) -> float:
+    """Returns the delay, or raises TimeoutError if waiting it out would pass the deadline."""
+    if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+        raise TimeoutError(f"Rate limit wait of {delay:.2f}s would exceed the request deadline.")
+    return delay
+
+
+def get_shared_limiter(name: str, requests_per_minute: int | None = None,
+                       tokens_per_minute: int | None = None) -> RateLimiter:
+    """
+    Returns the process-wide limiter registered under `name`, creating it on first use.
+
+    All LLMClient instances (and therefore all generators) targeting the same
+    provider/model deployment share one limiter; endpoints of a router pool are
+    separate deployments with their own limiters.
+    """
+    with _shared_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+            _shared_limiters[name] = limiter
+            logger.info(f"Created shared rate limiter '{name}' (rpm={requests_per_minute}, tpm={tokens_per_minute})")
+        return limiter
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024 # 512 MiB of cached completions
+
+
+class CacheMissError(RuntimeError):
+    """Raised in replay-only mode when a prompt has no recorded response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed, size-bounded on-disk cache for LLM completions.
+
+    Entries live in a single SQLite file. Each entry is keyed by a hash of the
+    request parameters that influence the output, and the least recently used
+    entries are evicted once the total stored size exceeds max_bytes.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = DEFAULT_MAX_BYTES, replay_only: bool = False):
+        """
+        Opens (or creates) the cache database.
+
+        Args:
+            path: Path of the SQLite cache file.
+            max_bytes: Upper bound on the total size of cached responses.
+            replay_only: If True, a lookup miss raises CacheMissError and nothing is written.
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # sqlite connection is shared by threads and async tasks
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._total_bytes, self._clock = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_access), 0) FROM responses"
+        ).fetchone()
+        logger.info(f"Response cache opened at {self.path} ({self._total_bytes} bytes, replay_only={replay_only})")
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature, max_tokens, prompt: str, response_format: dict | None = None) -> str:
+        """Returns the content hash identifying a completion request (plain-text requests keep their pre-JSON-mode keys)."""
+        fields = [provider, model, temperature, max_tokens, prompt]
+        if response_format is not None:
+            fields.append(response_format)
+        payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Looks up a cached response and marks it as recently used.
+
+        Raises:
+            CacheMissError: If the key is missing and the cache is in replay-only mode.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                if not self.replay_only: # Keep replay runs read-only
+                    self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (self._tick(), key))
+                    self._conn.commit()
+                return row[0]
+            self.misses += 1
+
+        if self.replay_only:
+            raise CacheMissError(f"No cached LLM response for key {key} (replay-only mode).")
+        return None
+
+    def put(self, key: str, value: str):
+        """Stores a response and evicts least recently used entries if over budget."""
+        if self.replay_only:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.warning(f"Response of {size} bytes exceeds cache budget; not caching.")
+            return
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, self._tick())
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _tick(self) -> float:
+        """Returns a strictly increasing access timestamp (lock held)."""
+        self._clock = max(time.time(), self._clock + 1e-6)
+        return self._clock
+
+    def _evict(self):
+        """Deletes least recently used entries until the total size fits max_bytes (lock held)."""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                logger.debug(f"Evicted cached response {key} ({size} bytes).")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def close(self):
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
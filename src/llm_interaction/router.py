@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from .deadline import deadline_scope, remaining_time
+from .llm_client import LLMClient
+from .telemetry import observe_calls
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2 # Weight of the newest observation in latency / error-rate averages
+DEFAULT_LATENCY_PRIOR_S = 5.0 # Assumed latency of an endpoint before it has been observed
+
+
+class EndpointHealth:
+    """Tracks smoothed latency and error rate of one endpoint, with a simple circuit breaker."""
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+
+    def record(self, latency_s: float, success: bool):
+        self.requests += 1
+        self.error_ewma = EWMA_ALPHA * (0.0 if success else 1.0) + (1 - EWMA_ALPHA) * self.error_ewma
+        if success:
+            self.consecutive_failures = 0
+            self.latency_ewma = latency_s if self.latency_ewma is None else \
+                EWMA_ALPHA * latency_s + (1 - EWMA_ALPHA) * self.latency_ewma
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.ejected_until = time.monotonic() + self.cooldown_s
+                logger.warning(f"Endpoint '{self.name}' ejected for {self.cooldown_s:.0f}s after "
+                               f"{self.consecutive_failures} consecutive failures.")
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def weight(self) -> float:
+        """Routing weight: faster and more reliable endpoints get proportionally more traffic."""
+        latency = self.latency_ewma if self.latency_ewma is not None else DEFAULT_LATENCY_PRIOR_S
+        return max(1e-3, (1.0 - self.error_ewma) ** 2 / max(latency, 1e-3))
+
+
+class LLMRouter:
+    """
+    Spreads LLM requests over a pool of endpoints (deployments, keys or regions).
+
+    Exposes the same generation API as LLMClient. Each request goes to an endpoint
+    picked at random, weighted by observed latency and error rate; if it fails the
+    request fails over to the next endpoint. Endpoints that fail repeatedly are
+    taken out of rotation for a cooldown period.
+    """
+
+    def __init__(self, llm_config: dict, api_keys: dict):
+        """
+        Initializes one LLMClient per entry of llm_config['endpoints'].
+
+        Each endpoint entry overrides the top-level LLM settings (default_model,
+        base_url, ...); its 'rate_limit' block overrides single keys of the top-level one.
+        'api_key_name' selects the key from api_keys (defaults to the provider name).
+
+        Args:
+            llm_config: Dictionary with LLM settings, including the 'endpoints' list.
+            api_keys: Dictionary containing API keys.
+        """
+        self.config = llm_config
+        routing_config = llm_config.get("routing") or {}
+        self.max_attempts = routing_config.get("max_attempts", 2) # Endpoints tried per request
+        self.endpoints = [] # list of (name, LLMClient, EndpointHealth)
+        self._lock = threading.Lock()
+        self._rng = random.Random(routing_config.get("seed"))
+
+        base_config = {k: v for k, v in llm_config.items() if k not in ("endpoints", "routing")}
+        shared_cache = None
+        for index, endpoint in enumerate(llm_config.get("endpoints", [])):
+            name = endpoint.get("name", f"endpoint{index}")
+            endpoint_config = {**base_config, **{k: v for k, v in endpoint.items() if k not in ("name", "api_key_name")}}
+            # Per-endpoint limits override single keys of the shared rate_limit block
+            endpoint_config["rate_limit"] = {**(base_config.get("rate_limit") or {}), **(endpoint.get("rate_limit") or {})}
+            endpoint_config["endpoint_name"] = name # Each endpoint has its own quota (and rate limiter)
+            provider = endpoint_config.get("default_provider", "openai")
+            key_name = endpoint.get("api_key_name", provider)
+            endpoint_keys = {provider: api_keys.get(key_name)} if api_keys.get(key_name) else {}
+            if shared_cache is not None:
+                endpoint_config["cache"] = {"enabled": False} # One cache connection for the whole pool
+            client = LLMClient(endpoint_config, endpoint_keys)
+            if shared_cache is None:
+                shared_cache = client.cache
+            else:
+                client.cache = shared_cache
+            health = EndpointHealth(name, routing_config.get("failure_threshold", 3), routing_config.get("cooldown_s", 30.0))
+            self.endpoints.append((name, client, health))
+        logger.info(f"LLMRouter initialized with endpoints: {[name for name, _, _ in self.endpoints]}")
+
+    @property
+    def client(self):
+        """The first initialized underlying API client (None if no endpoint is usable)."""
+        return next((c.client for _, c, _ in self.endpoints if c.client), None)
+
+    @property
+    def model(self) -> str | None:
+        return self.endpoints[0][1].model if self.endpoints else None
+
+    @property
+    def provider(self) -> str | None:
+        return self.endpoints[0][1].provider if self.endpoints else None
+
+    def generate_text(self, prompt: str, timeout: float | None = None, response_format: dict | None = None) -> str | None:
+        """
+        Routes one prompt to a healthy endpoint, failing over on error (see LLMClient.generate_text).
+
+        The timeout bounds the whole request, failovers included.
+        """
+        tried = set()
+        with deadline_scope(timeout):
+            for _ in range(min(self.max_attempts, len(self.endpoints))):
+                if self._deadline_passed():
+                    break
+                endpoint = self._pick(tried)
+                if endpoint is None:
+                    break
+                name, client, health = endpoint
+                tried.add(name)
+                started = time.monotonic()
+                with observe_calls() as calls:
+                    result = client.generate_text(prompt, timeout, response_format)
+                if self._settle(name, health, time.monotonic() - started, result, calls):
+                    return result
+        logger.error("All routed LLM endpoints failed for this request.")
+        return None
+
+    async def generate_text_async(self, prompt: str, timeout: float | None = None,
+                                  response_format: dict | None = None) -> str | None:
+        """Async counterpart of generate_text."""
+        tried = set()
+        with deadline_scope(timeout):
+            for _ in range(min(self.max_attempts, len(self.endpoints))):
+                if self._deadline_passed():
+                    break
+                endpoint = self._pick(tried)
+                if endpoint is None:
+                    break
+                name, client, health = endpoint
+                tried.add(name)
+                started = time.monotonic()
+                with observe_calls() as calls:
+                    result = await client.generate_text_async(prompt, timeout, response_format)
+                if self._settle(name, health, time.monotonic() - started, result, calls):
+                    return result
+        logger.error("All routed LLM endpoints failed for this request.")
+        return None
+
+    async def generate_many(self, prompts: list[str]) -> list[str | None]:
+        """Sends several prompts concurrently; each one is routed independently."""
+        return list(await asyncio.gather(*(self.generate_text_async(p) for p in prompts)))
+
+    def generate_batch(self, prompts: dict[str, str], job_path: str, backend=None,
+                       response_formats: dict[str, dict] | None = None) -> dict[str, str | None]:
+        """Submits a batch job through the first usable endpoint and prefills every endpoint with the results."""
+        submitter = next((c for _, c, _ in self.endpoints if c.client), None)
+        if submitter is None:
+            logger.error("No usable endpoint to submit the batch job.")
+            return {custom_id: None for custom_id in prompts}
+        results = submitter.generate_batch(prompts, job_path, backend, response_formats)
+        for _, client, _ in self.endpoints:
+            if client is not submitter:
+                for custom_id, text in results.items():
+                    if text and custom_id in prompts:
+                        client.prefill(prompts[custom_id], text, (response_formats or {}).get(custom_id))
+        return results
+
+    def _pick(self, exclude: set) -> tuple | None:
+        """Weighted random choice among available endpoints not yet tried for this request."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e[0] not in exclude and e[1].client and e[2].is_available(now)]
+            if not candidates:
+                # Every endpoint is ejected: fall back to any untried one rather than failing outright
+                candidates = [e for e in self.endpoints if e[0] not in exclude and e[1].client]
+            if not candidates:
+                return None
+            weights = [health.weight() for _, _, health in candidates]
+            return self._rng.choices(candidates, weights=weights, k=1)[0]
+
+    def _settle(self, name: str, health: EndpointHealth, latency_s: float, result: str | None, calls: list) -> bool:
+        """Updates the endpoint's health after one attempt; True if the request is done."""
+        if any(stats.cached for stats in calls):
+            return True # Served from the cache or a batch prefill: says nothing about the endpoint
+        if result is None and self._deadline_passed():
+            logger.warning(f"Request deadline passed on endpoint '{name}'; not failing over.")
+            return False # The budget ran out, which is not the endpoint's fault
+        with self._lock:
+            health.record(latency_s, result is not None)
+        if result is None:
+            logger.warning(f"Endpoint '{name}' failed; failing over.")
+        return result is not None
+
+    @staticmethod
+    def _deadline_passed() -> bool:
+        remaining = remaining_time()
+        return remaining is not None and remaining <= 0
+
+    def health_snapshot(self) -> list[dict]:
+        """Current routing statistics per endpoint (for logging / reports)."""
+        with self._lock:
+            return [{
+                "endpoint": name,
+                "requests": health.requests,
+                "latency_ewma_s": health.latency_ewma,
+                "error_ewma": round(health.error_ewma, 3),
+                "weight": round(health.weight(), 4),
+                "ejected": not health.is_available(time.monotonic()),
+            } for name, _, health in self.endpoints]
+
+
+def create_llm_client(llm_config: dict, api_keys: dict) -> LLMClient | LLMRouter:
+    """Returns an LLMRouter when an endpoint pool is configured, otherwise a single LLMClient."""
+    if llm_config.get("endpoints"):
+        return LLMRouter(llm_config, api_keys)
+    return LLMClient(llm_config, api_keys)
@@ -0,0 +1,142 @@
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+_current_tracker = contextvars.ContextVar("llm_usage_tracker", default=None)
+_call_observers = contextvars.ContextVar("llm_call_observers", default=())
+
+
+@dataclass
+class CallStats:
+    """Telemetry for a single LLMClient call."""
+    model: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    usage_estimated: bool = False # True if token counts are heuristics (e.g. stream aborted before usage arrived)
+    started_at: float | None = None # time.monotonic() when the call started
+    latency_s: float = 0.0        # Wall time of the whole call, including retries and back-off
+    ttft_s: float | None = None   # Time to first token (equals latency for non-streaming calls)
+    retries: int = 0
+    cached: bool = False
+    hedged: bool = False
+    success: bool = False
+    finish_reason: str | None = None
+
+    def absorb(self, other: "CallStats"):
+        """Copies the response-level fields of the attempt that produced the final answer."""
+        self.prompt_tokens = other.prompt_tokens
+        self.completion_tokens = other.completion_tokens
+        self.usage_estimated = other.usage_estimated
+        self.ttft_s = other.ttft_s
+        self.retries += other.retries
+        self.finish_reason = other.finish_reason
+
+
+@dataclass
+class UsageTracker:
+    """Collects the CallStats of every LLM call made inside a track_usage() block."""
+    calls: list[CallStats] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, stats: CallStats):
+        with self._lock:
+            self.calls.append(stats)
+
+    @property
+    def total_tokens(self) -> int:
+        """Prompt + completion tokens of all recorded calls."""
+        with self._lock:
+            return sum(c.prompt_tokens + c.completion_tokens for c in self.calls)
+
+    def summary(self) -> dict:
+        """Aggregates the recorded calls into flat columns for result records."""
+        with self._lock:
+            calls = list(self.calls)
+        live = [c for c in calls if not c.cached]
+        ttfts = [c.ttft_s for c in live if c.ttft_s is not None]
+        return {
+            "llm_calls": len(calls),
+            "llm_cached_calls": len(calls) - len(live),
+            "llm_failed_calls": sum(1 for c in calls if not c.success),
+            "llm_prompt_tokens": sum(c.prompt_tokens for c in calls),
+            "llm_completion_tokens": sum(c.completion_tokens for c in calls),
+            "llm_latency_s": round(sum(c.latency_s for c in calls), 3),
+            "llm_busy_s": round(busy_time(live), 3), # Wall time with at least one call in flight
+            "llm_ttft_mean_s": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+            "llm_retries": sum(c.retries for c in calls),
+            "llm_hedged_calls": sum(1 for c in calls if c.hedged),
+        }
+
+
+def busy_time(calls: list[CallStats]) -> float:
+    """
+    Length of the union of the calls' [start, start + latency] intervals.
+
+    Unlike the latency sum, overlapping calls (concurrent candidates, hedged
+    duplicates) are counted once.
+    """
+    intervals = sorted((c.started_at, c.started_at + c.latency_s) for c in calls if c.started_at is not None)
+    total, current_start, current_end = 0.0, None, None
+    for start, end in intervals:
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+@contextmanager
+def track_usage():
+    """
+    Collects telemetry for all LLM calls made in the block (including async tasks and
+    worker threads started with asyncio.to_thread, which inherit the context).
+
+    Yields:
+        The UsageTracker receiving the calls.
+    """
+    tracker = UsageTracker()
+    token = _current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_tracker.reset(token)
+
+
+def current_tracker() -> UsageTracker | None:
+    """The UsageTracker of the enclosing track_usage() block, if any."""
+    return _current_tracker.get()
+
+
+@contextmanager
+def observe_calls():
+    """
+    Collects the CallStats of the LLM calls made in the block, without taking them
+    away from the enclosing track_usage() block (unlike a nested track_usage()).
+
+    Yields:
+        The list receiving the calls.
+    """
+    observed = []
+    token = _call_observers.set(_call_observers.get() + (observed,))
+    try:
+        yield observed
+    finally:
+        _call_observers.reset(token)
+
+
+def record_call(stats: CallStats):
+    """Reports a finished call to the active tracker and observers, if any."""
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.record(stats)
+    for observed in _call_observers.get():
+        observed.append(stats)
+    logger.debug(f"LLM call stats: {stats}")
@@ -0,0 +1,157 @@
+import logging
+import re
+from functools import lru_cache
+
+from .rate_limiter import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_WINDOW = 8192 # Tokens, used for models missing from MODEL_CONTEXT_WINDOWS
+PROMPT_SAFETY_MARGIN = 64 # Tokens kept free for chat formatting overhead and tokenizer mismatch
+TOKEN_MEMO_MAX_CHARS = 512 # Longer texts (whole prompts) are counted without memoizing them
+
+# Context window (prompt + completion tokens) per model name prefix; the longest matching prefix wins
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+}
+
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_encoder_failure_logged = False
+
+
+@lru_cache(maxsize=8)
+def _get_encoder(model: str | None):
+    """
+    Loads (once per model) a tiktoken encoder, or returns None if none is usable.
+
+    Besides a missing tiktoken, loading fails when the BPE file is neither cached nor
+    downloadable (no network); prompts are then sized with the character heuristic.
+    """
+    global _encoder_failure_logged
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken not installed; estimating prompt tokens from character counts.")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        if not _encoder_failure_logged:
+            _encoder_failure_logged = True
+            logger.warning(f"tiktoken encoder could not be loaded ({e}); estimating prompt tokens from character counts.")
+        return None
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    """
+    Counts the tokens of `text` with the model's local tokenizer.
+
+    Falls back to the characters-per-token heuristic of the rate limiter when tiktoken
+    is not installed. Short texts are memoized, since the same KG lines recur across
+    requirements and methods; whole prompts are not, as they rarely repeat.
+    """
+    if len(text) <= TOKEN_MEMO_MAX_CHARS:
+        return _count_tokens_memoized(text, model)
+    return _encode_count(text, model)
+
+
+@lru_cache(maxsize=1024)
+def _count_tokens_memoized(text: str, model: str | None) -> int:
+    return _encode_count(text, model)
+
+
+def _encode_count(text: str, model: str | None) -> int:
+    encoder = _get_encoder(model)
+    if encoder is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def context_window(llm_config: dict, model: str | None = None) -> int:
+    """
+    Context window of the model serving the prompt (llm.context_window overrides the built-in table).
+
+    model defaults to the configured default_model.
+    """
+    if llm_config.get("context_window"):
+        return int(llm_config["context_window"])
+    model = model or llm_config.get("default_model") or ""
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+def prompt_token_budget(llm_config: dict, model: str | None = None) -> int:
+    """
+    Maximum prompt size in tokens for the model serving the prompt (default: default_model).
+
+    Uses llm.prompt_token_budget if set, otherwise the model's context window minus the
+    completion budget (llm.max_tokens) and a safety margin. An explicit budget is still
+    capped by what the context window allows.
+    """
+    available = context_window(llm_config, model) - llm_config.get("max_tokens", 1024) - PROMPT_SAFETY_MARGIN
+    configured = llm_config.get("prompt_token_budget")
+    budget = min(configured, available) if configured else available
+    return max(0, budget)
+
+
+def _terms(text: str) -> set[str]:
+    return {w.lower() for w in _WORD_RE.findall(text) if len(w) > 2}
+
+
+def rank_context_lines(lines: list[str], query: str) -> list[str]:
+    """
+    Orders context lines by relevance to `query` (most relevant first).
+
+    Relevance is the share of a line's terms that also occur in the query; ties keep
+    the original order, so the KG's own ordering is preserved among equal lines.
+    """
+    query_terms = _terms(query)
+
+    def score(line: str) -> float:
+        line_terms = _terms(line)
+        if not line_terms:
+            return 0.0
+        overlap = len(line_terms & query_terms)
+        return overlap + overlap / len(line_terms) # Absolute overlap first, density as tie-breaker
+
+    return sorted(lines, key=score, reverse=True) # sorted() is stable
+
+
+def fit_context(context: str, query: str, max_tokens: int, model: str | None = None) -> str:
+    """
+    Trims multi-line context to at most `max_tokens`, keeping the most relevant lines.
+
+    Args:
+        context: Newline-separated context (e.g. KG facts).
+        query: Text the context should be relevant to (the requirement).
+        max_tokens: Token budget for the returned context.
+        model: Model whose tokenizer is used for counting.
+
+    Returns:
+        The selected lines, most relevant first, or the context unchanged if it fits.
+    """
+    if count_tokens(context, model) <= max_tokens:
+        return context
+    lines = [line for line in context.splitlines() if line.strip()]
+    selected, used = [], 0
+    for line in rank_context_lines(lines, query):
+        line_tokens = count_tokens(line, model) + 1 # +1 for the newline
+        if used + line_tokens > max_tokens:
+            continue # A shorter, less relevant line may still fit
+        selected.append(line)
+        used += line_tokens
+    logger.info(f"Context trimmed to token budget {max_tokens}: kept {len(selected)}/{len(lines)} lines.")
+    return "\n".join(selected)
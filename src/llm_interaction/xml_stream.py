@@ -0,0 +1,103 @@
+import logging
+import re
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PREAMBLE_CHARS = 200 # Text allowed before the first '<' (e.g. a ```xml fence) before we call it prose
+
+# Stream states returned by XmlStreamMonitor.feed
+STREAM_CONTINUE = "continue"
+STREAM_COMPLETE = "complete" # Root element closed; remaining tokens are not needed
+STREAM_NOT_XML = "not_xml"   # Output is prose, not XML
+STREAM_MALFORMED = "malformed" # Well-formedness error detected mid-stream
+
+
+class XmlStreamMonitor:
+    """
+    Incrementally parses streamed LLM output to decide when the stream can stop early.
+
+    Text before the first '<' (a markdown fence, a short preamble) is tolerated up to
+    max_preamble_chars. From the first '<' on, chunks are fed to an lxml XMLPullParser;
+    the stream is complete as soon as the root element closes, and aborted as soon as
+    the parser reports a well-formedness error.
+    """
+
+    def __init__(self, max_preamble_chars: int = DEFAULT_MAX_PREAMBLE_CHARS):
+        self.max_preamble_chars = max_preamble_chars
+        self.state = STREAM_CONTINUE
+        self.error = None
+        self._parts = []
+        self._preamble_len = 0
+        self._xml_started = False
+        self._open = [] # Names of the elements opened but not yet closed
+        self._root_tag = None
+        self._parser = etree.XMLPullParser(events=("start", "end"))
+
+    @property
+    def text(self) -> str:
+        """The output received so far (cut right after the root end tag once complete)."""
+        return "".join(self._parts)
+
+    @property
+    def open_elements(self) -> list[str]:
+        """Elements still open at the end of the output received so far, outermost first."""
+        return list(self._open)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Consumes one streamed chunk.
+
+        Returns:
+            One of STREAM_CONTINUE, STREAM_COMPLETE, STREAM_NOT_XML, STREAM_MALFORMED.
+        """
+        if self.state != STREAM_CONTINUE or not chunk:
+            return self.state
+        self._parts.append(chunk)
+
+        if not self._xml_started:
+            start = chunk.find("<")
+            if start == -1:
+                self._preamble_len += len(chunk)
+                if self._preamble_len > self.max_preamble_chars:
+                    self.state = STREAM_NOT_XML
+                    logger.info(f"Streamed output has no XML after {self._preamble_len} chars; aborting.")
+                return self.state
+            self._xml_started = True
+            chunk = chunk[start:]
+
+        try:
+            self._parser.feed(chunk)
+        except etree.XMLSyntaxError as e:
+            # Trailing prose after the root in the same chunk also raises; the root may still have closed
+            self._drain_events()
+            if self.state != STREAM_COMPLETE:
+                self.state = STREAM_MALFORMED
+                self.error = str(e)
+                logger.info(f"Streamed XML is malformed ({e}); aborting.")
+            return self.state
+        self._drain_events()
+        return self.state
+
+    def _drain_events(self):
+        """Tracks the open elements from parser events and flags completion when the root closes."""
+        for event, element in self._parser.read_events():
+            if event == "start":
+                if self._root_tag is None:
+                    self._root_tag = etree.QName(element).localname
+                local = etree.QName(element).localname
+                self._open.append(f"{element.prefix}:{local}" if element.prefix else local)
+            else:
+                self._open.pop()
+                if not self._open:
+                    self.state = STREAM_COMPLETE
+                    self._trim_after_root()
+                    logger.debug(f"Root element <{self._root_tag}> closed; stream complete.")
+                    return
+
+    def _trim_after_root(self):
+        """Drops anything that followed the root end tag in the final chunk (e.g. a closing fence)."""
+        text = self.text
+        closing = list(re.finditer(rf"</(?:[\w.-]+:)?{re.escape(self._root_tag)}\s*>", text))
+        end = closing[-1].end() if closing else text.rfind(">") + 1
+        self._parts = [text[:end]]
@@ -0,0 +1,157 @@
+import logging
+from dataclasses import dataclass, field
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+XS_NS = "http://www.w3.org/2001/XMLSchema"
+
+
+def _local(name: str | None) -> str | None:
+    """Strips a namespace prefix ('AR:SHORT-NAME' -> 'SHORT-NAME')."""
+    return name.split(":", 1)[-1] if name else name
+
+
+def _occurs(node: etree._Element) -> tuple[int, int | None]:
+    max_occurs = node.get("maxOccurs", "1")
+    return int(node.get("minOccurs", "1")), None if max_occurs == "unbounded" else int(max_occurs)
+
+
+@dataclass
+class ChildDecl:
+    """An element allowed as a child in a content model."""
+    name: str
+    required: bool # Mandatory in every valid instance (minOccurs >= 1 along a chain of sequences)
+    declaration: etree._Element # The xs:element node (after resolving ref=)
+
+
+@dataclass
+class ContentModel:
+    """
+    Element children allowed by a complex type.
+
+    `ordered` is True only for plain sequences (each particle at most once), where the
+    declaration order is the required child order. `open` is True if xs:any allows
+    arbitrary children. `text` is True for simple-content and mixed types, whose
+    instances carry a text value.
+    """
+    children: list[ChildDecl] = field(default_factory=list)
+    ordered: bool = True
+    open: bool = False
+    text: bool = False
+
+    def child(self, name: str) -> ChildDecl | None:
+        return next((c for c in self.children if c.name == name), None)
+
+    def position(self, name: str) -> int:
+        return next((i for i, c in enumerate(self.children) if c.name == name), len(self.children))
+
+
+class XsdContentModel:
+    """
+    Reads the content models of a (subset of) XML Schema from its source document.
+
+    Supports global and local element declarations, named and anonymous complex
+    types, element/group references, sequences, choices, xs:all and complexContent
+    extensions. Constructs it does not understand make the affected model unordered
+    rather than wrong.
+    """
+
+    def __init__(self, schema_document: etree._Element):
+        root = schema_document.getroot() if hasattr(schema_document, "getroot") else schema_document
+        self.target_namespace = root.get("targetNamespace")
+        self.qualified = root.get("elementFormDefault") == "qualified"
+        self.elements = {n.get("name"): n for n in root.findall(f"{{{XS_NS}}}element")}
+        self.complex_types = {n.get("name"): n for n in root.findall(f"{{{XS_NS}}}complexType")}
+        self.groups = {n.get("name"): n for n in root.findall(f"{{{XS_NS}}}group")}
+        self.declarations = {} # Element name -> all its xs:element declarations, global and local
+        for node in root.iter(f"{{{XS_NS}}}element"):
+            if node.get("name"):
+                self.declarations.setdefault(node.get("name"), []).append(node)
+        self._models = {} # XPath of the declaration node -> ContentModel | None
+
+    def global_element(self, name: str) -> etree._Element | None:
+        return self.elements.get(name)
+
+    def instance_tag(self, name: str, declaration: etree._Element | None = None) -> str:
+        """
+        Tag of an instance element: in the target namespace if the declaration is global
+        or the schema is elementFormDefault="qualified".
+        """
+        is_global = declaration is not None and etree.QName(declaration.getparent()).localname == "schema"
+        if self.target_namespace and (is_global or self.qualified):
+            return etree.QName(self.target_namespace, name).text
+        return name
+
+    def instance_nsmap(self) -> dict | None:
+        """Namespace map for instance documents (a default namespace only if all elements are qualified)."""
+        if not self.target_namespace:
+            return None
+        return {(None if self.qualified else "ns"): self.target_namespace}
+
+    def model_for(self, declaration: etree._Element) -> ContentModel | None:
+        """Content model of an xs:element declaration, or None for simple / unknown types."""
+        key = declaration.getroottree().getpath(declaration) # lxml proxies are not stable identities
+        if key not in self._models:
+            self._models[key] = self._build_model(declaration)
+        return self._models[key]
+
+    def _build_model(self, declaration: etree._Element) -> ContentModel | None:
+        complex_type = declaration.find(f"{{{XS_NS}}}complexType")
+        if complex_type is None:
+            complex_type = self.complex_types.get(_local(declaration.get("type")))
+        if complex_type is None:
+            return None
+        model = ContentModel()
+        model.text = complex_type.get("mixed") == "true" or complex_type.find(f"{{{XS_NS}}}simpleContent") is not None
+        self._collect_type(complex_type, model, required=True, depth=0)
+        return model
+
+    def _collect_type(self, complex_type: etree._Element, model: ContentModel, required: bool, depth: int):
+        if depth > 20: # Recursive type hierarchies
+            model.ordered = False
+            return
+        extension = complex_type.find(f"{{{XS_NS}}}complexContent/{{{XS_NS}}}extension")
+        if extension is not None:
+            base = self.complex_types.get(_local(extension.get("base")))
+            if base is not None:
+                self._collect_type(base, model, required, depth + 1)
+            self._collect_particles(extension, model, required, depth + 1)
+        else:
+            self._collect_particles(complex_type, model, required, depth + 1)
+
+    def _collect_particles(self, container: etree._Element, model: ContentModel, required: bool, depth: int):
+        if depth > 20: # Recursive group references
+            model.ordered = False
+            return
+        for node in container:
+            if not isinstance(node.tag, str) or etree.QName(node).namespace != XS_NS:
+                continue
+            kind = etree.QName(node).localname
+            min_occurs, max_occurs = _occurs(node)
+            if kind == "element":
+                declaration = self.elements.get(_local(node.get("ref"))) if node.get("ref") else node
+                if declaration is not None: # A repeated element stays ordered: its occurrences form one block
+                    model.children.append(ChildDecl(declaration.get("name"), required and min_occurs >= 1, declaration))
+            elif kind in ("sequence", "choice", "all", "group"):
+                if kind in ("choice", "all") or max_occurs != 1:
+                    model.ordered = False
+                inner_required = required and min_occurs >= 1 and kind in ("sequence", "group")
+                target = self.groups.get(_local(node.get("ref"))) if kind == "group" and node.get("ref") else node
+                if target is not None:
+                    self._collect_particles(target, model, inner_required, depth + 1)
+            elif kind == "any":
+                model.open = True
+                model.ordered = False
+
+
+def content_model_of(xmlschema) -> XsdContentModel | None:
+    """Content model for a schema returned by load_xsd_schema (None if its source is unknown)."""
+    document = getattr(xmlschema, "document", None)
+    if document is None:
+        return None
+    model = getattr(xmlschema, "_content_model", None)
+    if model is None:
+        model = XsdContentModel(document)
+        xmlschema._content_model = model
+    return model
@@ -1,13 +1,23 @@
 import logging
+import threading
 from lxml import etree # lxml is commonly used for XSD validation
 
 logger = logging.getLogger(__name__)
 
+_validation_lock = threading.Lock() # XMLSchema.error_log belongs to the schema, so concurrent validations would mix errors
+
+class LoadedXsdSchema(etree.XMLSchema):
+    """An XMLSchema that keeps its source document (lxml does not expose the compiled content model)."""
+
+    def __init__(self, xmlschema_doc):
+        super().__init__(xmlschema_doc)
+        self.document = xmlschema_doc
+
 def load_xsd_schema(xsd_path: str) -> etree.XMLSchema | None:
     """Loads the XSD schema from a file."""
     try:
         xmlschema_doc = etree.parse(xsd_path)
-        xmlschema = etree.XMLSchema(xmlschema_doc)
+        xmlschema = LoadedXsdSchema(xmlschema_doc)
         logger.info(f"Successfully loaded XSD schema from: {xsd_path}")
         return xmlschema
     except etree.XMLSchemaParseError as e:
@@ -40,12 +50,14 @@ def validate_xsd(xml_content: str | bytes, xmlschema: etree.XMLSchema) -> tuple[
 
     try:
         xml_doc = etree.fromstring(xml_content)
-        is_valid = xmlschema.validate(xml_doc)
+        with _validation_lock:
+            is_valid = xmlschema.validate(xml_doc)
+            error_log = list(xmlschema.error_log)
         if is_valid:
             logger.debug("XSD validation successful.")
             return True, []
         else:
-            errors = [f"XSD Error: {err.message} (Line: {err.line}, Col: {err.column})" for err in xmlschema.error_log]
+            errors = [f"XSD Error: {err.message} (Line: {err.line}, Col: {err.column})" for err in error_log]
             logger.warning(f"XSD validation failed: {errors}")
             return False, errors
     except etree.XMLSyntaxError as e:
@@ -191,7 +191,7 @@ def test_xsd_constrained_generator_repair_fails(mock_validate_xsd, base_config,
     # validate_xsd keeps returning False
     mock_validate_xsd.return_value = (False, ["XSD Error: Element 'REQUIRED' is missing."])
 
-    # Assuming MAX_REPAIR_ATTEMPTS = 2 (default in generators.py)
+    # Default repair policy: 2 rounds, then stop since the errors did not decrease
     generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
     xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
 
@@ -279,4 +279,577 @@ def test_kg_enhanced_generator_valid(mock_base_validate, mock_query_kg, base_con
     assert xml == valid_xml
     assert not errors
 
-# Add more tests for KG Enhanced repair cycles, similar to FullConstrained tests
\ No newline at end of file
+# Add more tests for KG Enhanced repair cycles, similar to FullConstrained tests
+
+# --- Tests for multi-candidate racing ---
+
+def test_xsd_constrained_generator_candidate_race(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    """With num_candidates > 1 the first candidate that passes XSD validation wins."""
+    base_config["generation"] = {"num_candidates": 3}
+    valid_xml = "<MOCK_XML><REQUIRED>Value</REQUIRED></MOCK_XML>"
+    mock_llm_client.generate_text_async.side_effect = ["not xml", "<MOCK_XML></MOCK_XML>", valid_xml]
+
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert mock_llm_client.generate_text_async.call_count == 3
+    mock_llm_client.generate_text.assert_not_called() # No repair round trip needed
+    assert xml == valid_xml
+    assert not errors
+
+def test_xsd_constrained_generator_candidate_race_falls_back_to_repair(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    """If no candidate validates, the usual repair loop continues from the best one."""
+    base_config["generation"] = {"num_candidates": 2}
+    valid_xml = "<MOCK_XML><REQUIRED>Value</REQUIRED></MOCK_XML>"
+    mock_llm_client.generate_text_async.side_effect = ["<MOCK_XML></MOCK_XML>", "<MOCK_XML><WRONG/></MOCK_XML>"]
+    mock_llm_client.generate_text.return_value = valid_xml # Repair result
+
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert mock_llm_client.generate_text.call_count == 1
+    assert xml == valid_xml
+    assert not errors
+
+# --- Tests for slice-based repair ---
+
+from src.generation_pipeline.repair import extract_failing_slices, parse_fragment_response, splice_fragments
+from src.validation.xsd_validator import validate_xsd
+
+NESTED_XSD_CONTENT = """<?xml version="1.0" encoding="UTF-8" ?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:test" xmlns="urn:test" elementFormDefault="qualified">
+  <xs:element name="ROOT">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="ITEM" maxOccurs="unbounded">
+          <xs:complexType>
+            <xs:sequence>
+              <xs:element name="SHORT-NAME" type="xs:string"/>
+              <xs:element name="VALUE" type="xs:integer"/>
+            </xs:sequence>
+          </xs:complexType>
+        </xs:element>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+def make_nested_xml(bad_value: str = "abc") -> str:
+    items = [f"  <ITEM>\n    <SHORT-NAME>Item{i}</SHORT-NAME>\n    <VALUE>{bad_value if i == 3 else i}</VALUE>\n  </ITEM>" for i in range(8)]
+    return '<ROOT xmlns="urn:test">\n' + "\n".join(items) + "\n</ROOT>"
+
+@pytest.fixture(scope="module")
+def nested_xsd_schema():
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".xsd") as tmp_xsd:
+        tmp_xsd.write(NESTED_XSD_CONTENT)
+        xsd_path = tmp_xsd.name
+    schema = load_xsd_schema(xsd_path)
+    yield schema
+    os.remove(xsd_path)
+
+def test_extract_failing_slices_and_splice_back(nested_xsd_schema):
+    xml = make_nested_xml()
+    _, errors = validate_xsd(xml, nested_xsd_schema)
+
+    root, slices = extract_failing_slices(xml, errors)
+    assert len(slices) == 1
+    assert slices[0].path == "ROOT/ITEM[Item3]/VALUE"
+    assert "Item5" not in slices[0].xml
+
+    spliced = splice_fragments(root, slices, parse_fragment_response("=== FRAGMENT 1 ===\n```xml\n<VALUE>3</VALUE>\n```"))
+    assert spliced == make_nested_xml(bad_value="3")
+    assert validate_xsd(spliced, nested_xsd_schema) == (True, [])
+
+def test_extract_failing_slices_not_applicable_without_locations():
+    assert extract_failing_slices(make_nested_xml(), ["Drools Rule Violated: something"]) is None
+
+def test_extract_failing_slices_not_applicable_for_single_line_xml(nested_xsd_schema):
+    xml = "".join(line.strip() for line in make_nested_xml().splitlines())
+    valid, errors = validate_xsd(xml, nested_xsd_schema)
+    assert not valid
+
+    assert extract_failing_slices(xml, errors) is None # Every element starts on line 1: the culprit is ambiguous
+
+def test_xsd_generator_slice_repair_sends_only_failing_fragment(base_config, mock_llm_client, nested_xsd_schema):
+    base_config["generation"] = {"repair_mode": "slices"}
+    mock_llm_client.generate_text.side_effect = [make_nested_xml(), "=== FRAGMENT 1 ===\n<VALUE>3</VALUE>"]
+
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=nested_xsd_schema)
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    repair_prompt = mock_llm_client.generate_text.call_args_list[1][0][0]
+    assert "ROOT/ITEM[Item3]/VALUE" in repair_prompt
+    assert "Item5" not in repair_prompt # Rest of the document is not resent
+    assert xml == make_nested_xml(bad_value="3")
+    assert not errors
+
+# --- Tests for the stage pipeline engine ---
+
+from src.generation_pipeline.pipeline import CheckStage, run_checks
+
+def test_pipeline_records_stage_timings(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    mock_llm_client.generate_text.side_effect = ["<MOCK_XML></MOCK_XML>", "<MOCK_XML><REQUIRED>x</REQUIRED></MOCK_XML>"]
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors
+    assert set(generator.last_stage_timings) == {"prompt", "llm_generate", "xml_recovery", "precheck", "xsd", "auto_repair", "repair"}
+
+def test_run_checks_gated_vs_parallel():
+    calls = []
+    def failing(xml):
+        calls.append("xsd")
+        return ["XSD Error"]
+    def rules(xml):
+        calls.append("drools")
+        return ["Rule violated"]
+    checks = [CheckStage("xsd", failing), CheckStage("drools", rules)]
+
+    assert run_checks(checks, "<A/>") == (False, ["XSD Error"])
+    assert calls == ["xsd"] # Drools skipped once XSD failed
+    assert run_checks(checks, "<A/>", parallel=True) == (False, ["XSD Error", "Rule violated"])
+
+def test_check_stage_cache_skips_repeated_xml(base_config, mock_drools_validator):
+    base_config["generation"] = {"stage_cache": {"enabled": True}}
+    generator = FullConstrainedGenerator(base_config, llm_client=MagicMock(), drools_validator=mock_drools_validator)
+
+    assert generator._validate_xml("<A/>") == (True, [])
+    assert generator._validate_xml("<A/>") == (True, [])
+    assert generator._validate_xml("<B/>") == (True, [])
+    assert mock_drools_validator.validate_data.call_count == 2
+
+# --- Tests for shared initial generations ---
+
+import threading
+import time
+from src.generation_pipeline.pipeline import SingleFlightMemo
+
+def test_initial_generation_shared_across_methods(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    valid_xml = "<MOCK_XML><REQUIRED>Value</REQUIRED></MOCK_XML>"
+    mock_llm_client.generate_text.return_value = valid_xml
+    memo = SingleFlightMemo()
+    naive = NaiveGenerator(base_config, llm_client=mock_llm_client, initial_memo=memo)
+    xsd = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen, initial_memo=memo)
+
+    assert naive.generate(REQ_TEXT, PARSED_REQ) == (valid_xml, [])
+    assert xsd.generate(REQ_TEXT, PARSED_REQ) == (valid_xml, [])
+    mock_llm_client.generate_text.assert_called_once() # Same basic prompt, one completion
+
+def test_single_flight_memo_shares_in_flight_and_skips_failures():
+    memo = SingleFlightMemo()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(memo.get_or_compute("k", slow))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(cached for _, cached in results) == [False, True, True, True]
+    assert memo.get_or_compute("f", lambda: None, cacheable=bool) == (None, False)
+    assert memo.get_or_compute("f", lambda: "retry", cacheable=bool) == ("retry", False) # Failure was not stored
+
+# --- Tests for schema-driven auto-repair ---
+
+from src.generation_pipeline.repair import XsdAutoRepairer
+from src.validation.xsd_content_model import content_model_of
+
+PACKAGE_XSD_CONTENT = """<?xml version="1.0" encoding="UTF-8" ?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:test" xmlns:t="urn:test" elementFormDefault="qualified">
+  <xs:complexType name="PackageType">
+    <xs:sequence>
+      <xs:element name="SHORT-NAME" type="xs:string"/>
+      <xs:element name="CATEGORY" type="xs:string" minOccurs="0"/>
+      <xs:element name="VALUE" type="xs:integer"/>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:element name="ROOT">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="PACKAGE" type="t:PackageType" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+@pytest.fixture(scope="module")
+def package_xsd_schema():
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".xsd") as tmp_xsd:
+        tmp_xsd.write(PACKAGE_XSD_CONTENT)
+        xsd_path = tmp_xsd.name
+    schema = load_xsd_schema(xsd_path)
+    yield schema
+    os.remove(xsd_path)
+
+@pytest.mark.parametrize("broken", [
+    # Missing namespace, stray root wrapper, wrong child order
+    "<response><ROOT><PACKAGE><VALUE>1</VALUE><CATEGORY>c</CATEGORY><SHORT-NAME>P</SHORT-NAME></PACKAGE></ROOT></response>",
+    # Missing mandatory SHORT-NAME
+    '<ROOT xmlns="urn:test"><PACKAGE><VALUE>1</VALUE></PACKAGE></ROOT>',
+    # Stray nested wrapper
+    '<ROOT xmlns="urn:test"><PACKAGES><PACKAGE><SHORT-NAME>P</SHORT-NAME><VALUE>1</VALUE></PACKAGE></PACKAGES></ROOT>',
+    # Correct root, unqualified and wrong-namespace descendants
+    '<ROOT xmlns="urn:test"><PACKAGE xmlns=""><SHORT-NAME>P</SHORT-NAME><VALUE xmlns="urn:other">1</VALUE></PACKAGE></ROOT>',
+])
+def test_xsd_auto_repairer_fixes_mechanical_errors(package_xsd_schema, broken):
+    assert not validate_xsd(broken, package_xsd_schema)[0]
+
+    fixed = XsdAutoRepairer(content_model_of(package_xsd_schema)).repair(broken)
+
+    assert validate_xsd(fixed, package_xsd_schema) == (True, [])
+
+def test_xsd_auto_repairer_leaves_unfixable_errors(package_xsd_schema):
+    xml = '<ROOT xmlns="urn:test"><PACKAGE><SHORT-NAME>P</SHORT-NAME><VALUE>abc</VALUE></PACKAGE></ROOT>'
+    assert XsdAutoRepairer(content_model_of(package_xsd_schema)).repair(xml) is None
+
+def test_generator_auto_repair_avoids_llm_repair(base_config, mock_llm_client, package_xsd_schema):
+    mock_llm_client.generate_text.return_value = "<ROOT><PACKAGE><VALUE>1</VALUE><SHORT-NAME>P</SHORT-NAME></PACKAGE></ROOT>"
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=package_xsd_schema)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors
+    assert xml.startswith('<ROOT xmlns="urn:test"><PACKAGE><SHORT-NAME>P</SHORT-NAME>')
+    mock_llm_client.generate_text.assert_called_once() # No LLM repair round trip
+
+# --- Tests for repair memoization ---
+
+from src.generation_pipeline.repair import RepairMemo, canonical_xml_hash, error_signature
+
+def test_repair_memo_key_ignores_formatting_and_error_positions():
+    a = '<A x="1" y="2">\n  <B>t</B>\n</A>'
+    b = '<A y="2" x="1"><B>t</B></A>'
+    assert canonical_xml_hash(a) == canonical_xml_hash(b)
+    assert error_signature(["XSD Error: bad (Line: 3, Col: 0)"]) == error_signature(["XSD Error: bad (Line: 9, Col: 4)"])
+    assert RepairMemo.make_key(a, ["e (Line: 1, Col: 1)"]) == RepairMemo.make_key(b, ["e (Line: 2, Col: 5)"])
+    assert RepairMemo.make_key(a, ["e"]) != RepairMemo.make_key(a, ["other"])
+
+def test_repair_memo_key_separates_requirements_models_and_prompt_versions():
+    key = RepairMemo.make_key("<A/>", ["e"], model="m1", prompt_version="v1", requirement_text="req one")
+    assert key != RepairMemo.make_key("<A/>", ["e"], model="m1", prompt_version="v1", requirement_text="req two")
+    assert key != RepairMemo.make_key("<A/>", ["e"], model="m2", prompt_version="v1", requirement_text="req one")
+    assert key != RepairMemo.make_key("<A/>", ["e"], model="m1", prompt_version="v2", requirement_text="req one")
+
+def test_repair_memo_reuses_known_repair(tmp_path, base_config, mock_llm_client, dummy_xsd_schema_gen):
+    invalid_xml = "<MOCK_XML></MOCK_XML>"
+    repaired_xml = "<MOCK_XML><REQUIRED>Repaired</REQUIRED></MOCK_XML>"
+    mock_llm_client.generate_text.side_effect = [invalid_xml, repaired_xml, "<MOCK_XML>\n</MOCK_XML>"]
+    memo = RepairMemo(str(tmp_path / "repairs.sqlite"))
+
+    for _ in range(2):
+        generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+        generator.repair_memo = memo
+        assert generator.generate(REQ_TEXT, PARSED_REQ) == (repaired_xml, [])
+
+    assert mock_llm_client.generate_text.call_count == 3 # Second run: initial generation only
+    reopened = RepairMemo(str(tmp_path / "repairs.sqlite")) # Persisted for later runs
+    assert reopened.store.total_bytes > 0
+
+# --- Tests for skeleton prompts ---
+
+from src.generation_pipeline.skeleton import LEAF_PLACEHOLDER, SkeletonBuilder, element_name_candidates
+
+def test_element_name_candidates():
+    assert element_name_candidates("ComSignal")[0] == "COM-SIGNAL"
+    assert element_name_candidates("ISignal")[0] == "I-SIGNAL"
+    assert element_name_candidates("com signal")[0] == "COM-SIGNAL"
+
+def test_skeleton_contains_mandatory_children_in_order(package_xsd_schema):
+    builder = SkeletonBuilder(content_model_of(package_xsd_schema))
+    assert builder.target_element("Define a package with value 3.", {"entities": []}) == "PACKAGE" # Not the VALUE leaf
+
+    skeleton = builder.skeleton("PACKAGE")
+
+    assert "CATEGORY" not in skeleton # Optional branch left to the LLM
+    assert skeleton.index("SHORT-NAME") < skeleton.index("VALUE")
+    filled = skeleton.replace(LEAF_PLACEHOLDER, "P", 1).replace(LEAF_PLACEHOLDER, "3")
+    assert validate_xsd(filled, package_xsd_schema) == (True, [])
+
+def test_generator_uses_skeleton_prompt(base_config, mock_llm_client, package_xsd_schema):
+    base_config["generation"] = {"skeleton_prompt": True}
+    mock_llm_client.generate_text.return_value = '<ROOT xmlns="urn:test"><PACKAGE><SHORT-NAME>P</SHORT-NAME><VALUE>3</VALUE></PACKAGE></ROOT>'
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=package_xsd_schema)
+
+    xml, errors = generator.generate("Define a Package P with value 3.", PARSED_REQ)
+
+    prompt = mock_llm_client.generate_text.call_args[0][0]
+    assert "<SHORT-NAME>{{VALUE}}</SHORT-NAME>" in prompt
+    assert not errors
+
+# --- Tests for JSON output mode ---
+
+import json
+from src.generation_pipeline.json_output import JSON_RESPONSE_FORMAT, ArxmlJsonSerializer, element_key
+
+def test_json_serializer_writes_schema_order_and_namespace(package_xsd_schema):
+    serializer = ArxmlJsonSerializer(content_model_of(package_xsd_schema))
+    assert element_key("SHORT-NAME") == "shortName"
+
+    xml = serializer.to_xml({"root": {"package": [{"value": 1, "shortName": "A"}, {"shortName": "B", "category": "c", "value": 2}]}})
+
+    assert validate_xsd(xml, package_xsd_schema) == (True, [])
+    assert xml.startswith('<ROOT xmlns="urn:test"><PACKAGE><SHORT-NAME>A</SHORT-NAME><VALUE>1</VALUE></PACKAGE>')
+    assert serializer.to_xml(serializer.from_xml(xml)) == xml
+    assert serializer.parse_response("not json") is None
+    assert serializer.parse_response('{"root": {"": "x"}}') is None
+    assert serializer.parse_response('{" ": {}}') is None
+
+def test_generator_json_output_mode(base_config, mock_llm_client, package_xsd_schema):
+    base_config["generation"] = {"output_format": "json", "skeleton_prompt": True}
+    mock_llm_client.generate_text.return_value = '```json\n{"root": {"package": {"value": 3, "shortName": "P"}}}\n```'
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=package_xsd_schema)
+
+    xml, errors = generator.generate("Define a Package P with value 3.", PARSED_REQ)
+
+    prompt = mock_llm_client.generate_text.call_args[0][0]
+    assert '("root")' in prompt
+    assert json.dumps({"shortName": "{{VALUE}}"})[1:-1] in prompt # Skeleton shown in JSON form
+    assert mock_llm_client.generate_text.call_args.kwargs["response_format"] == JSON_RESPONSE_FORMAT
+    assert not errors
+    assert "<SHORT-NAME>P</SHORT-NAME><VALUE>3</VALUE>" in xml
+
+# --- Tests for fragment-parallel generation ---
+
+from src.generation_pipeline.fragments import plan_fragments
+
+FRAGMENT_REQ = {"text": REQ_TEXT, "entities": [("P1", "Package"), ("P2", "Package"), ("km/h", "UNIT")], "intent": "define"}
+
+def test_plan_fragments_uses_entities_naming_schema_elements(package_xsd_schema):
+    specs = plan_fragments(content_model_of(package_xsd_schema), FRAGMENT_REQ)
+    assert [(s.element, s.name) for s in specs] == [("PACKAGE", "P1"), ("PACKAGE", "P2")]
+    assert plan_fragments(content_model_of(package_xsd_schema), PARSED_REQ) is None
+
+@patch.object(KgEnhancedGenerator, '_query_kg_for_context', return_value="No specific context found.")
+def test_kg_generator_repairs_failing_fragment_alone(mock_query_kg, base_config, mock_llm_client, mock_kg_querier, package_xsd_schema):
+    base_config["generation"] = {"fragment_generation": True}
+    def answer(prompt):
+        if "Incorrect XML" in prompt:
+            return "<PACKAGE><SHORT-NAME>P2</SHORT-NAME><VALUE>2</VALUE></PACKAGE>"
+        if '"P1"' in prompt:
+            return "<PACKAGE><SHORT-NAME>P1</SHORT-NAME><VALUE>1</VALUE></PACKAGE>"
+        return "```xml\n<PACKAGE><SHORT-NAME>P2</SHORT-NAME><VALUE>two</VALUE></PACKAGE>\n```"
+    mock_llm_client.generate_text.side_effect = answer
+    generator = KgEnhancedGenerator(base_config, llm_client=mock_llm_client, kg_querier=mock_kg_querier,
+                                    xsd_schema=package_xsd_schema)
+
+    xml, errors = generator.generate(REQ_TEXT, FRAGMENT_REQ)
+
+    prompts = [c[0][0] for c in mock_llm_client.generate_text.call_args_list]
+    repair_prompts = [p for p in prompts if "Incorrect XML" in p]
+    assert len(prompts) == 3 and len(repair_prompts) == 1
+    assert "P1" not in repair_prompts[0] # Only the failing fragment is repaired
+    assert not errors
+    assert xml.index("P1") < xml.index("P2")
+    assert validate_xsd(xml, package_xsd_schema) == (True, [])
+
+# --- Tests for the adaptive repair policy ---
+
+from src.generation_pipeline.repair_policy import RepairPolicy
+from src.llm_interaction.telemetry import CallStats, track_usage
+
+def run_policy(policy, error_rounds):
+    """Feeds validation results to a repair session; returns the number of repairs granted and the stop reason."""
+    session = policy.start()
+    for errors in error_rounds:
+        if not session.should_repair(errors):
+            break
+    return session.repairs, session.stop_reason
+
+def test_repair_policy_extends_budget_while_errors_decrease():
+    rounds = [["e1", "e2", "e3", "e4"], ["e1", "e2", "e3"], ["e1", "e2"], ["e1"], ["e1"]]
+    assert run_policy(RepairPolicy(max_attempts=2, max_extra_attempts=2), rounds) == (4, "maximum repair rounds reached")
+
+def test_repair_policy_stops_on_oscillation_and_stalls():
+    assert run_policy(RepairPolicy(max_attempts=5), [["a"], ["b"], ["a"]]) == (2, "errors are oscillating")
+    assert run_policy(RepairPolicy(max_attempts=5, patience=0), [["a"], ["b"]])[0] == 1
+
+def test_repair_policy_respects_token_budget():
+    with track_usage() as tracker:
+        tracker.record(CallStats(prompt_tokens=900, completion_tokens=200))
+        assert run_policy(RepairPolicy(token_budget=1000), [["a"]]) == (0, "token budget exhausted")
+
+def test_generator_reports_repair_stop_reason(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    base_config["generation"] = {"repair_policy": {"max_attempts": 5}}
+    mock_llm_client.generate_text.side_effect = ["<MOCK_XML><A/></MOCK_XML>", "<MOCK_XML><B/></MOCK_XML>", "<MOCK_XML><A/></MOCK_XML>"]
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert errors and mock_llm_client.generate_text.call_count == 3 # Not 6: the errors came back
+    assert generator.last_repair_stop_reason == "errors are oscillating"
+
+# --- Tests for tolerant XML extraction and recovery ---
+from src.generation_pipeline.xml_recovery import (
+    XML_MULTIPLE_ROOTS, XML_TRUNCATED, XML_UNBALANCED, diagnose_xml, extract_xml_payload, recover_xml
+)
+
+def test_extract_xml_payload_from_fences_and_prose():
+    fenced = "Here is the document:\n```xml\n<A><B>x</B></A>\n```\nLet me know if you need more."
+    assert extract_xml_payload(fenced) == "<A><B>x</B></A>"
+    assert recover_xml("Sure! <A><B>x</B></A> Hope this helps.") == "<A><B>x</B></A>"
+    assert extract_xml_payload("I cannot help with that.") is None
+
+def test_diagnose_xml_classifies_structural_problems():
+    truncated = diagnose_xml("<A><B>val")
+    assert truncated.kind == XML_TRUNCATED and truncated.open_elements == ["A", "B"]
+    assert truncated.recovered is None # Cut inside text: needs the LLM
+    assert diagnose_xml("<A/><C/>").kind == XML_MULTIPLE_ROOTS
+    assert diagnose_xml("<A><B>x</C></A>").kind == XML_UNBALANCED
+
+def test_recover_xml_fixes_trivial_cases_locally():
+    assert recover_xml("<A><B>x</B>") == "<A><B>x</B></A>" # Only closing tags missing
+    assert recover_xml("<A><B>x</B></A>\n<A><B>x</B></A>") == "<A><B>x</B></A>" # Repeated document
+    assert recover_xml("<A/><C/>") is None
+    assert recover_xml("<A>x</A> and also <B/>") is None # Trailing text with elements goes to the repair
+    assert "further elements" in diagnose_xml("<A>x</A> and also <B/>").message
+
+def test_fenced_output_passes_without_llm_repair(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    mock_llm_client.generate_text.return_value = "```xml\n<MOCK_XML><REQUIRED>x</REQUIRED></MOCK_XML>\n```"
+    generator = XsdConstrainedGenerator(base_config, llm_client=mock_llm_client, xsd_schema=dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors and xml == "<MOCK_XML><REQUIRED>x</REQUIRED></MOCK_XML>"
+    assert mock_llm_client.generate_text.call_count == 1
+
+def test_structure_error_names_the_problem(base_config, mock_llm_client):
+    mock_llm_client.generate_text.return_value = "<MOCK_XML><REQUIRED>x"
+    generator = NaiveGenerator(base_config, llm_client=mock_llm_client)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert xml is None
+    assert "truncated" in errors[0] and "MOCK_XML/REQUIRED" in errors[0]
+
+# --- Tests for the model cascade ---
+from src.generation_pipeline.cascade import requirement_difficulty
+from src.generation_pipeline.generators import CascadeGenerator
+
+def make_cascade(base_config, strong_client, fast_client, xsd_schema):
+    return CascadeGenerator(base_config, fast_llm_client=fast_client, llm_client=strong_client, xsd_schema=xsd_schema)
+
+def test_requirement_difficulty_grows_with_length_and_entities():
+    simple = requirement_difficulty("Define signal VehicleSpeed.", {"entities": [("VehicleSpeed", "ISignal")]})
+    complex_ = requirement_difficulty(" ".join(["word"] * 100), {"entities": [(f"S{i}", "ISignal") for i in range(5)]})
+    assert simple < 0.1 and complex_ == 1.0
+
+def test_cascade_keeps_valid_fast_model_output(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    fast_client = MagicMock(spec=LLMClient)
+    fast_client.generate_text.return_value = "```xml\n<MOCK_XML><REQUIRED>x</REQUIRED></MOCK_XML>\n```"
+    generator = make_cascade(base_config, mock_llm_client, fast_client, dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors and "<REQUIRED>x</REQUIRED>" in xml
+    assert generator.last_model_tier == "fast"
+    mock_llm_client.generate_text.assert_not_called()
+
+def test_cascade_escalates_invalid_fast_output(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    fast_client = MagicMock(spec=LLMClient)
+    fast_client.generate_text.return_value = "<OTHER/>"
+    mock_llm_client.generate_text.return_value = "<MOCK_XML><REQUIRED>strong</REQUIRED></MOCK_XML>"
+    generator = make_cascade(base_config, mock_llm_client, fast_client, dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors and "strong" in xml
+    assert generator.last_model_tier == "strong"
+    assert fast_client.generate_text.call_count == 1 # Fast output is never LLM-repaired
+
+def test_cascade_prompt_budget_fits_the_fast_model(base_config, mock_llm_client):
+    strong = LLMClient({"default_model": "gpt-4o", "max_tokens": 1000}, {})
+    fast = LLMClient({"default_model": "gpt-4", "max_tokens": 1000}, {})
+    generator = CascadeGenerator(base_config, fast_llm_client=fast, llm_client=strong)
+
+    assert generator._prompt_budget() == {"max_prompt_tokens": 8192 - 1000 - 64, "model": "gpt-4"}
+
+def test_cascade_routes_difficult_requirements_to_strong_model(base_config, mock_llm_client, dummy_xsd_schema_gen):
+    base_config["generation"] = {"cascade": {"max_difficulty": 0.0}}
+    fast_client = MagicMock(spec=LLMClient)
+    mock_llm_client.generate_text.return_value = "<MOCK_XML><REQUIRED>strong</REQUIRED></MOCK_XML>"
+    generator = make_cascade(base_config, mock_llm_client, fast_client, dummy_xsd_schema_gen)
+
+    xml, errors = generator.generate(REQ_TEXT, PARSED_REQ)
+
+    assert not errors
+    fast_client.generate_text.assert_not_called()
+
+# --- Tests for retrieved few-shot examples ---
+from src.generation_pipeline.few_shot import FewShotExample, FewShotIndex, tokenize
+
+def write_example(tmp_path, example_id, requirement, xml):
+    (tmp_path / "requirements").mkdir(exist_ok=True)
+    (tmp_path / "ground_truth").mkdir(exist_ok=True)
+    (tmp_path / "requirements" / f"{example_id}.txt").write_text(requirement, encoding="utf-8")
+    (tmp_path / "ground_truth" / f"{example_id}_gold.arxml").write_text(xml, encoding="utf-8")
+
+def test_tokenize_splits_camel_case():
+    assert tokenize("Define ISignal VehicleSpeed") == ["define", "isignal", "signal", "vehiclespeed", "vehicle", "speed"]
+
+def test_few_shot_index_ranks_similar_examples_and_skips_self():
+    index = FewShotIndex()
+    index.add(FewShotExample("r1", "Define signal VehicleSpeed with length 16.", "<A/>"))
+    index.add(FewShotExample("r2", "Create a CAN frame EngineFrame.", "<B/>"))
+    index.add(FewShotExample("r3", "Define signal EngineSpeed with length 8.", "<C/>"))
+
+    results = index.query("Define signal WheelSpeed with length 12.", top_k=2)
+    assert {example.example_id for example, _ in results} == {"r1", "r3"} # Not the CAN frame
+    assert all(example.example_id != "r1" for example, _ in index.query("Define signal VehicleSpeed with length 16."))
+    assert index.query("Completely unrelated words") == []
+
+def test_few_shot_index_leaves_out_the_requirement_id():
+    index = FewShotIndex()
+    index.add(FewShotExample("r1", "Define signal VehicleSpeed with length 16.", "<A/>"))
+    index.add(FewShotExample("r2", "Define signal EngineSpeed with length 8.", "<B/>"))
+
+    # Same requirement, reworded: text equality does not catch it, the id does
+    results = index.query("Please define the signal VehicleSpeed, length 16 bits.", top_k=2, exclude_id="r1")
+    assert [example.example_id for example, _ in results] == ["r2"]
+
+def test_few_shot_index_query_after_removing_every_example():
+    index = FewShotIndex()
+    index.add(FewShotExample("r1", "Define signal VehicleSpeed.", "<A/>"))
+    index.remove("r1")
+    assert index.query("Define signal WheelSpeed.") == [] # Terms stay in the vocabulary, rows are gone
+
+def test_few_shot_index_syncs_incrementally(tmp_path):
+    write_example(tmp_path, "req_1", "Define signal VehicleSpeed.", "<A/>")
+    write_example(tmp_path, "req_2", "Create frame EngineFrame.", "<B/>")
+    index = FewShotIndex()
+    assert index.sync_directory(tmp_path / "ground_truth", tmp_path / "requirements") == 2
+    assert index.sync_directory(tmp_path / "ground_truth", tmp_path / "requirements") == 0 # Nothing changed
+
+    write_example(tmp_path, "req_3", "Define signal EngineSpeed.", "<C/>")
+    (tmp_path / "ground_truth" / "req_2_gold.arxml").unlink()
+    assert index.sync_directory(tmp_path / "ground_truth", tmp_path / "requirements") == 1
+    assert sorted(e.example_id for e in index.examples) == ["req_1", "req_3"]
+
+def test_initial_prompt_includes_retrieved_examples(tmp_path, base_config, mock_llm_client):
+    write_example(tmp_path, "req_1", "Define a MOCK_XML with REQUIRED value gold.", "<MOCK_XML><REQUIRED>gold</REQUIRED></MOCK_XML>")
+    base_config["paths"] = {"ground_truth": str(tmp_path / "ground_truth"), "requirements": str(tmp_path / "requirements")}
+    base_config["generation"] = {"few_shot": {"enabled": True, "top_k": 1}}
+    generator = FullConstrainedGenerator(base_config, llm_client=mock_llm_client)
+
+    prompt = generator.initial_prompt("Define a MOCK_XML with REQUIRED value test.", {})
+
+    assert "=== EXAMPLE 1 ===" in prompt and "<REQUIRED>gold</REQUIRED>" in prompt
+    assert prompt.index("<REQUIRED>gold</REQUIRED>") < prompt.index("REQUIRED value test.") # Examples precede the task
+
+def test_initial_prompt_leaves_out_own_gold_answer(tmp_path, base_config, mock_llm_client):
+    write_example(tmp_path, "req_1", "Define a MOCK_XML with REQUIRED value gold.", "<MOCK_XML><REQUIRED>gold</REQUIRED></MOCK_XML>")
+    base_config["paths"] = {"ground_truth": str(tmp_path / "ground_truth"), "requirements": str(tmp_path / "requirements")}
+    base_config["generation"] = {"few_shot": {"enabled": True, "top_k": 1}}
+    generator = FullConstrainedGenerator(base_config, llm_client=mock_llm_client)
+
+    prompt = generator.initial_prompt("Please define a MOCK_XML whose REQUIRED value is gold.", {"requirement_id": "req_1"})
+
+    assert "<REQUIRED>gold</REQUIRED>" not in prompt
@@ -0,0 +1,595 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock
+
+from src.llm_interaction.llm_client import LLMClient
+
+# --- Test Fixtures ---
+
+def make_response(text: str):
+    """Builds a minimal object shaped like an OpenAI chat completion response."""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+@pytest.fixture
+def llm_config():
+    return {
+        "default_provider": "openai",
+        "default_model": "gpt-test",
+        "temperature": 0.0,
+        "max_tokens": 64,
+        "max_concurrency": 2
+    }
+
+@pytest.fixture
+def llm_client(llm_config):
+    """LLMClient with the real OpenAI clients swapped for mocks (no network)."""
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.return_value = make_response("  <SYNC/>  ")
+    client.async_client = MagicMock()
+    client.async_client.chat.completions.create = AsyncMock(return_value=make_response("<ASYNC/>"))
+    return client
+
+# --- Sync API ---
+
+def test_generate_text_strips_response(llm_client):
+    assert llm_client.generate_text("prompt") == "<SYNC/>"
+    kwargs = llm_client.client.chat.completions.create.call_args.kwargs
+    assert kwargs["model"] == "gpt-test"
+    assert kwargs["max_tokens"] == 64
+
+def test_generate_text_api_error_returns_none(llm_client):
+    llm_client.client.chat.completions.create.side_effect = RuntimeError("boom")
+    assert llm_client.generate_text("prompt") is None
+
+# --- Async API ---
+
+def test_generate_text_async(llm_client):
+    assert asyncio.run(llm_client.generate_text_async("prompt")) == "<ASYNC/>"
+
+def test_generate_many_preserves_order_and_bounds_concurrency(llm_client):
+    in_flight = 0
+    peak = 0
+
+    async def fake_create(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return make_response(kwargs["messages"][0]["content"].upper())
+
+    llm_client.async_client.chat.completions.create = AsyncMock(side_effect=fake_create)
+    results = asyncio.run(llm_client.generate_many([f"p{i}" for i in range(6)]))
+
+    assert results == [f"P{i}" for i in range(6)]
+    assert peak == 2 # max_concurrency from config
+
+def test_generate_many_reports_failures_as_none(llm_client):
+    llm_client.async_client.chat.completions.create = AsyncMock(
+        side_effect=[make_response("<A/>"), RuntimeError("boom")]
+    )
+    results = asyncio.run(llm_client.generate_many(["a", "b"]))
+    assert results == ["<A/>", None]
+
+# --- Response Cache ---
+
+from src.llm_interaction.response_cache import ResponseCache, CacheMissError
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa" # Touch 'a' so 'b' becomes the LRU entry
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    assert cache.total_bytes == 8
+
+def test_response_cache_persists_across_instances(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = ResponseCache(path)
+    cache.put("k", "<X/>")
+    cache.close()
+    assert ResponseCache(path, replay_only=True).get("k") == "<X/>"
+
+def test_llm_client_serves_repeat_prompts_from_cache(llm_config, tmp_path):
+    llm_config["cache"] = {"enabled": True, "path": str(tmp_path / "cache.sqlite")}
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.return_value = make_response("<CACHED/>")
+
+    assert client.generate_text("same prompt") == "<CACHED/>"
+    assert client.generate_text("same prompt") == "<CACHED/>"
+    assert client.client.chat.completions.create.call_count == 1
+
+def test_llm_client_replay_only_fails_on_miss(llm_config, tmp_path):
+    llm_config["cache"] = {"enabled": True, "path": str(tmp_path / "cache.sqlite"), "mode": "replay_only"}
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    with pytest.raises(CacheMissError):
+        client.generate_text("never recorded")
+    client.client.chat.completions.create.assert_not_called()
+
+def test_cache_key_includes_response_format(llm_config, tmp_path):
+    llm_config["cache"] = {"enabled": True, "path": str(tmp_path / "cache.sqlite")}
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = [make_response("<PLAIN/>"), make_response('{"json": 1}')]
+
+    assert client.generate_text("prompt") == "<PLAIN/>"
+    assert client.generate_text("prompt", response_format={"type": "json_object"}) == '{"json": 1}' # Not the cached XML
+    assert client.generate_text("prompt") == "<PLAIN/>"
+    assert client.client.chat.completions.create.call_count == 2
+
+# --- Rate Limiter ---
+
+from src.llm_interaction.rate_limiter import RateLimiter, estimate_tokens, parse_retry_after
+
+class RateLimitedError(Exception):
+    """Stand-in for openai.RateLimitError (status 429 with response headers)."""
+    status_code = 429
+    def __init__(self, retry_after: str):
+        super().__init__("429 Too Many Requests")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after})
+
+def test_rate_limiter_delays_once_bucket_is_empty():
+    limiter = RateLimiter(requests_per_minute=60) # 1 request per second
+    assert limiter.reserve(0) == 0.0
+    for _ in range(59):
+        limiter.reserve(0)
+    assert limiter.reserve(0) == pytest.approx(1.0, abs=0.05)
+
+def test_rate_limiter_tokens_per_minute():
+    limiter = RateLimiter(tokens_per_minute=600) # 10 tokens per second
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(100) == pytest.approx(10.0, abs=0.1)
+
+def test_rate_limiter_backs_off_on_429():
+    limiter = RateLimiter(requests_per_minute=600)
+    assert limiter.record_rate_limited(2.0) == 2.0
+    assert limiter.rate_scale == 0.5
+    assert limiter.reserve(0) == pytest.approx(2.0, abs=0.05)
+
+def test_estimate_tokens_and_retry_after():
+    assert estimate_tokens("x" * 400, 100) == 201
+    assert parse_retry_after({"retry-after": "3"}) == 3.0
+    assert parse_retry_after({"retry-after-ms": "250"}) == 0.25
+    assert parse_retry_after({}) is None
+
+def test_llm_client_retries_after_429(llm_config, monkeypatch):
+    llm_config["rate_limit"] = {"requests_per_minute": 1000, "max_retries": 2}
+    llm_config["default_model"] = "gpt-test-429" # Own shared limiter for this test
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = [RateLimitedError("0"), make_response("<OK/>")]
+    sleeps = []
+    monkeypatch.setattr("src.llm_interaction.llm_client.time.sleep", sleeps.append)
+
+    assert client.generate_text("prompt") == "<OK/>"
+    assert client.client.chat.completions.create.call_count == 2
+    assert client.rate_limiter.throttled_count == 1
+
+def test_llm_client_does_not_back_off_past_the_deadline(llm_config, monkeypatch):
+    llm_config["rate_limit"] = {"requests_per_minute": 1000, "max_retries": 2}
+    llm_config["default_model"] = "gpt-test-429-deadline"
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = [RateLimitedError("30"), make_response("<OK/>")]
+    sleeps = []
+    monkeypatch.setattr("src.llm_interaction.llm_client.time.sleep", sleeps.append)
+
+    assert client.generate_text("prompt", timeout=5) is None # Retry-After 30s > 5s left
+    assert sleeps == []
+    assert client.client.chat.completions.create.call_count == 1
+
+def test_rate_limiter_wait_respects_deadline():
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.record_rate_limited(10.0)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(0, deadline_at=time.monotonic() + 1)
+
+# --- Streaming ---
+
+from src.llm_interaction.xml_stream import XmlStreamMonitor, STREAM_COMPLETE, STREAM_NOT_XML, STREAM_MALFORMED
+
+def make_chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+class FakeStream:
+    """Iterable stream of chunks that records how many were consumed and whether it was closed."""
+    def __init__(self, texts):
+        self.texts = texts
+        self.consumed = 0
+        self.closed = False
+    def __iter__(self):
+        for text in self.texts:
+            self.consumed += 1
+            yield make_chunk(text)
+    def close(self):
+        self.closed = True
+
+def test_stream_monitor_completes_when_root_closes():
+    monitor = XmlStreamMonitor()
+    states = [monitor.feed(c) for c in ["```xml\n<ROOT>", "<A>1</A>", "</RO", "OT>\n```\nExplanation..."]]
+    assert states[-1] == STREAM_COMPLETE
+    assert monitor.text.endswith("</ROOT>")
+
+def test_stream_monitor_detects_prose_and_malformed_xml():
+    prose = XmlStreamMonitor(max_preamble_chars=10)
+    assert prose.feed("I am sorry, but I cannot do that.") == STREAM_NOT_XML
+    broken = XmlStreamMonitor()
+    assert broken.feed("<ROOT><A></B>") == STREAM_MALFORMED
+
+def test_streaming_generate_text_stops_early(llm_config):
+    llm_config["streaming"] = True
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    stream = FakeStream(["<ROOT>", "<A/>", "</ROOT>", " trailing", " tokens", " never", " read"])
+    client.client = MagicMock()
+    client.client.chat.completions.create.return_value = stream
+
+    assert client.generate_text("prompt") == "<ROOT><A/></ROOT>"
+    assert client.client.chat.completions.create.call_args.kwargs["stream"] is True
+    assert stream.consumed == 3
+    assert stream.closed
+
+def test_json_mode_request_is_not_streamed(llm_config):
+    llm_config["streaming"] = True
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.return_value = make_response('{"root": {}}')
+
+    assert client.generate_text("prompt", response_format={"type": "json_object"}) == '{"root": {}}'
+    kwargs = client.client.chat.completions.create.call_args.kwargs
+    assert kwargs["response_format"] == {"type": "json_object"}
+    assert "stream" not in kwargs
+
+# --- Deadlines and Hedging ---
+
+import time
+from src.llm_interaction.deadline import deadline_scope, remaining_time
+
+def test_deadline_scope_nests_and_tightens():
+    assert remaining_time() is None
+    with deadline_scope(10):
+        with deadline_scope(100):
+            assert remaining_time() <= 10
+    assert remaining_time() is None
+
+def test_generate_text_passes_timeout_and_fails_after_deadline(llm_client):
+    with deadline_scope(5):
+        assert llm_client.generate_text("prompt") == "<SYNC/>"
+    assert 0 < llm_client.client.chat.completions.create.call_args.kwargs["timeout"] <= 5
+
+    llm_client.client.chat.completions.create.reset_mock()
+    with deadline_scope(-1): # Budget already spent
+        assert llm_client.generate_text("prompt") is None
+    llm_client.client.chat.completions.create.assert_not_called()
+
+def test_hedged_request_returns_faster_duplicate(llm_config):
+    llm_config["hedging"] = {"enabled": True, "min_samples": 3}
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    for _ in range(3):
+        client._record_latency(0.05) # p95 = 50ms
+
+    calls = []
+    def slow_then_fast(**kwargs):
+        calls.append(kwargs)
+        time.sleep(1.0 if len(calls) == 1 else 0.0)
+        return make_response(f"<R{len(calls)}/>")
+
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = slow_then_fast
+    started = time.monotonic()
+    assert client.generate_text("prompt") == "<R2/>"
+    assert time.monotonic() - started < 0.9
+    assert client.hedged_count == 1
+
+def test_hedged_request_records_losing_attempt_tokens(llm_config):
+    llm_config["hedging"] = {"enabled": True, "min_samples": 3}
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    for _ in range(3):
+        client._record_latency(0.05)
+
+    calls = []
+    def slow_then_fast(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.3 if len(calls) == 1 else 0.0)
+        return make_response(f"<R{len(calls)}/>")
+
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = slow_then_fast
+    with track_usage() as usage:
+        assert client.generate_text("prompt") == "<R2/>"
+        client._hedge_executor.shutdown(wait=True) # Let the losing request finish
+    summary = usage.summary()
+
+    assert summary["llm_calls"] == 2 # The answer and the discarded duplicate
+    assert summary["llm_prompt_tokens"] == 2 * usage.calls[0].prompt_tokens > 0
+    assert summary["llm_busy_s"] < summary["llm_latency_s"] # Overlapping attempts are counted once
+
+# --- Telemetry ---
+
+from src.llm_interaction.telemetry import CallStats, busy_time, track_usage
+
+def test_busy_time_merges_overlapping_calls():
+    calls = [CallStats(started_at=0.0, latency_s=2.0), CallStats(started_at=1.0, latency_s=2.0),
+             CallStats(started_at=5.0, latency_s=1.0), CallStats(latency_s=9.0)] # No start: not placed
+    assert busy_time(calls) == 4.0
+
+def test_track_usage_aggregates_call_stats(llm_client):
+    llm_client.client.chat.completions.create.return_value = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="<A/>"), finish_reason="stop")],
+        usage=SimpleNamespace(prompt_tokens=12, completion_tokens=3)
+    )
+    with track_usage() as usage:
+        llm_client.generate_text("one")
+        llm_client.generate_text("two")
+        asyncio.run(llm_client.generate_text_async("three")) # Mock response without usage -> estimated
+    summary = usage.summary()
+
+    assert summary["llm_calls"] == 3
+    assert summary["llm_failed_calls"] == 0
+    assert summary["llm_prompt_tokens"] >= 24
+    assert summary["llm_completion_tokens"] >= 6
+    assert summary["llm_ttft_mean_s"] is not None
+
+def test_track_usage_counts_failures_and_streaming_ttft(llm_config):
+    llm_config["streaming"] = True
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = [FakeStream(["<A>", "</A>"]), RuntimeError("boom")]
+    with track_usage() as usage:
+        client.generate_text("ok")
+        client.generate_text("fails")
+    assert usage.calls[0].ttft_s is not None
+    assert usage.calls[0].usage_estimated # Stream closed before a usage chunk arrived
+    assert usage.summary()["llm_failed_calls"] == 1
+
+# --- Endpoint Routing ---
+
+from src.llm_interaction.router import LLMRouter, EndpointHealth, create_llm_client
+
+@pytest.fixture
+def router(llm_config):
+    llm_config["endpoints"] = [{"name": "a"}, {"name": "b", "default_model": "gpt-test-b"}]
+    llm_config["routing"] = {"seed": 7, "failure_threshold": 2, "cooldown_s": 60}
+    router = create_llm_client(llm_config, {"openai": "test-key"})
+    for _, client, _ in router.endpoints:
+        client.client = MagicMock()
+    return router
+
+def test_create_llm_client_returns_router_for_endpoint_pool(router, llm_config):
+    assert isinstance(router, LLMRouter)
+    assert [c.model for _, c, _ in router.endpoints] == ["gpt-test", "gpt-test-b"]
+    assert isinstance(create_llm_client({"default_model": "x"}, {"openai": "k"}), LLMClient)
+
+def test_router_fails_over_and_ejects_unhealthy_endpoint(router):
+    (_, client_a, health_a), (_, client_b, _) = router.endpoints
+    client_a.client.chat.completions.create.side_effect = RuntimeError("region down")
+    client_b.client.chat.completions.create.return_value = make_response("<B/>")
+
+    results = [router.generate_text("prompt") for _ in range(6)]
+
+    assert results == ["<B/>"] * 6 # Every request that hit 'a' failed over to 'b'
+    assert client_a.client.chat.completions.create.call_count <= 2 # Never retried once ejected
+    assert health_a.error_ewma > 0
+
+def test_router_stops_failing_over_once_the_deadline_passes(router):
+    def slow_failure(**kwargs):
+        time.sleep(0.06)
+        raise RuntimeError("slow and broken")
+    for _, client, _ in router.endpoints:
+        client.client.chat.completions.create.side_effect = slow_failure
+
+    assert router.generate_text("prompt", timeout=0.05) is None
+
+    calls = sum(client.client.chat.completions.create.call_count for _, client, _ in router.endpoints)
+    assert calls == 1 # No failover after the budget was spent
+    assert all(health.requests == 0 for _, _, health in router.endpoints) # Expiry is not held against the endpoint
+
+def test_router_keeps_prefilled_answers_out_of_endpoint_health(router):
+    for _, client, _ in router.endpoints:
+        client.prefill("prompt", "<PREFILLED/>")
+
+    assert router.generate_text("prompt") == "<PREFILLED/>"
+
+    assert all(health.requests == 0 and health.latency_ewma is None for _, _, health in router.endpoints)
+
+def test_router_endpoints_have_own_rate_limiters(llm_config):
+    llm_config["rate_limit"] = {"requests_per_minute": 100, "tokens_per_minute": 5000}
+    llm_config["endpoints"] = [{"name": "east"}, {"name": "west", "rate_limit": {"requests_per_minute": 10}}]
+    pool = create_llm_client(llm_config, {"openai": "test-key"})
+    (_, east, _), (_, west, _) = pool.endpoints
+
+    assert east.rate_limiter is not west.rate_limiter # Same model, separate quotas
+    assert west.config["rate_limit"] == {"requests_per_minute": 10, "tokens_per_minute": 5000}
+
+def test_endpoint_health_ejects_after_consecutive_failures():
+    health = EndpointHealth("a", failure_threshold=2, cooldown_s=60)
+    health.record(1.0, False)
+    assert health.is_available(time.monotonic())
+    health.record(1.0, False)
+    assert not health.is_available(time.monotonic())
+
+def test_endpoint_health_prefers_fast_reliable_endpoints():
+    fast, slow, flaky = EndpointHealth("fast"), EndpointHealth("slow"), EndpointHealth("flaky")
+    fast.record(0.5, True)
+    slow.record(5.0, True)
+    flaky.record(0.5, True)
+    flaky.record(0.5, False)
+    assert fast.weight() > slow.weight()
+    assert fast.weight() > flaky.weight()
+
+# --- Batch Mode ---
+
+import json
+from src.llm_interaction.batch import LocalBatchBackend, parse_batch_output, write_batch_file
+
+
+def test_batch_file_round_trip_maps_results_by_custom_id(tmp_path, llm_client):
+    job = write_batch_file({"R1::baseline1": "p1", "R2::baseline1": "p2"}, tmp_path / "job.jsonl", llm_client._completion_kwargs)
+    backend = LocalBatchBackend(lambda prompt: None if prompt == "p2" else f"<{prompt}/>")
+    job_id = backend.submit(job)
+
+    results = parse_batch_output(backend.results(job_id))
+
+    assert results == {"R1::baseline1": "<p1/>", "R2::baseline1": None}
+    assert backend.submitted_requests == 2
+
+def test_generate_batch_prefills_interactive_calls(tmp_path, llm_client):
+    backend = LocalBatchBackend(lambda prompt: "<BATCHED/>")
+
+    results = llm_client.generate_batch({"R1::proposed": "prompt"}, str(tmp_path / "job.jsonl"), backend)
+
+    assert results == {"R1::proposed": "<BATCHED/>"}
+    assert llm_client.generate_text("prompt") == "<BATCHED/>"
+    llm_client.client.chat.completions.create.assert_not_called()
+
+def test_prefilled_results_are_served_once(tmp_path, llm_client):
+    answers = iter(["<FIRST/>", "<SECOND/>"])
+    backend = LocalBatchBackend(lambda prompt: next(answers))
+    llm_client.client.chat.completions.create.return_value = make_response("<LIVE/>")
+
+    llm_client.generate_batch({"R1::baseline1": "prompt", "R1::proposed": "prompt"}, str(tmp_path / "job.jsonl"), backend)
+
+    assert [llm_client.generate_text("prompt") for _ in range(3)] == ["<FIRST/>", "<SECOND/>", "<LIVE/>"]
+
+def test_generate_batch_keeps_json_mode(tmp_path, llm_client):
+    job_path = tmp_path / "job.jsonl"
+
+    llm_client.generate_batch({"R1::json": "json prompt", "R1::xml": "xml prompt"}, str(job_path),
+                              LocalBatchBackend(lambda prompt: "{}"), {"R1::json": {"type": "json_object"}})
+
+    bodies = {line["custom_id"]: line["body"] for line in map(json.loads, job_path.read_text().splitlines())}
+    assert bodies["R1::json"]["response_format"] == {"type": "json_object"}
+    assert "response_format" not in bodies["R1::xml"]
+
+# --- Prompt Token Budget ---
+
+from src.llm_interaction.prompt_formatter import format_kg_enhanced_prompt
+from src.llm_interaction.token_budget import count_tokens, fit_context, prompt_token_budget
+
+
+def test_prompt_token_budget_leaves_room_for_completion():
+    assert prompt_token_budget({"default_model": "gpt-4", "max_tokens": 2048}) == 8192 - 2048 - 64
+    assert prompt_token_budget({"default_model": "gpt-4o-mini", "max_tokens": 1000, "prompt_token_budget": 3000}) == 3000
+    assert prompt_token_budget({"default_model": "unknown", "context_window": 1000, "max_tokens": 2000}) == 0
+    assert prompt_token_budget({"default_model": "gpt-4", "max_tokens": 2048}, model="gpt-4o") == 128000 - 2048 - 64
+
+def test_count_tokens_falls_back_when_encoder_cannot_load(monkeypatch):
+    import sys, types
+    from src.llm_interaction import token_budget
+    failing = types.SimpleNamespace(
+        encoding_for_model=MagicMock(side_effect=OSError("no network")), get_encoding=MagicMock(side_effect=OSError("no network"))
+    )
+    monkeypatch.setitem(sys.modules, "tiktoken", failing)
+    token_budget._get_encoder.cache_clear()
+    try:
+        assert count_tokens("x" * 40, "offline-model") == 40 // 4 + 1
+    finally:
+        token_budget._get_encoder.cache_clear()
+
+def test_count_tokens_memoizes_only_short_texts():
+    from src.llm_interaction import token_budget
+    token_budget._count_tokens_memoized.cache_clear()
+
+    count_tokens("<SHORT-NAME>Speed</SHORT-NAME>")
+    count_tokens("x" * (token_budget.TOKEN_MEMO_MAX_CHARS + 1))
+
+    assert token_budget._count_tokens_memoized.cache_info().currsize == 1 # The long prompt is not pinned in memory
+
+def test_fit_context_keeps_most_relevant_lines_within_budget():
+    context = "\n".join([
+        "Context for 'Wiper': unrelated facts about wipers and washers",
+        "Context for 'Speed': VehicleSpeed signal with unit km/h",
+        "Context for 'Door': door lock states",
+    ])
+    trimmed = fit_context(context, "Send the vehicle speed signal", max_tokens=20)
+
+    assert trimmed.splitlines()[0].startswith("Context for 'Speed'")
+    assert count_tokens(trimmed) <= 20
+    assert fit_context(context, "anything", max_tokens=10_000) == context
+
+def test_kg_enhanced_prompt_respects_token_budget():
+    context = "\n".join(f"Context for 'Item{i}': attribute list {'x' * 40}" for i in range(200))
+    prompt = format_kg_enhanced_prompt("Define Item7", context, max_prompt_tokens=300)
+
+    assert count_tokens(prompt) <= 300
+    assert "Define Item7" in prompt
+
+# --- Prompt Templates ---
+
+from src.llm_interaction.prompt_formatter import format_repair_prompt
+from src.llm_interaction.prompt_templates import BASIC_PROMPT, PromptTemplate, templates_fingerprint
+
+
+def test_prompt_template_ids_track_content():
+    original = PromptTemplate("t", 1, "Requirement: ${requirement_text}")
+    edited = PromptTemplate("t", 1, "Requirement:\n${requirement_text}")
+
+    assert original.placeholders == {"requirement_text"}
+    assert original.template_id.startswith("t@v1+")
+    assert original.content_hash != edited.content_hash
+    assert BASIC_PROMPT.template_id == PromptTemplate("basic", 1, BASIC_PROMPT.source).template_id
+    assert len(templates_fingerprint()) == 12
+    with pytest.raises(KeyError):
+        original.render()
+
+def test_repair_prompt_includes_xml_and_errors():
+    prompt = format_repair_prompt("req", "<A>{not a placeholder}</A>", ["XSD Error: bad (Line: 1, Col: 2)"])
+    assert "<A>{not a placeholder}</A>" in prompt
+    assert "- XSD Error: bad (Line: 1, Col: 2)" in prompt
+
+# --- Truncation Continuation ---
+
+from src.llm_interaction.continuation import stitch_continuation, truncated_open_elements
+
+def make_finished_response(text: str, finish_reason: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason=finish_reason)])
+
+def test_truncated_open_elements_and_stitching():
+    assert truncated_open_elements("```xml\n<A><B><C>val") == ["A", "B", "C"]
+    assert truncated_open_elements("<A><B/></A>") is None # Complete
+    assert truncated_open_elements("Sorry, I cannot do that.") is None
+    partial = "<A>\n  <B>first</B>\n  <C>sec"
+    assert stitch_continuation(partial, "```xml\n  <B>first</B>\n  <C>second</C>\n</A>\n```") == \
+        "<A>\n  <B>first</B>\n  <C>second</C>\n</A>"
+
+def test_generate_text_continues_truncated_xml(llm_client):
+    llm_client.client.chat.completions.create.side_effect = [
+        make_finished_response("<A><B>part", "length"),
+        make_finished_response("ial</B><C>x", "length"),
+        make_finished_response("</C></A>", "stop"),
+    ]
+    with track_usage() as tracker:
+        assert llm_client.generate_text("prompt") == "<A><B>partial</B><C>x</C></A>"
+
+    assert len(tracker.calls) == 3 # Each continuation is its own call
+    continuation_prompt = llm_client.client.chat.completions.create.call_args.kwargs["messages"][0]["content"]
+    assert "<A><B>partial</B><C>x" in continuation_prompt and "A > C" in continuation_prompt
+
+def test_continuation_keeps_whitespace_at_the_seam(llm_client):
+    llm_client.client.chat.completions.create.side_effect = [
+        make_finished_response("<A><B>two ", "length"), # Cut right after a space inside the text
+        make_finished_response("words</B></A>\n", "stop"),
+    ]
+    assert llm_client.generate_text("prompt") == "<A><B>two words</B></A>"
+
+def test_generate_text_continuations_are_bounded(llm_config):
+    llm_config["max_continuations"] = 1
+    client = LLMClient(llm_config, {"openai": "test-key"})
+    client.client = MagicMock()
+    client.client.chat.completions.create.side_effect = [
+        make_finished_response("<A><B>x", "length"), make_finished_response("yz", "length"), make_finished_response("</B></A>", "stop")
+    ]
+
+    assert client.generate_text("prompt") == "<A><B>xyz" # Left to the generator's XML recovery / repair
+    assert client.client.chat.completions.create.call_count == 2
+
+def test_json_mode_output_is_not_continued(llm_client):
+    llm_client.client.chat.completions.create.return_value = make_finished_response('{"a":', "length")
+    assert llm_client.generate_text("prompt", response_format={"type": "json_object"}) == '{"a":'
+    assert llm_client.client.chat.completions.create.call_count == 1
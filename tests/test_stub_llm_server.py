@@ -0,0 +1,51 @@
+import json
+import pytest
+
+from experiments.stub_llm_server import StubLLMBackend, StubLLMServer, LatencyModel
+from src.llm_interaction.llm_client import LLMClient
+
+GOLD_XML = "<AUTOSAR><AR-PACKAGES><AR-PACKAGE><SHORT-NAME>Speed</SHORT-NAME></AR-PACKAGE></AR-PACKAGES></AUTOSAR>"
+
+@pytest.fixture
+def stub_server(tmp_path):
+    """Stub server replaying one ground truth answer."""
+    gt_dir = tmp_path / "ground_truth"
+    req_dir = tmp_path / "requirements"
+    gt_dir.mkdir()
+    req_dir.mkdir()
+    (gt_dir / "req_001_gold.arxml").write_text(GOLD_XML, encoding="utf-8")
+    (req_dir / "req_001.txt").write_text("Define a signal named Speed.", encoding="utf-8")
+    backend = StubLLMBackend(ground_truth_dir=str(gt_dir), requirements_dir=str(req_dir), chunk_chars=8, seed=1)
+    server = StubLLMServer(backend).start()
+    yield server
+    server.stop()
+
+def make_client(server, **overrides):
+    config = {"default_provider": "openai", "default_model": "stub", "max_tokens": 512, "base_url": server.base_url}
+    config.update(overrides)
+    return LLMClient(config, {"openai": "stub-key"})
+
+def test_stub_server_replays_ground_truth(stub_server):
+    client = make_client(stub_server)
+    assert client.generate_text('Requirement:\n"Define a signal named Speed."') == GOLD_XML
+
+def test_stub_server_streaming(stub_server):
+    client = make_client(stub_server, streaming=True)
+    assert client.generate_text("Define a signal named Speed.") == GOLD_XML
+
+def test_stub_server_json_mode(stub_server):
+    client = make_client(stub_server)
+    response = client.generate_text("Define a signal named Speed.", response_format={"type": "json_object"})
+    assert json.loads(response) == {"autosar": {"arPackages": {"arPackage": {"shortName": "Speed"}}}}
+
+def test_stub_server_injects_rate_limits(stub_server):
+    stub_server.backend.rate_limit_rate = 1.0
+    client = make_client(stub_server)
+    client.client = client.client.with_options(max_retries=0)
+    assert client.generate_text("Define a signal named Speed.") is None
+
+def test_latency_model_specs():
+    assert LatencyModel("fixed:0.5").sample() == 0.5
+    assert 0.1 <= LatencyModel("uniform:0.1,0.2").sample() <= 0.2
+    with pytest.raises(ValueError):
+        LatencyModel("pareto:1")